@@ -1,20 +1,56 @@
 import os
 import io
+import sys
+import gc
+import signal
+import socket
+import argparse
+import asyncio
 import base64
+import time
+import queue
+import json
+import hashlib
+import zipfile
+import zlib
+import functools
+import itertools
+import threading
 import traceback
+import uuid
+import weakref
+import cProfile
+import pstats
+import marshal
+import multiprocessing
+import tempfile
+import contextlib
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 import pandas as pd
 import numpy as np
-from flask import Flask, request, jsonify, send_from_directory
+from flask import (Flask, Response, request, jsonify, send_from_directory, stream_with_context, url_for,
+                   has_request_context)
 from flask_cors import CORS
+from werkzeug.serving import BaseWSGIServer, WSGIRequestHandler
 from PIL import Image
 import pickle
-import matplotlib
-matplotlib.use('Agg')
-import matplotlib.pyplot as plt
-import seaborn as sns
 from sklearn.linear_model import LinearRegression
 from sklearn.model_selection import train_test_split
 from sklearn.metrics import r2_score, mean_squared_error
+from sklearn.neighbors import BallTree
+import chart_render
+try:
+    import pyarrow as pa
+    import pyarrow.feather as feather
+    import pyarrow.parquet as pq
+except Exception:
+    pa = None
+try:
+    from openpyxl.utils.exceptions import InvalidFileException
+except Exception:
+    InvalidFileException = None
 try:
     import plotly.graph_objs as go
     from plotly.io import to_html
@@ -23,84 +59,442 @@ except Exception:
     def to_html(*args, **kwargs):
         return "<div>Plotly not available on server.</div>"
 try:
-    from tensorflow.keras.models import load_model  
-except Exception: 
-    load_model = None 
+    from pyinstrument import Profiler as PyinstrumentProfiler
+except Exception:
+    PyinstrumentProfiler = None
+try:
+    from gunicorn.app.base import BaseApplication as GunicornApplication
+except Exception:
+    GunicornApplication = None
+try:
+    import uvicorn
+except Exception:
+    uvicorn = None
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
 app = Flask(__name__)
 CORS(app)
 
-def generate_dummy_ocean_data():
-    """Generates a sample DataFrame for oceanographic data."""
+def _dummy_dates(n):
+    """Sampling dates for n rows: one per day up to ten years, then several per day."""
+    days = min(n, 3650)
+    offsets = (np.arange(n) * days // max(n, 1)).astype('timedelta64[D]')
+    return pd.to_datetime(np.datetime64('2023-01-01') + offsets)
+
+
+def generate_dummy_ocean_data(n=100, seed=None):
+    """Generates a sample DataFrame for oceanographic data.
+
+    `seed` makes the data reproducible (the benchmark suite scales `n` up to 1e7). Depth is
+    skewed towards the surface, temperature follows a seasonal cycle and cools with depth,
+    and oxygen falls as temperature rises.
+    """
+    rng = np.random.default_rng(seed)
+    dates = _dummy_dates(n)
+    season = np.sin(2 * np.pi * dates.dayofyear.to_numpy() / 365.25)
+    depth = np.minimum(rng.exponential(12.0, n), 50.0)
+    temperature = 20 + 3 * season - 0.12 * depth + rng.normal(0, 0.8, n)
     data = {
-        'sample_id': range(1, 101),
-        'date': pd.to_datetime(pd.date_range(start='2023-01-01', periods=100, freq='D')),
-        'time': pd.date_range(start='2023-01-01', periods=100, freq='H').strftime('%H:%M'),
-        'lat': np.random.uniform(20, 40, 100),
-        'lon': np.random.uniform(-100, -80, 100),
-        'depth_m': np.random.uniform(0, 50, 100),
-        'temperature_C': np.random.uniform(15, 25, 100) + np.sin(np.linspace(0, 2*np.pi, 100)) * 2,
-        'salinity_PSU': np.random.uniform(30, 35, 100) - np.cos(np.linspace(0, 2*np.pi, 100)) * 1,
-        'oxygen_mgL': np.random.uniform(5, 10, 100),
-        'pH': np.random.uniform(7.5, 8.5, 100)
+        'sample_id': np.arange(1, n + 1),
+        'date': dates,
+        'time': pd.Categorical.from_codes(np.arange(n) % 24, [f'{h:02d}:00' for h in range(24)]),
+        'lat': rng.uniform(20, 40, n),
+        'lon': rng.uniform(-100, -80, n),
+        'depth_m': depth,
+        'temperature_C': temperature,
+        'salinity_PSU': rng.normal(34.5, 0.6, n) - 0.5 * season,
+        'oxygen_mgL': np.clip(14.6 - 0.35 * temperature + rng.normal(0, 0.4, n), 2, 12),
+        'pH': rng.normal(8.05, 0.08, n)
     }
     return pd.DataFrame(data)
 
-def generate_dummy_fisheries_data():
-    """Generates a sample DataFrame for fisheries data."""
-    species = ['Sardina pilchardus', 'Engraulis encrasicolus', 'Merluccius merluccius']
-    life_stages = ['juvenile', 'adult']
+
+def generate_dummy_fisheries_data(n=100, seed=None):
+    """Generates a sample DataFrame for fisheries data.
+
+    Species abundance is skewed, counts are over-dispersed (negative binomial) and the
+    life stage follows from each fish's length relative to its species.
+    """
+    rng = np.random.default_rng(seed)
+    species = np.array(['Sardina pilchardus', 'Engraulis encrasicolus', 'Merluccius merluccius'])
+    mean_length = np.array([160.0, 120.0, 280.0])
+    which = rng.choice(len(species), n, p=[0.5, 0.35, 0.15])
+    length = np.clip(rng.normal(mean_length[which], mean_length[which] * 0.25), 30, 600)
     data = {
-        'sample_id': range(1, 101),
-        'date': pd.to_datetime(pd.date_range(start='2023-01-01', periods=100, freq='D')),
-        'lat': np.random.uniform(20, 40, 100),
-        'lon': np.random.uniform(-100, -80, 100),
-        'species_scientific': np.random.choice(species, 100),
-        'count': np.random.randint(10, 500, 100),
-        'avg_length_mm': np.random.uniform(50, 300, 100),
-        'life_stage': np.random.choice(life_stages, 100)
+        'sample_id': np.arange(1, n + 1),
+        'date': _dummy_dates(n),
+        'lat': rng.uniform(20, 40, n),
+        'lon': rng.uniform(-100, -80, n),
+        'species_scientific': species[which],
+        'count': rng.negative_binomial(2, 2 / (2 + 120.0), n) + 10,
+        'avg_length_mm': length,
+        'life_stage': np.where(length < mean_length[which] * 0.8, 'juvenile', 'adult')
     }
     return pd.DataFrame(data)
 
 MODEL_PATH = 'otolith_classifier.h5'
-model = None
 SPECIES_LABELS = ['Sardina pilchardus', 'Engraulis encrasicolus', 'Merluccius merluccius']
 
 FISH_MODEL_PKL = 'model-fish.pkl'
 OCEAN_MODEL_PKL = 'model-ocean.pkl'
-fish_model = None
-ocean_model = None
 
-if os.path.exists(MODEL_PATH) and load_model is not None:
-    try:
-        model = load_model(MODEL_PATH)
-        print("Pre-trained model loaded successfully.")
-    except Exception as e:
-        print(f"Error loading model: {str(e)}")
-else:
-    if load_model is None:
-        print("Warning: TensorFlow not available. AI prediction API will be unavailable.")
-    else:
-        print("Warning: 'otolith_classifier.h5' not found. AI prediction API will be unavailable.")
+# --- Model registry ---
+MODEL_RELOAD_INTERVAL = float(os.environ.get('MODEL_RELOAD_INTERVAL', '5'))
+MODEL_LOAD_TIMEOUT = float(os.environ.get('MODEL_LOAD_TIMEOUT', '120'))
+MODEL_PRELOAD = [n for n in os.environ.get('MODEL_PRELOAD', 'fish,ocean').split(',') if n]
 
-if os.path.exists(FISH_MODEL_PKL):
+
+def _rss_bytes() -> int:
+    """Resident set size of this process, or 0 where /proc is unavailable."""
     try:
-        with open(FISH_MODEL_PKL, 'rb') as f:
-            fish_model = pickle.load(f)
-        print("Fish model loaded from model-fish.pkl")
-    except Exception as e:
-        print(f"Error loading fish model: {e}")
-else:
-    print("Info: 'model-fish.pkl' not found.")
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except Exception:
+        return 0
+
+
+class _ModelEntry:
+    def __init__(self, name, path, loader, warmup=None):
+        self.name = name
+        self.path = path
+        self.loader = loader
+        self.warmup = warmup
+        self.obj = None
+        self.mtime = None
+        self.failed_mtime = None
+        self.loading = None
+        self.checked = 0.0
+        self.error = None
+        self.stats = {}
+
+
+class _ModelRegistry:
+    """Loads models on first use in a background thread and hot-reloads them when the file changes.
+
+    A reload builds and warms the new model before swapping it in, so requests keep
+    using the previous version until the new one is ready.
+    """
+
+    def __init__(self, check_interval=MODEL_RELOAD_INTERVAL):
+        self.check_interval = check_interval
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def register(self, name, path, loader, warmup=None):
+        self._entries[name] = _ModelEntry(name, path, loader, warmup)
+
+    def get(self, name, wait=MODEL_LOAD_TIMEOUT):
+        """Return the loaded model, waiting up to `wait` seconds for a first load; None if unavailable."""
+        entry = self._entries[name]
+        self._check(entry)
+        loading = entry.loading
+        if entry.obj is None and loading is not None and wait:
+            loading.wait(wait)
+        return entry.obj
 
-if os.path.exists(OCEAN_MODEL_PKL):
+    def version(self, name):
+        """mtime of the model file currently loaded under `name`, for keying caches on it."""
+        return self._entries[name].mtime
+
+    def preload(self, names, wait=0):
+        """Start loading `names` now, re-checking their files; with `wait`, block up to that many seconds."""
+        entries = [self._entries[name] for name in names if name in self._entries]
+        for entry in entries:
+            entry.checked = 0.0
+            self._check(entry)
+        if wait:
+            for entry in entries:
+                loading = entry.loading
+                if loading is not None:
+                    loading.wait(wait)
+
+    def _check(self, entry):
+        now = time.monotonic()
+        if entry.obj is not None and now - entry.checked < self.check_interval:
+            return
+        entry.checked = now
+        try:
+            mtime = os.path.getmtime(entry.path)
+        except OSError:
+            if entry.obj is None:
+                entry.error = f"'{entry.path}' not found."
+            return
+        if mtime == entry.mtime or mtime == entry.failed_mtime:
+            return
+        with self._lock:
+            if entry.loading is not None:
+                return
+            entry.loading = threading.Event()
+        threading.Thread(target=self._load, args=(entry, mtime), name=f'load-{entry.name}', daemon=True).start()
+
+    def _load(self, entry, mtime):
+        done = entry.loading
+        rss_before = _rss_bytes()
+        t0 = time.perf_counter()
+        try:
+            obj = entry.loader(entry.path)
+            t1 = time.perf_counter()
+            if entry.warmup is not None:
+                try:
+                    entry.warmup(obj)
+                except Exception as e:
+                    print(f"Warm-up of {entry.name} model failed: {e}")
+            t2 = time.perf_counter()
+            with self._lock:
+                entry.obj = obj
+                entry.mtime = mtime
+                entry.error = None
+                entry.stats = {
+                    'load_seconds': round(t1 - t0, 3),
+                    'warmup_seconds': round(t2 - t1, 3),
+                    'rss_delta_bytes': max(0, _rss_bytes() - rss_before),
+                    'file_bytes': os.path.getsize(entry.path),
+                    'loaded_at': time.time(),
+                }
+            print(f"{entry.name} model loaded from {entry.path} in {t1 - t0:.2f}s")
+        except Exception as e:
+            entry.error = str(e)
+            entry.failed_mtime = mtime
+            print(f"Error loading {entry.name} model: {e}")
+        finally:
+            with self._lock:
+                entry.loading = None
+            done.set()
+
+    def stats(self):
+        return {
+            name: {
+                'path': e.path,
+                'loaded': e.obj is not None,
+                'loading': e.loading is not None,
+                'mtime': e.mtime,
+                'error': e.error,
+                **e.stats,
+            }
+            for name, e in self._entries.items()
+        }
+
+
+def _load_keras_model(path):
+    # TensorFlow is imported here so workers that never classify images don't pay for it.
+    from tensorflow.keras.models import load_model
+    return load_model(path)
+
+
+def _load_pickle_model(path):
+    with open(path, 'rb') as f:
+        return pickle.load(f)
+
+
+model_registry = _ModelRegistry()
+model_registry.register('otolith', MODEL_PATH, _load_keras_model,
+                        warmup=lambda m: m.predict(np.zeros((1, 128, 128, 3), dtype=np.float32)))
+model_registry.register('fish', FISH_MODEL_PKL, _load_pickle_model,
+                        warmup=lambda m: _safe_predict(m, np.zeros((1, 5))))
+model_registry.register('ocean', OCEAN_MODEL_PKL, _load_pickle_model,
+                        warmup=lambda m: _safe_predict(m, np.zeros((1, 5))))
+
+
+@app.route('/api/models', methods=['GET'])
+def model_stats():
+    return jsonify(model_registry.stats())
+
+# --- Content-addressed result cache ---
+RESULT_CACHE_MAX_BYTES = int(os.environ.get('RESULT_CACHE_MAX_MB', '256')) * 1024 * 1024
+RESULT_CACHE_DIR = os.environ.get('RESULT_CACHE_DIR') or None
+RESULT_CACHE_DISK_MAX_BYTES = int(os.environ.get('RESULT_CACHE_DISK_MAX_MB', '1024')) * 1024 * 1024
+# Bump when the shape of cached responses changes so old disk entries are ignored.
+RESULT_CACHE_VERSION = 1
+
+
+def _source_version():
+    """APP_VERSION if set, else a short hash of this module's source."""
+    version = os.environ.get('APP_VERSION')
+    if version:
+        return version
     try:
-        with open(OCEAN_MODEL_PKL, 'rb') as f:
-            ocean_model = pickle.load(f)
-        print("Ocean model loaded from model-ocean.pkl")
-    except Exception as e:
-        print(f"Error loading ocean model: {e}")
-else:
-    print("Info: 'model-ocean.pkl' not found.")
+        with open(__file__, 'rb') as f:
+            return hashlib.sha256(f.read()).hexdigest()[:12]
+    except OSError:
+        return 'unknown'
+
+
+APP_VERSION = _source_version()
+
+
+class _ResultCache:
+    """Size-bounded LRU of serialized JSON responses with an optional on-disk tier.
+
+    Keys hash the upload together with the code version and the settings that
+    shape responses, so a restart after an upgrade or config change misses
+    instead of serving stale bodies. The disk tier is capped at
+    disk_max_bytes; hits refresh a file's mtime and the oldest files are
+    pruned first.
+    """
+
+    def __init__(self, max_bytes, disk_dir=None, disk_max_bytes=None):
+        self.max_bytes = max_bytes
+        self.disk_dir = disk_dir
+        self.disk_max_bytes = disk_max_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._disk_bytes = 0
+        self._lock = threading.Lock()
+        self.hits = self.disk_hits = self.misses = self.disk_evictions = 0
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+            self._disk_bytes = sum(size for _, size, _ in self._disk_entries())
+
+    def _disk_path(self, key):
+        return os.path.join(self.disk_dir, f'{key}.json')
+
+    def _disk_entries(self):
+        """(mtime, size, path) for every cached file; other workers may write too."""
+        entries = []
+        with os.scandir(self.disk_dir) as it:
+            for entry in it:
+                if not entry.name.endswith('.json'):
+                    continue
+                try:
+                    st = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, entry.path))
+        return entries
+
+    def _prune_disk(self):
+        """Delete least recently used files until the disk tier fits its cap."""
+        entries = sorted(self._disk_entries())
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= self.disk_max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+            with self._lock:
+                self.disk_evictions += 1
+        with self._lock:
+            self._disk_bytes = total
+
+    def get(self, key):
+        with self._lock:
+            body = self._entries.get(key)
+            if body is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return body
+        path = self._disk_path(key) if self.disk_dir else None
+        if path and os.path.exists(path):
+            try:
+                with open(path, 'rb') as f:
+                    body = f.read()
+                os.utime(path)
+            except FileNotFoundError:
+                # Pruned by another worker between the check and the read.
+                body = None
+        if path and body is not None:
+            with self._lock:
+                self.disk_hits += 1
+            self._remember(key, body)
+            return body
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key, body: bytes):
+        self._remember(key, body)
+        if self.disk_dir:
+            if self.disk_max_bytes is not None and len(body) > self.disk_max_bytes:
+                return
+            tmp = f'{self._disk_path(key)}.{os.getpid()}.{threading.get_ident()}.tmp'
+            with open(tmp, 'wb') as f:
+                f.write(body)
+            os.replace(tmp, self._disk_path(key))
+            with self._lock:
+                self._disk_bytes += len(body)
+                over = self.disk_max_bytes is not None and self._disk_bytes > self.disk_max_bytes
+            if over:
+                self._prune_disk()
+
+    def _remember(self, key, body):
+        if len(body) > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= len(old)
+            self._entries[key] = body
+            self._bytes += len(body)
+            while self._bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= len(evicted)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+                'disk_dir': self.disk_dir,
+                'disk_bytes': self._disk_bytes,
+                'disk_max_bytes': self.disk_max_bytes,
+                'disk_evictions': self.disk_evictions,
+            }
+
+
+result_cache = _ResultCache(RESULT_CACHE_MAX_BYTES, RESULT_CACHE_DIR, RESULT_CACHE_DISK_MAX_BYTES)
+
+
+def _result_cache_salt():
+    """Code and config that change response bodies without changing the upload."""
+    return [RESULT_CACHE_VERSION, APP_VERSION, QC_MODE, CHART_MAX_POINTS]
+
+
+def _upload_cache_key(file) -> str:
+    """Hash the uploaded bytes together with the route and request parameters."""
+    h = hashlib.sha256()
+    stream = file.stream
+    for block in iter(lambda: stream.read(1 << 20), b''):
+        h.update(block)
+    stream.seek(0)
+    params = sorted((k, v) for k, v in list(request.args.items()) + list(request.form.items()))
+    h.update(json.dumps([request.path, params, _result_cache_salt()]).encode('utf-8'))
+    return h.hexdigest()
+
+
+def _cache_upload_result(view):
+    """Serve repeat uploads of the same file to `view` straight from result_cache."""
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        file = request.files.get('file')
+        if file is None or file.filename == '':
+            return view(*args, **kwargs)
+        key = _upload_cache_key(file)
+        body = result_cache.get(key)
+        if body is not None:
+            resp = app.response_class(body, mimetype='application/json')
+            resp.headers['X-Cache'] = 'HIT'
+            return resp
+        resp = app.make_response(view(*args, **kwargs))
+        if resp.status_code == 200 and resp.mimetype == 'application/json':
+            result_cache.put(key, resp.get_data())
+        resp.headers['X-Cache'] = 'MISS'
+        return resp
+    return wrapper
+
+
+@app.route('/api/cache_stats', methods=['GET'])
+def cache_stats():
+    return jsonify(result_cache.stats())
+
 
 @app.route('/api/oceanographic_data', methods=['POST'])
 def process_ocean_data():
@@ -110,56 +504,91 @@ def process_ocean_data():
     try:
         if 'file' in request.files and request.files['file'].filename != '':
             file = request.files['file']
-            if file.filename.endswith('.csv'):
-                df = pd.read_csv(file)
-            elif file.filename.endswith('.xlsx'):
-                df = pd.read_excel(file)
-            else:
-                return jsonify({"error": "Unsupported file type. Please upload a CSV or Excel file."}), 400
+            if _upload_format(file) is None:
+                return jsonify({"error": UNSUPPORTED_UPLOAD}), 400
+            df = _read_upload(file)
         else:
             df = generate_dummy_ocean_data()
 
         for col in ['temperature_C', 'salinity_PSU', 'oxygen_mgL', 'pH', 'depth_m']:
             if col in df.columns:
                 df[col] = pd.to_numeric(df[col], errors='coerce')
+        # Flag before filling, so imputed values still show up as missing. The screen runs on
+        # the schema-normalized view, so aliased headers are checked too.
+        qc = _QualityControl() if _qc_mode() else None
+        if qc:
+            screened = qc.screen(_normalize_ocean_columns(df))
+            if _qc_flag_columns():
+                for col in qc.flag_columns(screened) + ['qc_duplicate']:
+                    df[col] = screened[col].to_numpy()
+        for col in ['temperature_C', 'salinity_PSU', 'oxygen_mgL', 'pH', 'depth_m']:
+            if col in df.columns:
                 df[col] = df[col].fillna(df[col].mean())
-        
+
         if 'date' in df.columns:
-            df['date'] = df['date'].dt.strftime('%Y-%m-%d')
+            df['date'] = pd.to_datetime(df['date'], errors='coerce').dt.strftime('%Y-%m-%d')
         if 'time' in df.columns:
             df['time'] = df['time'].astype(str)
-            
-        return jsonify(df.to_dict(orient='records'))
 
+        stream_mode = _stream_mode()
+        if stream_mode:
+            response = _streamed_response(_iter_json_rows(df), stream_mode)
+        else:
+            response = jsonify(df.to_dict(orient='records'))
+        if qc:
+            response.headers['X-QC-Summary'] = json.dumps(qc.summary(), separators=(',', ':'))
+        return response
+
+    except _UploadParseError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         return jsonify({"error": f"An error occurred: {str(e)}"}), 500
 
 @app.route('/api/fisheries_data', methods=['POST'])
 def process_fisheries_data():
     """
-    Handles data upload, cleaning, and returns processed fisheries data,
-    simulating a cross-domain join with oceanographic data.
+    Handles data upload, cleaning, and returns processed fisheries data joined to the
+    nearest oceanographic sample within max_km and max_hours (see _spatiotemporal_join).
+    Ocean data comes from ocean_dataset_id or an 'ocean_file' upload, and an uploaded
+    file without either is rejected with 400; the demo data is joined against the demo
+    ocean data.
     """
     try:
-        if 'file' in request.files and request.files['file'].filename != '':
-            file = request.files['file']
-            if file.filename.endswith('.csv'):
-                df = pd.read_csv(file)
-            elif file.filename.endswith('.xlsx'):
-                df = pd.read_excel(file)
-            else:
-                return jsonify({"error": "Unsupported file type. Please upload a CSV or Excel file."}), 400
+        ocean, error = _join_ocean_source(demo=not _has_data_source())
+        if error:
+            return error
+        if ocean is None:
+            return jsonify({"error": "No ocean data to join against: send an ocean_file upload or an ocean_dataset_id."}), 400
+
+        if _has_data_source():
+            chunks, error = _request_chunks('fisheries')
+            if error:
+                return error
+            parts = list(chunks)
+            df = pd.concat(parts, ignore_index=True) if parts else _normalize_fisheries_columns(pd.DataFrame())
         else:
             df = generate_dummy_fisheries_data()
-            
-        df['temperature_C'] = np.random.uniform(15, 25, len(df))
-        df['salinity_PSU'] = np.random.uniform(30, 35, len(df))
 
-        if 'date' in df.columns:
-            df['date'] = df['date'].dt.strftime('%Y-%m-%d')
-            
-        return jsonify(df.to_dict(orient='records'))
+        df['date'] = pd.to_datetime(df['date'], errors='coerce')
+        df, stats = _spatiotemporal_join(
+            df, ocean,
+            max_km=request.values.get('max_km', JOIN_MAX_KM, type=float),
+            max_hours=request.values.get('max_hours', JOIN_MAX_HOURS, type=float))
 
+        df['date'] = df['date'].dt.strftime('%Y-%m-%d')
+
+        stream_mode = _stream_mode()
+        if stream_mode:
+            resp = _streamed_response(_iter_json_rows(df), stream_mode)
+        else:
+            # Unmatched hauls carry NaN, which must go out as null to stay valid JSON.
+            records = _json_records(df)
+            resp = jsonify({"records": records, "join": stats} if request.values.get('with_stats') else records)
+        resp.headers['X-Join-Coverage'] = json.dumps(stats)
+        return resp
+
+    except _UploadParseError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         return jsonify({"error": f"An error occurred: {str(e)}"}), 500
 
@@ -167,7 +596,9 @@ def process_fisheries_data():
 def predict_species():
     """
     Accepts an image, pre-processes it, and uses the AI model to predict the species.
+    Concurrent requests are coalesced into a single model.predict call by the batcher.
     """
+    model = model_registry.get('otolith')
     if model is None:
         return jsonify({"error": "AI model not available. Please train and save 'otolith_classifier.h5'."}), 503
 
@@ -176,63 +607,303 @@ def predict_species():
             return jsonify({"error": "No image file provided."}), 400
         
         file = request.files['image']
-        img = Image.open(io.BytesIO(file.read())).convert('RGB')
-        img = img.resize((128, 128))
-        img_array = np.array(img) / 255.0
-        img_array = np.expand_dims(img_array, axis=0)
-        
-        predictions = model.predict(img_array)[0]
-        
-        predicted_class_index = np.argmax(predictions)
-        predicted_species = SPECIES_LABELS[predicted_class_index]
-        confidence = float(predictions[predicted_class_index])
-        
-        return jsonify({
-            "predicted_species": predicted_species,
-            "confidence": confidence
-        })
+        data = file.read()
+        key = _species_cache_key(data)
+        cached = result_cache.get(key)
+        if cached is not None:
+            return jsonify(json.loads(cached))
+        img_array = _preprocess_otolith(data)
+        result = _species_result(_get_species_batcher().submit(img_array))
+        result_cache.put(key, json.dumps(result).encode('utf-8'))
+        return jsonify(result)
+
+    except Exception as e:
+        return jsonify({"error": f"An error occurred during prediction: {str(e)}"}), 500
+
+
+@app.route('/api/predict_species_batch', methods=['POST'])
+def predict_species_batch():
+    """
+    Accepts several images (multipart list under 'images', e.g. a folder upload) and/or
+    zip archives of images, and classifies them in batches of SPECIES_BATCH_MAX.
+    """
+    model = model_registry.get('otolith')
+    if model is None:
+        return jsonify({"error": "AI model not available. Please train and save 'otolith_classifier.h5'."}), 503
+
+    try:
+        files = request.files.getlist('images') + request.files.getlist('archive')
+        if not files:
+            return jsonify({"error": "No images provided. Send files under 'images' or a zip under 'archive'."}), 400
+
+        results = _classify_images(model, _iter_uploaded_images(files))
+        return jsonify({"results": results, "count": len(results)})
 
     except Exception as e:
         return jsonify({"error": f"An error occurred during prediction: {str(e)}"}), 500
 
+
+OTOLITH_SIZE = (128, 128)
+SPECIES_DECODE_WORKERS = int(os.environ.get('SPECIES_DECODE_WORKERS', str(os.cpu_count() or 2)))
+
+
+def _preprocess_otolith(data: bytes, out: np.ndarray = None) -> np.ndarray:
+    """Decode image bytes into a (128, 128, 3) float32 array scaled to [0, 1].
+
+    JPEGs are decoded in draft mode, letting libjpeg scale by up to 1/8 during the
+    DCT instead of decoding the full-resolution microscope image. `out`, if given,
+    is filled in place (e.g. one slot of a batch buffer).
+    """
+    img = Image.open(io.BytesIO(data))
+    if img.format == 'JPEG':
+        img.draft('RGB', OTOLITH_SIZE)
+    img = img.convert('RGB').resize(OTOLITH_SIZE, reducing_gap=3.0)
+    if out is None:
+        out = np.empty(OTOLITH_SIZE[::-1] + (3,), dtype=np.float32)
+    np.multiply(np.asarray(img, dtype=np.uint8), np.float32(1 / 255.0), out=out)
+    return out
+
+
+def _species_cache_key(data: bytes) -> str:
+    """Content hash of an image plus the loaded classifier version, for result_cache."""
+    h = hashlib.sha256(data)
+    h.update(f"otolith:{model_registry.version('otolith')}".encode('utf-8'))
+    return h.hexdigest()
+
+
+_decode_pool = None
+_decode_pool_lock = threading.Lock()
+
+
+def _get_decode_pool() -> ThreadPoolExecutor:
+    global _decode_pool
+    with _decode_pool_lock:
+        if _decode_pool is None:
+            _decode_pool = ThreadPoolExecutor(max_workers=SPECIES_DECODE_WORKERS, thread_name_prefix='decode')
+        return _decode_pool
+
+
+def _classify_images(model, images) -> list:
+    """Classify (filename, bytes) pairs in batches of SPECIES_BATCH_MAX.
+
+    Cached and duplicate images skip inference. The rest are decoded on the decode
+    thread pool straight into one of two preallocated float32 batch buffers, so the
+    next batch decodes while the model runs on the current one.
+    """
+    results, todo, waiting = [], OrderedDict(), {}
+    for name, data in images:
+        key = _species_cache_key(data)
+        results.append({"filename": name})
+        cached = result_cache.get(key)
+        if cached is not None:
+            results[-1].update(json.loads(cached))
+        elif key in todo:
+            waiting[key].append(len(results) - 1)
+        else:
+            todo[key] = data
+            waiting[key] = [len(results) - 1]
+
+    keys = list(todo)
+    batches = [keys[i:i + SPECIES_BATCH_MAX] for i in range(0, len(keys), SPECIES_BATCH_MAX)]
+    buffers = [np.empty((SPECIES_BATCH_MAX,) + OTOLITH_SIZE[::-1] + (3,), dtype=np.float32) for _ in range(2)]
+    pool = _get_decode_pool()
+
+    def decode(batch, buf):
+        return [pool.submit(_preprocess_otolith, todo[key], buf[i]) for i, key in enumerate(batch)]
+
+    pending = decode(batches[0], buffers[0]) if batches else None
+    for b, batch in enumerate(batches):
+        buf, futures = buffers[b % 2], pending
+        ok = []
+        for i, (key, future) in enumerate(zip(batch, futures)):
+            try:
+                future.result()
+                ok.append(i)
+            except Exception as e:
+                for slot in waiting[key]:
+                    results[slot]["error"] = f"Could not decode image: {str(e)}"
+        pending = decode(batches[b + 1], buffers[(b + 1) % 2]) if b + 1 < len(batches) else None
+        if not ok:
+            continue
+        _job_stage('predict', len(ok))
+        predictions = model.predict(buf[:len(batch)] if len(ok) == len(batch) else buf[ok])
+        for i, row in zip(ok, predictions):
+            result = _species_result(row)
+            result_cache.put(batch[i], json.dumps(result).encode('utf-8'))
+            for slot in waiting[batch[i]]:
+                results[slot].update(result)
+    return results
+
+
+def _species_result(predictions) -> dict:
+    predicted_class_index = int(np.argmax(predictions))
+    return {
+        "predicted_species": SPECIES_LABELS[predicted_class_index],
+        "confidence": float(predictions[predicted_class_index])
+    }
+
+
+def _iter_uploaded_images(files):
+    """Yield (filename, bytes) for uploaded images, expanding zip archives."""
+    for file in files:
+        if file.filename.lower().endswith('.zip'):
+            with zipfile.ZipFile(file) as zf:
+                for info in zf.infolist():
+                    if info.is_dir() or info.filename.startswith('__MACOSX/'):
+                        continue
+                    yield info.filename, zf.read(info)
+        else:
+            yield file.filename, file.read()
+
+
+# --- Micro-batching for otolith inference ---
+SPECIES_BATCH_MAX = int(os.environ.get('SPECIES_BATCH_MAX', '32'))
+SPECIES_BATCH_WAIT_MS = float(os.environ.get('SPECIES_BATCH_WAIT_MS', '10'))
+
+
+class _PendingPrediction:
+    __slots__ = ('array', 'done', 'result', 'error')
+
+    def __init__(self, array):
+        self.array = array
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class _PredictBatcher:
+    """Coalesces concurrent single-sample predictions into one batched predict call.
+
+    The worker thread takes the first queued request, then keeps collecting until
+    `max_batch` requests are queued or `max_wait` seconds have passed, runs
+    `predict_fn` once on the stacked array and hands each caller its own row.
+    """
+
+    def __init__(self, predict_fn, max_batch=32, max_wait=0.01):
+        self.predict_fn = predict_fn
+        self.max_batch = max(1, int(max_batch))
+        self.max_wait = max(0.0, float(max_wait))
+        self._buffer = None
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name='predict-batcher', daemon=True)
+        self._thread.start()
+
+    def submit(self, array: np.ndarray) -> np.ndarray:
+        pending = _PendingPrediction(array)
+        self._queue.put(pending)
+        pending.done.wait()
+        if pending.error is not None:
+            raise pending.error
+        return pending.result
+
+    def _collect(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            try:
+                batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _stack(self, arrays):
+        """Copy the samples into a batch buffer that is allocated once and reused."""
+        first = arrays[0]
+        if self._buffer is None or self._buffer.shape[1:] != first.shape or self._buffer.dtype != first.dtype:
+            self._buffer = np.empty((self.max_batch,) + first.shape, dtype=first.dtype)
+        batch = self._buffer[:len(arrays)]
+        for row, array in zip(batch, arrays):
+            row[...] = array
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            try:
+                outputs = self.predict_fn(self._stack([p.array for p in batch]))
+                for pending, row in zip(batch, outputs):
+                    pending.result = row
+            except Exception as e:
+                for pending in batch:
+                    pending.error = e
+            finally:
+                for pending in batch:
+                    pending.done.set()
+
+
+_species_batcher = None
+_species_batcher_lock = threading.Lock()
+
+
+def _get_species_batcher() -> _PredictBatcher:
+    global _species_batcher
+    with _species_batcher_lock:
+        if _species_batcher is None:
+            _species_batcher = _PredictBatcher(lambda X: model_registry.get('otolith').predict(X), SPECIES_BATCH_MAX,
+                                               SPECIES_BATCH_WAIT_MS / 1000.0)
+        return _species_batcher
+
 @app.route('/api/predict_fish', methods=['POST'])
 def predict_fish():
     """Predict using fish model (model-fish.pkl). Accepts JSON {features:[...]},
     or CSV/Excel file under 'file'. Returns predictions array."""
+    fish_model = model_registry.get('fish')
     if fish_model is None:
         return jsonify({"error": "Fish model not available."}), 503
 
     try:
-        if 'file' in request.files and request.files['file'].filename != '':
-            file = request.files['file']
-            if file.filename.endswith('.csv'):
-                df = pd.read_csv(file)
-            elif file.filename.endswith('.xlsx'):
-                df = pd.read_excel(file)
-            else:
-                return jsonify({"error": "Unsupported file type. Upload CSV/XLSX."}), 400
-
-            df = _normalize_ocean_columns(df)
+        if _has_data_source():
+            chunks, error = _request_chunks('ocean')
+            if error:
+                return error
 
             required_features = ['temperature_C', 'salinity_PSU', 'oxygen_mgL', 'pH', 'depth_m']
-            missing = [f for f in required_features if f not in df.columns]
-            if missing:
-                return jsonify({"error": f"Missing required columns: {missing}"}), 400
+            stream_mode = _stream_mode()
+            if stream_mode:
+                # Predictions are computed and sent one upload chunk at a time, once the
+                # first chunk shows the upload has the features.
+                first, chunks = _peek_chunks(chunks)
+                missing = _unusable_columns(first, required_features) if first is not None else []
+                if missing:
+                    return jsonify({"error": f"Missing required columns: {missing}"}), 400
+                throughput = _Throughput()
+
+                def prediction_rows():
+                    for chunk in chunks:
+                        _job_stage('predict', len(chunk))
+                        preds = throughput.predict(fish_model, _feature_matrix(chunk, required_features))
+                        yield [_json_dumps(v) for v in _json_values(preds)]
+
+                return _streamed_response(prediction_rows(), stream_mode, prefix='{"predictions": ',
+                                          suffix=lambda: f', "count": {throughput.rows}, '
+                                                         f'"throughput": {_json_dumps(throughput.stats())}}}')
+
+            parts = []
+            throughput = _Throughput()
+            for chunk in chunks:
+                missing = _unusable_columns(chunk, required_features)
+                if missing:
+                    return jsonify({"error": f"Missing required columns: {missing}"}), 400
+                _job_stage('predict', len(chunk))
+                parts.append(throughput.predict(fish_model, _feature_matrix(chunk, required_features)))
 
-            X = df[required_features].values
-            preds = _safe_predict(fish_model, X)
+            preds = np.concatenate(parts) if parts else np.array([])
             return jsonify({
                 "predictions": preds.tolist(),
-                "count": len(preds)
+                "count": len(preds),
+                "throughput": throughput.stats()
             })
 
         payload = request.get_json(silent=True) or {}
         features = payload.get('features')
         if features is None:
-            return jsonify({"error": "Provide 'features': [..] in JSON or upload a CSV/XLSX file."}), 400
+            return jsonify({"error": "Provide 'features': [..] in JSON or upload a data file."}), 400
         X = np.array(features, dtype=float).reshape(1, -1)
         preds = _safe_predict(fish_model, X)
-        return jsonify({"prediction": float(preds[0]) if preds.ndim == 1 else preds[0]})
+        return jsonify({"prediction": float(preds[0]) if preds.ndim == 1 else preds[0].tolist()})
+    except _UploadParseError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         return jsonify({"error": f"Fish prediction failed: {str(e)}"}), 500
 
@@ -240,48 +911,69 @@ def predict_fish():
 @app.route('/api/predict_ocean', methods=['POST'])
 def predict_ocean():
     """Predict using ocean model (model-ocean.pkl) and return charts or a single prediction."""
+    ocean_model = model_registry.get('ocean')
     if ocean_model is None:
         return jsonify({"error": "Ocean model not available."}), 503
 
     required_features = ["temperature_C", "salinity_PSU", "oxygen_mgL", "pH", "depth_m"]
 
     try:
-        if 'file' in request.files and request.files['file'].filename != '':
-            file = request.files['file']
-            if file.filename.endswith('.csv'):
-                df = pd.read_csv(file)
-            elif file.filename.endswith('.xlsx') or file.filename.endswith('.xls'):
-                df = pd.read_excel(file, engine='openpyxl')
-            else:
-                return jsonify({"error": "Unsupported file type. Upload CSV/XLSX."}), 400
-
-            df = _normalize_ocean_columns(df)
+        if _has_data_source():
+            chunks, error = _request_chunks('ocean')
+            if error:
+                return error
 
-            missing = [f for f in required_features if f not in df.columns]
-            if missing:
-                return jsonify({"error": f"Missing required columns: {missing}"}), 400
+            # Only depth and prediction are kept per row; the sample comes from the first chunks.
+            parts, head = [], []
+            head_rows = 0
+            throughput = _Throughput()
+            for chunk in chunks:
+                missing = _unusable_columns(chunk, required_features)
+                if missing:
+                    return jsonify({"error": f"Missing required columns: {missing}"}), 400
+                _job_stage('predict', len(chunk))
+                preds = throughput.predict(ocean_model, _feature_matrix(chunk, required_features, fill=0.0))
+                chunk['Prediction'] = preds if getattr(preds, 'ndim', 1) == 1 else preds.flatten()
+                parts.append(chunk[['depth_m', 'Prediction']])
+                if head_rows < 20:
+                    head.append(chunk.head(20 - head_rows))
+                    head_rows += len(head[-1])
 
-            X = df[required_features].apply(pd.to_numeric, errors='coerce').fillna(0.0).values
-            preds = _safe_predict(ocean_model, X)
-            df['Prediction'] = preds if getattr(preds, 'ndim', 1) == 1 else preds.flatten()
+            df = pd.concat(parts, ignore_index=True) if parts else pd.DataFrame(columns=['depth_m', 'Prediction'])
+            sample = pd.concat(head, ignore_index=True) if head else pd.DataFrame()
+            if 'date' in sample and sample['date'].dtype.kind == 'M':  # parsed by compact mode
+                sample['date'] = sample['date'].dt.strftime('%Y-%m-%d')
+            _job_stage('chart')
+            downsample = _downsample_options()
+            scatter = _bin_points(df, 'depth_m', 'Prediction', 'Prediction', downsample)
+            trend = _downsample_series(df[['Prediction']].assign(row=np.arange(len(df))), 'row', 'Prediction', downsample)
+            chart_points = {
+                'scatter': {'original': int(len(df)), 'plotted': int(len(df if scatter is None else scatter))},
+                'trend': {'original': int(len(df)), 'plotted': int(len(trend))},
+            }
+            if scatter is None:
+                scatter = df
             charts = {}
+            chart_format = _chart_format()
             if go is not None:
                 fig1 = go.Figure([go.Scatter(
-                    x=df['depth_m'], y=df['Prediction'], mode='markers',
-                    marker=dict(color=df['Prediction'], colorscale='Turbo', showscale=True)
+                    x=scatter['depth_m'], y=scatter['Prediction'], mode='markers',
+                    marker=dict(color=scatter['Prediction'], colorscale='Turbo', showscale=True)
                 )])
                 fig1.update_layout(title='Predictions vs Depth', xaxis_title='Depth (m)', yaxis_title='Prediction')
-                charts['scatter'] = to_html(fig1, include_plotlyjs=False, full_html=False)
+                charts['scatter'] = _render_figure(fig1, chart_format)
 
                 # Trend line
-                fig2 = go.Figure([go.Scatter(y=df['Prediction'], mode='lines+markers')])
+                fig2 = go.Figure([go.Scatter(x=trend['row'], y=trend['Prediction'], mode='lines+markers')])
                 fig2.update_layout(title='Prediction Trend', xaxis_title='Index', yaxis_title='Prediction')
-                charts['trend'] = to_html(fig2, include_plotlyjs=False, full_html=False)
+                charts['trend'] = _render_figure(fig2, chart_format)
 
             return jsonify({
                 "count": int(len(df)),
+                "throughput": throughput.stats(),
+                "chart_points": chart_points,
                 "charts": charts,
-                "sample": df.head(20).fillna('').to_dict(orient='records')
+                "sample": _sample_records(sample)
             })
 
         payload = request.get_json(silent=True) or {}
@@ -298,318 +990,3575 @@ def predict_ocean():
         preds = _safe_predict(ocean_model, X)
         pred_value = float(preds[0]) if getattr(preds, 'ndim', 1) == 1 else float(preds.flatten()[0])
         return jsonify({"prediction": pred_value, "features_order": required_features})
+    except _UploadParseError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         traceback.print_exc()
         return jsonify({"error": str(e)}), 500
 
+# --- Bulk prediction ---
+PREDICT_CHUNK_ROWS = int(os.environ.get('PREDICT_CHUNK_ROWS', '50000'))
+PREDICT_WORKERS = int(os.environ.get('PREDICT_WORKERS', str(os.cpu_count() or 2)))
+
+# Which of predict_proba/predict each model supports, decided on its first call.
+_predict_methods = weakref.WeakKeyDictionary()
+_predict_methods_lock = threading.Lock()
+_predict_pool = None
+_predict_pool_lock = threading.Lock()
+
+
 def _safe_predict(model_obj, X: np.ndarray) -> np.ndarray:
-    """Try predict_proba then predict; return numpy array of outputs."""
-    try:
-        if hasattr(model_obj, 'predict_proba'):
-            proba = model_obj.predict_proba(X)
-            return np.array(proba)
-    except Exception:
-        pass
-    preds = model_obj.predict(X)
-    return np.array(preds)
+    """Try predict_proba then predict; return numpy array of outputs.
 
-@app.route('/upload_integration1', methods=['POST'])
-def upload_integration1():
-    """Oceanographic: accept CSV/XLSX, clean, compute summaries, return Plotly charts HTML and data sample."""
-    try:
-        if 'file' not in request.files or request.files['file'].filename == '':
-            return jsonify({"error": "No file uploaded."}), 400
-        file = request.files['file']
-        if file.filename.endswith('.csv'):
-            df = pd.read_csv(file)
-        elif file.filename.endswith('.xlsx') or file.filename.endswith('.xls'):
-            df = pd.read_excel(file, engine='openpyxl')
-        else:
-            return jsonify({"error": "Unsupported file type. Upload CSV/XLSX."}), 400
+    The method that worked is remembered per model, so later calls go straight to it.
+    """
+    with _predict_methods_lock:
+        method = _predict_methods.get(model_obj)
+    if method is not None:
+        return np.asarray(getattr(model_obj, method)(X))
+    method, out = 'predict', None
+    if hasattr(model_obj, 'predict_proba'):
+        try:
+            out, method = model_obj.predict_proba(X), 'predict_proba'
+        except Exception:
+            pass
+    if out is None:
+        out = model_obj.predict(X)
+    with _predict_methods_lock:
+        _predict_methods[model_obj] = method
+    return np.asarray(out)
 
-        df = _normalize_ocean_columns(df)
-        if 'date' in df.columns:
-            df['date'] = pd.to_datetime(df['date'], errors='coerce')
-        ts = df.dropna(subset=['date']).sort_values('date')
 
-        charts = {}
-        if go is not None:
-            fig_ts = go.Figure()
-            fig_ts.add_trace(go.Scatter(x=ts['date'], y=ts['temperature_C'], mode='lines', name='Temperature (°C)'))
-            fig_ts.update_layout(title='Temperature over Time', xaxis_title='Date', yaxis_title='°C', template='plotly_white')
-            charts['time_series'] = to_html(fig_ts, include_plotlyjs=False, full_html=False)
+def _feature_matrix(frame: pd.DataFrame, columns, fill=None) -> np.ndarray:
+    """float32 (rows, features) matrix filled column by column, without an intermediate frame.
 
-   
-            fig_depth = go.Figure()
-            fig_depth.add_trace(go.Histogram(x=df['depth_m'].dropna(), nbinsx=20, name='Depth (m)'))
-            fig_depth.update_layout(title='Depth Distribution', xaxis_title='Depth (m)', yaxis_title='Count', template='plotly_white')
-            charts['depth_hist'] = to_html(fig_depth, include_plotlyjs=False, full_html=False)
+    Columns are expected to be numeric already (the schema normalizers coerce them).
+    """
+    X = np.empty((len(frame), len(columns)), dtype=np.float32)
+    for j, col in enumerate(columns):
+        X[:, j] = frame[col].to_numpy(dtype=np.float32, na_value=np.nan)
+    if fill is not None:
+        X[np.isnan(X)] = fill
+    return X
 
-          
-            fig_spatial = go.Figure()
-            fig_spatial.add_trace(go.Scattergl(x=df['lon'], y=df['lat'], mode='markers',
-                                               marker=dict(color=df['temperature_C'], colorscale='Turbo', showscale=True),
-                                               text=df['sample_id']))
-            fig_spatial.update_layout(title='Spatial Distribution (colored by Temp)', xaxis_title='Longitude', yaxis_title='Latitude', template='plotly_white')
-            charts['spatial'] = to_html(fig_spatial, include_plotlyjs=False, full_html=False)
 
-        summary = {
-            'total_samples': int(df.shape[0]),
-            'avg_temp': float(df['temperature_C'].mean(skipna=True)) if df['temperature_C'].notna().any() else None,
-            'avg_depth': float(df['depth_m'].mean(skipna=True)) if df['depth_m'].notna().any() else None,
-            'date_min': ts['date'].min().strftime('%Y-%m-%d') if not ts.empty else None,
-            'date_max': ts['date'].max().strftime('%Y-%m-%d') if not ts.empty else None,
-        }
-        sample = df.head(50).fillna('').to_dict(orient='records')
-        return jsonify({
-            'summary': summary,
-            'charts': charts,
-            'sample': sample
-        })
-    except Exception as e:
-        return jsonify({"error": f"Integration1 processing failed: {str(e)}"}), 500
+def _get_predict_pool() -> ThreadPoolExecutor:
+    global _predict_pool
+    with _predict_pool_lock:
+        if _predict_pool is None:
+            _predict_pool = ThreadPoolExecutor(max_workers=PREDICT_WORKERS, thread_name_prefix='predict')
+        return _predict_pool
 
 
-@app.route('/upload_integration2', methods=['POST'])
-def upload_integration2():
-    """Fisheries: accept CSV/XLSX, clean, compute summaries, return Plotly charts HTML and data sample."""
-    try:
-        if 'file' not in request.files or request.files['file'].filename == '':
-            return jsonify({"error": "No file uploaded."}), 400
-        file = request.files['file']
-        if file.filename.endswith('.csv'):
-            df = pd.read_csv(file)
-        elif file.filename.endswith('.xlsx') or file.filename.endswith('.xls'):
-            df = pd.read_excel(file, engine='openpyxl')
-        else:
-            return jsonify({"error": "Unsupported file type. Upload CSV/XLSX."}), 400
+def _bulk_predict(model_obj, X: np.ndarray, chunk_rows=None) -> np.ndarray:
+    """_safe_predict over row slices of X run concurrently on the prediction thread pool.
 
-    
-        df = _normalize_fisheries_columns(df)
-  
-        if 'date' in df.columns:
-            df['date'] = pd.to_datetime(df['date'], errors='coerce')
+    Threads rather than processes: the models already live in this process, and the
+    NumPy/scikit-learn kernels doing the work release the GIL.
+    """
+    if chunk_rows is None:
+        chunk_rows = PREDICT_CHUNK_ROWS
+        if has_request_context():
+            chunk_rows = request.values.get('predict_chunk_rows', PREDICT_CHUNK_ROWS, type=int)
+    chunk_rows = max(1, chunk_rows)
+    if len(X) <= chunk_rows or PREDICT_WORKERS <= 1:
+        return _safe_predict(model_obj, X)
+    _safe_predict(model_obj, X[:1])  # settle the method once before fanning out
+    slices = [X[i:i + chunk_rows] for i in range(0, len(X), chunk_rows)]
+    return np.concatenate(list(_get_predict_pool().map(lambda part: _safe_predict(model_obj, part), slices)))
 
-        charts = {}
-        if go is not None:
-            abundance = df.groupby('species_scientific', dropna=True)['count'].sum().sort_values(ascending=False).head(15)
-            fig_abund = go.Figure([go.Bar(x=abundance.index.astype(str), y=abundance.values)])
-            fig_abund.update_layout(title='Species Abundance', xaxis_title='Species', yaxis_title='Total Count', template='plotly_white')
-            charts['abundance'] = to_html(fig_abund, include_plotlyjs=False, full_html=False)
 
-            fig_len = go.Figure([go.Histogram(x=df['avg_length_mm'].dropna(), nbinsx=25)])
-            fig_len.update_layout(title='Length Distribution (mm)', xaxis_title='Avg Length (mm)', yaxis_title='Count', template='plotly_white')
-            charts['length_dist'] = to_html(fig_len, include_plotlyjs=False, full_html=False)
+class _Throughput:
+    """Rows and seconds spent inside prediction calls, reported as rows/sec."""
 
-   
-            ts = df.dropna(subset=['date']).copy()
-            ts['month'] = ts['date'].dt.to_period('M').dt.to_timestamp()
-            monthly = ts.groupby('month')['count'].sum().reset_index()
-            fig_trend = go.Figure([go.Scatter(x=monthly['month'], y=monthly['count'], mode='lines+markers')])
-            fig_trend.update_layout(title='Fish Count Over Time', xaxis_title='Month', yaxis_title='Count', template='plotly_white')
-            charts['trend'] = to_html(fig_trend, include_plotlyjs=False, full_html=False)
+    def __init__(self):
+        self.rows = 0
+        self.seconds = 0.0
 
-        summary = {
-            'total_samples': int(df.shape[0]),
-            'unique_species': int(df['species_scientific'].nunique(dropna=True)),
-            'total_fish': int(df['count'].sum(skipna=True)) if df['count'].notna().any() else 0,
-            'avg_length': float(df['avg_length_mm'].mean(skipna=True)) if df['avg_length_mm'].notna().any() else None,
-        }
-        sample = df.head(50).fillna('').to_dict(orient='records')
-        return jsonify({'summary': summary, 'charts': charts, 'sample': sample})
-    except Exception as e:
-        return jsonify({"error": f"Integration2 processing failed: {str(e)}"}), 500
+    def predict(self, model_obj, X):
+        t0 = time.perf_counter()
+        out = _bulk_predict(model_obj, X)
+        self.seconds += time.perf_counter() - t0
+        self.rows += len(X)
+        return out
 
-def _clean_columns(df: pd.DataFrame) -> pd.DataFrame:
-    def norm(c: str) -> str:
-        c = str(c).strip().lower()
-        replacements = {
-            '(': '', ')': '', '/': '_', '\\': '_', '-': '_', ' ': '_', '%': 'pct'
+    def stats(self) -> dict:
+        return {
+            'rows': self.rows,
+            'seconds': round(self.seconds, 4),
+            'rows_per_sec': round(self.rows / self.seconds, 1) if self.seconds > 0 else None,
         }
-        for k, v in replacements.items():
-            c = c.replace(k, v)
-        return c
-    df = df.copy()
-    df.columns = [norm(c) for c in df.columns]
-    return df
 
 
-def _normalize_ocean_columns(df: pd.DataFrame) -> pd.DataFrame:
-    df = _clean_columns(df)
-    mapping = {
-        'sample_id': ['sample_id', 'id', 'sampleid'],
-        'date': ['date', 'sampling_date', 'sample_date'],
-        'time': ['time', 'sampling_time', 'sample_time'],
-        'lat': ['lat', 'latitude'],
-        'lon': ['lon', 'longitude'],
-        'depth_m': ['depth_m', 'depth', 'depth_meter', 'depth_meters'],
-        'temperature_c': ['temperature_c', 'temperature', 'temp_c', 'temp'],
-        'salinity_psu': ['salinity_psu', 'salinity'],
-        'oxygen_mgl': ['oxygen_mgl', 'dissolved_oxygen_mg_l', 'do_mg_l', 'oxygen'],
-        'ph': ['ph']
-    }
-    df = _apply_mapping(df, mapping)
-    for col in ['temperature_c', 'salinity_psu', 'oxygen_mgl', 'ph', 'depth_m', 'lat', 'lon']:
-        if col in df.columns:
-            df[col] = pd.to_numeric(df[col], errors='coerce')
-    for col in ['sample_id','date','time','lat','lon','depth_m','temperature_c','salinity_psu','oxygen_mgl','ph']:
-        if col not in df.columns:
-            df[col] = np.nan
-    df = df.rename(columns={'temperature_c': 'temperature_C', 'salinity_psu': 'salinity_PSU', 'oxygen_mgl': 'oxygen_mgL'})
-    return df
+# --- Streaming responses ---
+STREAM_BATCH_ROWS = int(os.environ.get('STREAM_BATCH_ROWS', '5000'))
+_json_dumps = functools.partial(json.dumps, separators=(',', ':'), default=str)
 
 
-def _normalize_fisheries_columns(df: pd.DataFrame) -> pd.DataFrame:
-    df = _clean_columns(df)
-    mapping = {
-        'sample_id': ['sample_id', 'id', 'sampleid'],
-        'date': ['date', 'sampling_date', 'sample_date'],
-        'lat': ['lat', 'latitude'],
-        'lon': ['lon', 'longitude'],
-        'species_scientific': ['species_scientific', 'species', 'scientific_name'],
-        'count': ['count', 'fish_count', 'n'],
-        'avg_length_mm': ['avg_length_mm', 'avg_length', 'length_mm', 'mean_length_mm'],
-        'life_stage': ['life_stage', 'stage']
-    }
-    df = _apply_mapping(df, mapping)
-    for col in ['count', 'avg_length_mm', 'lat', 'lon']:
-        if col in df.columns:
-            df[col] = pd.to_numeric(df[col], errors='coerce')
-    for col in ['sample_id','date','lat','lon','species_scientific','count','avg_length_mm','life_stage']:
-        if col not in df.columns:
-            df[col] = np.nan
-    return df
+def _stream_mode():
+    """'ndjson' or 'json' when the client asked for a streamed body via ?stream=, else None."""
+    mode = request.values.get('stream')
+    return mode if mode in ('ndjson', 'json') else None
 
 
-def _apply_mapping(df: pd.DataFrame, mapping: dict) -> pd.DataFrame:
-    col_map = {}
-    cols = set(df.columns)
-    for target, aliases in mapping.items():
-        for a in aliases:
-            if a in cols:
-                col_map[a] = target
-                break
-    return df.rename(columns=col_map)
+def _peek_chunks(chunks):
+    """(first chunk or None, iterator over all chunks): lets a streamed route validate the
+    upload while it can still answer 400, before it commits to a 200."""
+    chunks = iter(chunks)
+    first = next(chunks, None)
+    return first, (itertools.chain([first], chunks) if first is not None else chunks)
 
-@app.route("/")
-def index():
-    return "✅ Flask is running! Use integration1.html or integration2.html frontend files."
 
+def _unusable_columns(chunk: pd.DataFrame, columns) -> list:
+    """`columns` that are absent from a normalized chunk (where they are all NaN) or hold
+    no numeric value in it."""
+    return [c for c in columns if c not in chunk.columns or not chunk[c].notna().any()]
 
-# --- Main entry point ---
-if __name__ == '__main__':
-    app.run(debug=True)
 
-# --- New: ML Analysis Route ---
-@app.route('/upload_ml_analysis', methods=['POST'])
-def upload_ml_analysis():
-    try:
-        if 'file' not in request.files or request.files['file'].filename == '':
-            return jsonify({"error": "No file uploaded."}), 400
-
-        file = request.files['file']
-        if file.filename.endswith('.csv'):
-            df = pd.read_csv(file)
-        elif file.filename.endswith('.xlsx') or file.filename.endswith('.xls'):
-            df = pd.read_excel(file, engine='openpyxl')
-        else:
-            return jsonify({"error": "Unsupported file type. Upload CSV/XLSX."}), 400
-        df = df.dropna(how='any')
-        if 'date' in df.columns:
-            try:
-                df['date'] = pd.to_datetime(df['date'], errors='coerce')
-            except Exception:
-                pass
-        col_map = {
-            'Temperature': ['temperature', 'temp', 'temperature_c', 'temperature_C'],
-            'Salinity': ['salinity', 'salinity_psu', 'salinity_PSU'],
-            'Oxygen': ['oxygen', 'oxygen_mgl', 'oxygen_mgL', 'do_mg_l'],
-            'Turbidity': ['turbidity'],
-            'Depth': ['depth', 'depth_m'],
-            'Chlorophyll': ['chlorophyll', 'chlorophyll_a', 'chl_a']
-        }
+def _json_values(arr: np.ndarray) -> list:
+    """Python values for one column slice, with NaN/NaT mapped to None (JSON null)."""
+    if arr.ndim > 1:
+        return arr.tolist()
+    if arr.dtype.kind in 'iub':
+        return arr.tolist()
+    if arr.dtype.kind == 'M':
+        out = np.datetime_as_string(arr, unit='s').astype(object)
+    else:
+        out = arr.astype(object)
+    out[pd.isna(arr)] = None
+    return out.tolist()
 
-        def find_col(dfcols, aliases):
-            lower = {c.lower(): c for c in dfcols}
-            for a in aliases:
-                if a.lower() in lower:
-                    return lower[a.lower()]
-            return None
 
-        resolved = {}
-        for target, aliases in col_map.items():
-            resolved[target] = find_col(df.columns, aliases) or target if target in df.columns else None
+def _json_records(df: pd.DataFrame) -> list:
+    """df.to_dict(orient='records') with NaN/NaT as None, so jsonify emits valid JSON."""
+    names = [str(c) for c in df.columns]
+    values = [_json_values(df[c].to_numpy()) for c in df.columns]
+    return [dict(zip(names, row)) for row in zip(*values)]
 
-        required = ["Temperature", "Salinity", "Oxygen", "Turbidity", "Depth", "Chlorophyll"]
-        missing = [k for k in required if not resolved.get(k)]
-        if missing:
-            return jsonify({"error": f"Missing required columns: {missing}"}), 400
 
-        X = df[[resolved['Temperature'], resolved['Salinity'], resolved['Oxygen'], resolved['Turbidity'], resolved['Depth']]].apply(pd.to_numeric, errors='coerce').dropna()
-        y = pd.to_numeric(df[resolved['Chlorophyll']], errors='coerce').loc[X.index]
+def _sample_records(df: pd.DataFrame) -> list:
+    """Records for response samples, missing values as '' (categorical columns included)."""
+    categorical = {c: object for c in df.columns if isinstance(df[c].dtype, pd.CategoricalDtype)}
+    return (df.astype(categorical) if categorical else df).fillna('').to_dict(orient='records')
 
-        if len(X) < 10:
+
+def _iter_json_rows(df: pd.DataFrame, batch_rows=None):
+    """Yield lists of JSON-encoded records, one batch of rows at a time, from the frame's NumPy columns."""
+    batch_rows = batch_rows or STREAM_BATCH_ROWS
+    names = [str(c) for c in df.columns]
+    arrays = [df[c].to_numpy() for c in df.columns]
+    for start in range(0, len(df), batch_rows):
+        values = [_json_values(a[start:start + batch_rows]) for a in arrays]
+        yield [_json_dumps(dict(zip(names, row))) for row in zip(*values)]
+
+
+def _encode_stream(row_batches, mode, prefix='', suffix=''):
+    if mode == 'ndjson':
+        for rows in row_batches:
+            if rows:
+                yield '\n'.join(rows) + '\n'
+        return
+    yield prefix + '['
+    first = True
+    for rows in row_batches:
+        if rows:
+            yield ('' if first else ',') + ','.join(rows)
+            first = False
+    yield ']' + (suffix() if callable(suffix) else suffix)
+
+
+def _gzip_stream(chunks):
+    z = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        # Sync-flush per batch so the client can start decoding before the body ends.
+        yield z.compress(chunk.encode('utf-8')) + z.flush(zlib.Z_SYNC_FLUSH)
+    yield z.flush()
+
+
+class _UnclosableStream:
+    """File proxy whose close() is a no-op; the wrapped file is closed when it is garbage collected."""
+
+    def __init__(self, stream):
+        self._stream = stream
+
+    def __getattr__(self, name):
+        return getattr(self._stream, name)
+
+    def close(self):
+        pass
+
+
+def _keep_upload_open(file):
+    """Let a streamed response read the upload lazily.
+
+    Flask closes request files when the view returns, before a streamed body is
+    generated, so the upload's close() is detached from the request teardown.
+    """
+    if not isinstance(file.stream, _UnclosableStream):
+        file.stream = _UnclosableStream(file.stream)
+
+
+def _streamed_response(row_batches, mode, prefix='', suffix=''):
+    """Stream row batches as NDJSON or as a chunked JSON array, gzip-compressed when the client accepts it.
+
+    In 'json' mode the body is `prefix + [rows...] + suffix`; `suffix` may be a callable
+    evaluated after the last batch (e.g. to append a row count).
+    """
+    body = _encode_stream(row_batches, mode, prefix, suffix)
+    headers = {}
+    if 'gzip' in request.headers.get('Accept-Encoding', ''):
+        body = _gzip_stream(body)
+        headers['Content-Encoding'] = 'gzip'
+    mimetype = 'application/x-ndjson' if mode == 'ndjson' else 'application/json'
+    return Response(stream_with_context(body), mimetype=mimetype, headers=headers)
+
+
+# --- Fisheries / ocean spatio-temporal join ---
+JOIN_MAX_KM = float(os.environ.get('JOIN_MAX_KM', '50'))
+JOIN_MAX_HOURS = float(os.environ.get('JOIN_MAX_HOURS', '72'))
+JOIN_NEIGHBOURS = int(os.environ.get('JOIN_NEIGHBOURS', '16'))
+JOIN_OCEAN_COLUMNS = ['sample_id', 'lat', 'lon', 'date', 'temperature_C', 'salinity_PSU', 'oxygen_mgL', 'pH']
+
+
+def _join_ocean_source(demo=False):
+    """Ocean samples to join against: ocean_dataset_id, an 'ocean_file' upload, or demo data.
+
+    Returns (frame or None, None) or (None, error response).
+    """
+    dataset_id = request.values.get('ocean_dataset_id')
+    if dataset_id:
+        meta = dataset_store.meta(dataset_id) if pa is not None else None
+        if meta is None or meta['kind'] != 'ocean':
+            return None, (jsonify({"error": f"Unknown ocean dataset '{dataset_id}'."}), 404)
+        cols = [c for c in JOIN_OCEAN_COLUMNS if c in meta['columns']]
+        return _normalize_ocean_columns(dataset_store.read_table(dataset_id, cols).to_pandas(), _compact_mode()), None
+    file = request.files.get('ocean_file')
+    if file is not None and file.filename != '':
+        if _upload_format(file) is None:
+            return None, (jsonify({"error": f"ocean_file: {UNSUPPORTED_UPLOAD}"}), 400)
+        compact = _compact_mode()
+        return _read_upload(file, lambda c: _normalize_ocean_columns(c, compact), columns=JOIN_OCEAN_COLUMNS), None
+    if demo:
+        return _normalize_ocean_columns(generate_dummy_ocean_data()), None
+    return None, None
+
+
+def _spatiotemporal_join(hauls: pd.DataFrame, casts, max_km=JOIN_MAX_KM, max_hours=JOIN_MAX_HOURS,
+                         k=JOIN_NEIGHBOURS):
+    """Attach to every haul the nearest ocean cast within `max_km` and `max_hours`.
+
+    Hauls are processed in time blocks `max_hours` wide. Each block builds a haversine
+    BallTree over only the casts that fall within the block +/- the tolerance (found by
+    binary search on the time-sorted casts) and asks it for the k nearest casts; the
+    closest one inside the time tolerance wins. Hauls whose k-th neighbour is still
+    within `max_km` fall back to an exact radius query, so the result is exact.
+    `max_hours` <= 0 joins on distance only. Returns (joined frame, coverage stats).
+    """
+    t0 = time.perf_counter()
+    n = len(hauls)
+    match = np.full(n, -1, dtype=np.int64)
+    dist_km = np.full(n, np.nan)
+    use_time = max_hours is not None and max_hours > 0
+    tol = np.int64(max_hours * 3600 * 1e9) if use_time else None
+
+    h_lat = np.radians(hauls['lat'].to_numpy(dtype=float))
+    h_lon = np.radians(hauls['lon'].to_numpy(dtype=float))
+    h_t = pd.to_datetime(hauls['date'], errors='coerce').to_numpy(dtype='datetime64[ns]').view(np.int64)
+    h_ok = np.isfinite(h_lat) & np.isfinite(h_lon) & ((h_t != _NAT) if use_time else True)
+
+    if casts is None or casts.empty:
+        casts = _normalize_ocean_columns(pd.DataFrame())
+    c_lat = np.radians(casts['lat'].to_numpy(dtype=float))
+    c_lon = np.radians(casts['lon'].to_numpy(dtype=float))
+    c_t = pd.to_datetime(casts['date'], errors='coerce').to_numpy(dtype='datetime64[ns]').view(np.int64)
+    c_idx = np.flatnonzero(np.isfinite(c_lat) & np.isfinite(c_lon) & ((c_t != _NAT) if use_time else True))
+    c_idx = c_idx[np.argsort(c_t[c_idx], kind='stable')]
+    c_sorted_t = c_t[c_idx]
+    radius = max_km / EARTH_RADIUS_KM
+
+    def match_block(hi, ci):
+        if hi.size == 0 or ci.size == 0:
+            return
+        tree = BallTree(np.column_stack([c_lat[ci], c_lon[ci]]), metric='haversine')
+        pts = np.column_stack([h_lat[hi], h_lon[hi]])
+        kk = min(k, ci.size)
+        d, j = tree.query(pts, k=kk)
+        ok = d <= radius
+        if use_time:
+            ok &= np.abs(c_t[ci][j] - h_t[hi][:, None]) <= tol
+        first = ok.argmax(axis=1)
+        found = ok[np.arange(hi.size), first]
+        match[hi[found]] = ci[j[found, first[found]]]
+        dist_km[hi[found]] = d[found, first[found]] * EARTH_RADIUS_KM
+
+        pending = np.flatnonzero(~found & (d[:, -1] <= radius)) if kk < ci.size else np.empty(0, dtype=np.int64)
+        if pending.size:
+            ind, dd = tree.query_radius(pts[pending], r=radius, return_distance=True, sort_results=True)
+            for p, cand, cd in zip(pending, ind, dd):
+                if use_time:
+                    keep = np.abs(c_t[ci[cand]] - h_t[hi[p]]) <= tol
+                    cand, cd = cand[keep], cd[keep]
+                if cand.size:
+                    match[hi[p]] = ci[cand[0]]
+                    dist_km[hi[p]] = cd[0] * EARTH_RADIUS_KM
+
+    valid = np.flatnonzero(h_ok)
+    if not use_time:
+        match_block(valid, c_idx)
+    elif valid.size:
+        start = h_t[valid].min()
+        block = (h_t[valid] - start) // tol
+        order = np.argsort(block, kind='stable')
+        blocks, bounds = np.unique(block[order], return_index=True)
+        bounds = np.append(bounds, order.size)
+        for b, lo, hi in zip(blocks, bounds[:-1], bounds[1:]):
+            win_lo = start + b * tol - tol
+            win_hi = start + (b + 1) * tol + tol
+            ci = c_idx[np.searchsorted(c_sorted_t, win_lo, 'left'):np.searchsorted(c_sorted_t, win_hi, 'right')]
+            match_block(valid[order[lo:hi]], ci)
+
+    hit = match >= 0
+    out = hauls.copy()
+    for col in ['temperature_C', 'salinity_PSU', 'oxygen_mgL', 'pH']:
+        values = np.full(n, np.nan)
+        if col in casts.columns:
+            values[hit] = casts[col].to_numpy(dtype=float)[match[hit]]
+        out[col] = values
+    ocean_ids = np.full(n, None, dtype=object)
+    ocean_ids[hit] = casts['sample_id'].to_numpy(dtype=object)[match[hit]]
+    out['ocean_sample_id'] = ocean_ids
+    out['join_distance_km'] = dist_km
+    time_diff_h = np.full(n, np.nan)
+    time_diff_h[hit] = np.abs(c_t[match[hit]] - h_t[hit]) / 3.6e12 if use_time else np.nan
+    out['join_time_diff_h'] = time_diff_h
+
+    stats = {
+        'hauls': int(n),
+        'hauls_joinable': int(h_ok.sum()),
+        'ocean_samples': int(c_idx.size),
+        'matched': int(hit.sum()),
+        'coverage_pct': round(100.0 * float(hit.sum()) / n, 2) if n else 0.0,
+        'median_distance_km': float(np.median(dist_km[hit])) if hit.any() else None,
+        'p90_distance_km': float(np.percentile(dist_km[hit], 90)) if hit.any() else None,
+        'median_time_diff_h': float(np.median(time_diff_h[hit])) if hit.any() and use_time else None,
+        'max_km': max_km,
+        'max_hours': max_hours if use_time else None,
+        'elapsed_ms': round((time.perf_counter() - t0) * 1000, 1),
+    }
+    return out, stats
+
+
+# --- Chart payloads ---
+def _chart_format() -> str:
+    """'columnar' when the client asked for typed-array chart payloads, else 'html'."""
+    return 'columnar' if request.values.get('chart_format') == 'columnar' else 'html'
+
+
+def _render_figure(fig, chart_format='html'):
+    """Render a Plotly figure as an HTML snippet, or as a columnar payload.
+
+    The columnar payload keeps the trace/layout structure but replaces every data
+    array with base64 little-endian float32 (float64 epoch-ms for dates, and for
+    integers float32 cannot hold exactly), which the front end turns back into typed
+    arrays and hands straight to Plotly.newPlot. Labels (text, hover text, ids, ...)
+    and non-numeric columns stay strings, dictionary-encoded when values repeat.
+    """
+    if chart_format != 'columnar':
+        return to_html(fig, include_plotlyjs=False, full_html=False)
+    layout = fig.layout.to_plotly_json()
+    layout.pop('template', None)
+    return {
+        'format': 'columnar',
+        'traces': [_encode_chart_value(t.to_plotly_json()) for t in fig.data],
+        'layout': layout,
+    }
+
+
+# Trace attributes Plotly shows as labels: sent as strings even when the values are numeric.
+_CHART_TEXT_KEYS = frozenset({'text', 'hovertext', 'ids', 'labels', 'customdata', 'legendgroup'})
+_FLOAT32_EXACT_INT = 2 ** 24
+
+
+def _encode_chart_value(value, key=None):
+    if isinstance(value, dict):
+        return {k: _encode_chart_value(v, k) for k, v in value.items()}
+    if isinstance(value, (np.ndarray, pd.Series, pd.Index)) or (isinstance(value, (list, tuple)) and len(value) > 16):
+        return _encode_text_column(value) if key in _CHART_TEXT_KEYS else _encode_column(value)
+    return value
+
+
+def _b64(arr) -> str:
+    return base64.b64encode(arr.tobytes()).decode('ascii')
+
+
+def _encode_column(values):
+    arr = np.asarray(values)
+    if arr.dtype.kind == 'O' and arr.size:
+        first = next((v for v in arr if v is not None and not (isinstance(v, float) and np.isnan(v))), None)
+        if hasattr(first, 'year') and hasattr(first, 'hour'):
+            arr = pd.to_datetime(arr, errors='coerce').to_numpy()
+    if arr.dtype.kind == 'M':
+        ms = arr.astype('datetime64[ms]').astype('<i8').astype('<f8')
+        ms[np.isnat(arr)] = np.nan
+        return {'dtype': 'float64', 'kind': 'datetime', 'data': _b64(ms)}
+    if arr.dtype.kind in 'iufb':
+        if arr.dtype.kind in 'iu' and arr.size and np.abs(arr).max() > _FLOAT32_EXACT_INT:
+            return {'dtype': 'float64', 'data': _b64(np.ascontiguousarray(arr, dtype='<f8'))}
+        return {'dtype': 'float32', 'data': _b64(np.ascontiguousarray(arr, dtype='<f4'))}
+    return _encode_text_column(arr)
+
+
+def _encode_text_column(values):
+    """Strings (None for missing) as a plain list, or dictionary-encoded when values repeat:
+    {'kind': 'dictionary', 'values': [...], 'dtype': 'int32', 'data': codes}, code -1 = missing."""
+    codes, uniques = pd.factorize(pd.Series(np.asarray(values, dtype=object)), use_na_sentinel=True)
+    labels = [v if isinstance(v, str) else _chart_label(v) for v in uniques.tolist()]
+    if len(labels) * 2 > len(codes):
+        return [None if c < 0 else labels[c] for c in codes.tolist()]
+    return {'kind': 'dictionary', 'values': labels, 'dtype': 'int32', 'data': _b64(codes.astype('<i4'))}
+
+
+def _chart_label(value) -> str:
+    """Whole floats (e.g. integer ids that passed through a float column) without the '.0'."""
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+# --- Chart downsampling ---
+CHART_MAX_POINTS = int(os.environ.get('CHART_MAX_POINTS', '5000'))
+CHART_GRID_BINS = int(os.environ.get('CHART_GRID_BINS', '200'))
+
+
+def _downsample_options() -> dict:
+    """Per-request settings: downsample=auto|none, max_points, grid_bins."""
+    mode = request.values.get('downsample', 'none')
+    return {
+        'mode': mode if mode in ('auto', 'none') else 'none',
+        'max_points': max(3, request.values.get('max_points', CHART_MAX_POINTS, type=int)),
+        'grid_bins': max(1, request.values.get('grid_bins', CHART_GRID_BINS, type=int)),
+    }
+
+
+def _lttb_indices(x: np.ndarray, y: np.ndarray, n_out: int) -> np.ndarray:
+    """Indices kept by largest-triangle-three-buckets on x-sorted, finite data."""
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+    # n_out - 2 buckets between the fixed first and last points.
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.int64)
+    sizes = np.diff(edges)
+    mean_x = np.add.reduceat(x[:n - 1], edges[:-1]) / sizes
+    mean_y = np.add.reduceat(y[:n - 1], edges[:-1]) / sizes
+
+    keep = np.empty(n_out, dtype=np.int64)
+    keep[0], keep[-1] = 0, n - 1
+    a = 0
+    for i in range(n_out - 2):
+        lo, hi = edges[i], edges[i + 1]
+        cx, cy = (mean_x[i + 1], mean_y[i + 1]) if i + 1 < len(sizes) else (x[-1], y[-1])
+        area = np.abs((x[a] - cx) * (y[lo:hi] - y[a]) - (x[a] - x[lo:hi]) * (cy - y[a]))
+        a = lo + int(np.argmax(area))
+        keep[i + 1] = a
+    return keep
+
+
+def _downsample_series(frame: pd.DataFrame, xcol, ycol, options) -> pd.DataFrame:
+    """Reduce an x-sorted series to options['max_points'] rows with LTTB when downsampling is on."""
+    if options['mode'] == 'none' or len(frame) <= options['max_points']:
+        return frame
+    frame = frame.dropna(subset=[xcol, ycol])
+    x = frame[xcol].to_numpy()
+    if x.dtype.kind == 'M':
+        x = x.astype('datetime64[ns]').astype(np.int64)
+    keep = _lttb_indices(x.astype(float), frame[ycol].to_numpy(dtype=float), options['max_points'])
+    return frame.iloc[keep]
+
+
+def _bin_points(frame: pd.DataFrame, xcol, ycol, vcol, options):
+    """Aggregate scatter points into a grid of cells with mean `vcol` and count `n`.
+
+    Returns None when downsampling is off or the frame is already small enough.
+    """
+    if options['mode'] == 'none' or len(frame) <= options['max_points']:
+        return None
+    x = frame[xcol].to_numpy(dtype=float)
+    y = frame[ycol].to_numpy(dtype=float)
+    v = frame[vcol].to_numpy(dtype=float)
+    ok = np.isfinite(x) & np.isfinite(y)
+    x, y, v = x[ok], y[ok], v[ok]
+    if x.size == 0:
+        return pd.DataFrame(columns=[xcol, ycol, vcol, 'n'])
+
+    # Keep the number of cells within max_points as well as grid_bins per axis.
+    bins = max(1, min(options['grid_bins'], int(np.sqrt(options['max_points']))))
+    x0, y0 = x.min(), y.min()
+    xw = (x.max() - x0) / bins or 1.0
+    yw = (y.max() - y0) / bins or 1.0
+    ix = np.minimum(((x - x0) / xw).astype(np.int64), bins - 1)
+    iy = np.minimum(((y - y0) / yw).astype(np.int64), bins - 1)
+    cell = ix * bins + iy
+
+    counts = np.bincount(cell, minlength=bins * bins)
+    has_v = np.isfinite(v)
+    v_sum = np.bincount(cell[has_v], weights=v[has_v], minlength=bins * bins)
+    v_count = np.bincount(cell[has_v], minlength=bins * bins)
+    occupied = np.flatnonzero(counts)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = v_sum[occupied] / v_count[occupied]
+    cells = pd.DataFrame({
+        xcol: x0 + (occupied // bins + 0.5) * xw,
+        ycol: y0 + (occupied % bins + 0.5) * yw,
+        'n': counts[occupied],
+    })
+    cells[vcol] = mean
+    return cells
+
+
+@app.route('/upload_integration1', methods=['POST'])
+@_cache_upload_result
+def upload_integration1():
+    """Oceanographic: accept CSV/XLSX/Parquet/Feather, clean, compute summaries, return Plotly charts HTML and data sample."""
+    try:
+        chunks, error = _request_chunks('ocean')
+        if error:
+            return error
+
+        # Summaries are folded in chunk by chunk; only the plotted columns are retained.
+        temp_stats, depth_stats, date_stats = _StreamStats(), _StreamStats(), _StreamStats()
+        total_samples = head_rows = 0
+        ts_parts, point_parts, head = [], [], []
+        qc = _QualityControl() if _qc_mode() else None
+        keep_flags = _qc_flag_columns()
+        for chunk in chunks:
+            _job_stage('aggregate', len(chunk))
+            chunk['date'] = pd.to_datetime(chunk['date'], errors='coerce')
+            if qc:
+                chunk = qc.screen(chunk) if keep_flags else qc.strip(qc.screen(chunk))
+            total_samples += len(chunk)
+            temp_stats.update(chunk['temperature_C'])
+            depth_stats.update(chunk['depth_m'])
+            dated = chunk.loc[chunk['date'].notna(), ['date', 'temperature_C']]
+            date_stats.update(dated['date'])
+            ts_parts.append(dated)
+            point_parts.append(chunk[['lon', 'lat', 'depth_m', 'temperature_C', 'sample_id']])
+            if head_rows < 50:
+                head.append(chunk.head(50 - head_rows))
+                head_rows += len(head[-1])
+
+        _job_stage('aggregate')
+        ts = (pd.concat(ts_parts, ignore_index=True) if ts_parts
+              else pd.DataFrame(columns=['date', 'temperature_C'])).sort_values('date')
+        df = (pd.concat(point_parts, ignore_index=True) if point_parts
+              else pd.DataFrame(columns=['lon', 'lat', 'depth_m', 'temperature_C', 'sample_id']))
+
+        _job_stage('downsample')
+        downsample = _downsample_options()
+        ts_plot = _downsample_series(ts, 'date', 'temperature_C', downsample)
+        spatial, spatial_text = df, df['sample_id']
+        binned = _bin_points(df, 'lon', 'lat', 'temperature_C', downsample)
+        if binned is not None:
+            spatial, spatial_text = binned, 'n=' + binned['n'].astype(str)
+
+        _job_stage('chart')
+
+        charts = {}
+        chart_format = _chart_format()
+        if go is not None:
+            fig_ts = go.Figure()
+            fig_ts.add_trace(go.Scatter(x=ts_plot['date'], y=ts_plot['temperature_C'], mode='lines', name='Temperature (°C)'))
+            fig_ts.update_layout(title='Temperature over Time', xaxis_title='Date', yaxis_title='°C', template='plotly_white')
+            charts['time_series'] = _render_figure(fig_ts, chart_format)
+
+   
+            fig_depth = go.Figure()
+            fig_depth.add_trace(go.Histogram(x=df['depth_m'].dropna(), nbinsx=20, name='Depth (m)'))
+            fig_depth.update_layout(title='Depth Distribution', xaxis_title='Depth (m)', yaxis_title='Count', template='plotly_white')
+            charts['depth_hist'] = _render_figure(fig_depth, chart_format)
+
+          
+            fig_spatial = go.Figure()
+            fig_spatial.add_trace(go.Scattergl(x=spatial['lon'], y=spatial['lat'], mode='markers',
+                                               marker=dict(color=spatial['temperature_C'], colorscale='Turbo', showscale=True),
+                                               text=spatial_text))
+            fig_spatial.update_layout(title='Spatial Distribution (colored by Temp)', xaxis_title='Longitude', yaxis_title='Latitude', template='plotly_white')
+            charts['spatial'] = _render_figure(fig_spatial, chart_format)
+
+        summary = {
+            'total_samples': int(total_samples),
+            'avg_temp': temp_stats.mean,
+            'avg_depth': depth_stats.mean,
+            'date_min': date_stats.min.strftime('%Y-%m-%d') if date_stats.count else None,
+            'date_max': date_stats.max.strftime('%Y-%m-%d') if date_stats.count else None,
+            'chart_points': {
+                'time_series': {'original': int(len(ts)), 'plotted': int(len(ts_plot))},
+                'spatial': {'original': int(len(df)), 'plotted': int(len(spatial))},
+            },
+        }
+        if qc:
+            summary['qc'] = qc.summary()
+        _job_stage('serialize')
+        sample = _sample_records(pd.concat(head, ignore_index=True)) if head else []
+        return jsonify({
+            'summary': summary,
+            'charts': charts,
+            'sample': sample
+        })
+    except _UploadParseError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"error": f"Integration1 processing failed: {str(e)}"}), 500
+
+
+@app.route('/upload_integration2', methods=['POST'])
+@_cache_upload_result
+def upload_integration2():
+    """Fisheries: accept CSV/XLSX/Parquet/Feather, clean, compute summaries, return Plotly charts HTML and data sample."""
+    try:
+        chunks, error = _request_chunks('fisheries')
+        if error:
+            return error
+
+        # Charts and summary come from the aggregate cube; a stored dataset's cube is
+        # kept between requests, an upload (or a filtered dataset) gets a fresh one.
+        dataset_id = request.values.get('dataset_id')
+        if dataset_id and not _spatial_query_args():
+            cube = _dataset_cube(dataset_id)
+            head = [dataset_store.read_table(dataset_id).slice(0, 50).to_pandas()]
+        else:
+            cube, head, head_rows = _FisheriesCube(), [], 0
+            for chunk in chunks:
+                _job_stage('aggregate', len(chunk))
+                chunk['date'] = pd.to_datetime(chunk['date'], errors='coerce')
+                cube.update(chunk)
+                if head_rows < 50:
+                    head.append(chunk.head(50 - head_rows))
+                    head_rows += len(head[-1])
+        dash = cube.dashboard()
+
+        _job_stage('chart')
+        charts = {}
+        chart_format = _chart_format()
+        if go is not None:
+            top = dash['abundance'].sort_values(ascending=False).head(15)
+            fig_abund = go.Figure([go.Bar(x=top.index.astype(str), y=top.values)])
+            fig_abund.update_layout(title='Species Abundance', xaxis_title='Species', yaxis_title='Total Count', template='plotly_white')
+            charts['abundance'] = _render_figure(fig_abund, chart_format)
+
+            hist = dash['length_hist']
+            fig_len = go.Figure([go.Bar(x=hist.index + CUBE_LENGTH_BIN_MM / 2, y=hist.values, width=CUBE_LENGTH_BIN_MM)])
+            fig_len.update_layout(title='Length Distribution (mm)', xaxis_title='Avg Length (mm)', yaxis_title='Count', template='plotly_white', bargap=0)
+            charts['length_dist'] = _render_figure(fig_len, chart_format)
+
+            monthly = dash['monthly']
+            fig_trend = go.Figure([go.Scatter(x=monthly.index, y=monthly.values, mode='lines+markers')])
+            fig_trend.update_layout(title='Fish Count Over Time', xaxis_title='Month', yaxis_title='Count', template='plotly_white')
+            charts['trend'] = _render_figure(fig_trend, chart_format)
+
+        summary = dash['summary']
+        _job_stage('serialize')
+        sample = _sample_records(pd.concat(head, ignore_index=True)) if head else []
+        return jsonify({'summary': summary, 'charts': charts, 'sample': sample})
+    except _UploadParseError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"error": f"Integration2 processing failed: {str(e)}"}), 500
+
+# --- Schema resolution ---
+_HEADER_TRANS = str.maketrans({'(': '', ')': '', '/': '_', '\\': '_', '-': '_', ' ': '_', '%': 'pct'})
+
+
+def _norm_header(c) -> str:
+    return str(c).strip().lower().translate(_HEADER_TRANS)
+
+
+class _Schema:
+    """Canonical columns of one upload type, with a precompiled alias -> canonical index.
+
+    Aliases are matched against normalized headers; when several headers match the
+    same canonical column, the alias listed first wins.
+    """
+
+    def __init__(self, aliases: dict, numeric=(), text=(), categorical=()):
+        self.columns = list(aliases)
+        self.numeric = list(numeric)
+        self.text = list(text)
+        self.categorical = list(categorical)
+        self.index = {}
+        for canonical, names in aliases.items():
+            for rank, alias in enumerate(names):
+                self.index.setdefault(alias, (canonical, rank))
+
+    def resolve(self, headers) -> dict:
+        """Return {canonical: original header} for the canonical columns present."""
+        return _resolve_headers(self, tuple(headers))[1]
+
+
+@functools.lru_cache(maxsize=512)
+def _resolve_headers(schema: _Schema, headers: tuple):
+    """Memoized header resolution: (new column names, {canonical: original header}).
+
+    Chunked uploads repeat the same header tuple for every chunk, so this runs once per file.
+    """
+    normalized = [_norm_header(h) for h in headers]
+    best = {}
+    for pos, name in enumerate(normalized):
+        hit = schema.index.get(name)
+        if hit is not None:
+            canonical, rank = hit
+            if canonical not in best or rank < best[canonical][0]:
+                best[canonical] = (rank, pos)
+    columns = list(normalized)
+    found = {}
+    for canonical, (_, pos) in best.items():
+        columns[pos] = canonical
+        found[canonical] = headers[pos]
+    return tuple(columns), found
+
+
+OCEAN_SCHEMA = _Schema({
+    'sample_id': ['sample_id', 'id', 'sampleid'],
+    'date': ['date', 'sampling_date', 'sample_date'],
+    'time': ['time', 'sampling_time', 'sample_time'],
+    'lat': ['lat', 'latitude'],
+    'lon': ['lon', 'longitude'],
+    'depth_m': ['depth_m', 'depth', 'depth_meter', 'depth_meters'],
+    'temperature_C': ['temperature_c', 'temperature', 'temp_c', 'temp'],
+    'salinity_PSU': ['salinity_psu', 'salinity'],
+    'oxygen_mgL': ['oxygen_mgl', 'dissolved_oxygen_mg_l', 'do_mg_l', 'oxygen'],
+    'pH': ['ph']
+}, numeric=['temperature_C', 'salinity_PSU', 'oxygen_mgL', 'pH', 'depth_m', 'lat', 'lon'], text=['time'])
+
+FISHERIES_SCHEMA = _Schema({
+    'sample_id': ['sample_id', 'id', 'sampleid'],
+    'date': ['date', 'sampling_date', 'sample_date'],
+    'lat': ['lat', 'latitude'],
+    'lon': ['lon', 'longitude'],
+    'species_scientific': ['species_scientific', 'species', 'scientific_name'],
+    'count': ['count', 'fish_count', 'n'],
+    'avg_length_mm': ['avg_length_mm', 'avg_length', 'length_mm', 'mean_length_mm'],
+    'life_stage': ['life_stage', 'stage']
+}, numeric=['count', 'avg_length_mm', 'lat', 'lon'], text=['species_scientific', 'life_stage'],
+   categorical=['species_scientific', 'life_stage'])
+
+ML_SCHEMA = _Schema({
+    'Temperature': ['temperature', 'temp', 'temperature_c'],
+    'Salinity': ['salinity', 'salinity_psu'],
+    'Oxygen': ['oxygen', 'oxygen_mgl', 'do_mg_l'],
+    'Turbidity': ['turbidity'],
+    'Depth': ['depth', 'depth_m'],
+    'Chlorophyll': ['chlorophyll', 'chlorophyll_a', 'chl_a']
+})
+
+
+def _coerce_numeric(df: pd.DataFrame, columns) -> pd.DataFrame:
+    """Coerce `columns` to numbers in place, parsing all non-numeric ones in a single to_numeric pass."""
+    pending = [c for c in columns if c in df.columns and df[c].dtype.kind not in 'iufb']
+    if pending:
+        flat = pd.to_numeric(pd.Series(df[pending].to_numpy(dtype=object).ravel(order='F')), errors='coerce')
+        values = flat.to_numpy(dtype=float).reshape(len(df), len(pending), order='F')
+        for i, col in enumerate(pending):
+            df[col] = values[:, i]
+    return df
+
+
+# --- Compact frames ---
+COMPACT_FRAMES = os.environ.get('COMPACT_FRAMES', '0') == '1'
+_INT32 = np.iinfo(np.int32)
+_FLOAT32_MAX = float(np.finfo(np.float32).max)
+
+
+def _compact_mode() -> bool:
+    """compact=1/0 on the request, else the COMPACT_FRAMES default."""
+    value = request.values.get('compact') if has_request_context() else None
+    if value:
+        return value.lower() not in ('0', 'false', 'no')
+    return COMPACT_FRAMES
+
+
+def _absent_column(n) -> np.ndarray:
+    """An all-NaN float32 column of n rows, half the float64 NaN column of a default frame.
+
+    (A zero-stride view would not stay one: pandas copies it into the frame.)
+    """
+    return np.full(n, np.nan, dtype=np.float32)
+
+
+def _frame_bytes(df: pd.DataFrame) -> int:
+    return int(df.memory_usage(index=False, deep=True).sum())
+
+
+def _downcast(values: np.ndarray) -> np.ndarray:
+    """int32 for whole numbers without gaps, else float32, as far as the value range allows."""
+    finite = values[np.isfinite(values)] if values.dtype.kind == 'f' else values
+    if finite.size == 0:
+        return values.astype(np.float32)
+    lo, hi = finite.min(), finite.max()
+    whole = values.dtype.kind in 'iu' or np.array_equal(finite, np.trunc(finite))
+    if finite.size == values.size and whole and _INT32.min <= lo and hi <= _INT32.max:
+        return values.astype(np.int32)
+    if max(abs(float(lo)), abs(float(hi))) <= _FLOAT32_MAX:
+        return values.astype(np.float32)
+    return values
+
+
+def _compact_frame(df: pd.DataFrame, schema: _Schema):
+    """Shrink the columns of a normalized frame in place: numeric columns downcast, dates
+    parsed to datetime64, categorical columns as pandas categories."""
+    for col in schema.numeric:
+        if col in df.columns and df[col].dtype.kind in 'iuf':
+            df[col] = _downcast(df[col].to_numpy())
+    if 'date' in schema.columns and 'date' in df.columns and df['date'].dtype.kind != 'M':
+        df['date'] = pd.to_datetime(df['date'], errors='coerce')
+    for col in schema.categorical:
+        if col in df.columns and not isinstance(df[col].dtype, pd.CategoricalDtype):
+            df[col] = df[col].astype('category')
+
+
+def _normalize_columns(df: pd.DataFrame, schema: _Schema, compact=False) -> pd.DataFrame:
+    """Rename headers to `schema`, coerce its numeric columns and add any missing ones as NaN.
+
+    Only the column index is replaced; the caller's data is not copied or modified.
+    With `compact`, columns are also shrunk by _compact_frame, missing ones are float32,
+    and the frame's measured size is reported to the request timer next to the size the
+    default frame would have had.
+    """
+    columns, _ = _resolve_headers(schema, tuple(df.columns))
+    df = df.copy(deep=False)
+    df.columns = list(columns)
+    _coerce_numeric(df, schema.numeric)
+    if not compact:
+        for col in schema.columns:
+            if col not in df.columns:
+                df[col] = np.nan
+        return df
+    before = _frame_bytes(df)
+    _compact_frame(df, schema)
+    for col in schema.columns:
+        if col not in df.columns:
+            df[col] = _absent_column(len(df))
+            before += 8 * len(df)  # the float64 NaN column of the default frame
+    _frame_memory(before, _frame_bytes(df))
+    return df
+
+
+def _normalize_ocean_columns(df: pd.DataFrame, compact=False) -> pd.DataFrame:
+    return _normalize_columns(df, OCEAN_SCHEMA, compact)
+
+
+def _normalize_fisheries_columns(df: pd.DataFrame, compact=False) -> pd.DataFrame:
+    return _normalize_columns(df, FISHERIES_SCHEMA, compact)
+
+
+# --- Streaming ingestion ---
+INGEST_CHUNK_ROWS = int(os.environ.get('INGEST_CHUNK_ROWS', '100000'))
+
+
+UNSUPPORTED_UPLOAD = "Unsupported file type. Upload CSV (plain, gzip or zstd), XLSX, Parquet or Feather/Arrow."
+# Uploads that do not parse as their sniffed format: malformed CSV text, corrupt
+# compressed streams, truncated Parquet/Feather/Arrow files and broken XLSX archives.
+_PARSE_ERRORS = (pd.errors.ParserError, pd.errors.EmptyDataError, UnicodeDecodeError, zlib.error, EOFError,
+                 OSError, zipfile.BadZipFile)
+if pa is not None:
+    _PARSE_ERRORS += (pa.ArrowInvalid,)
+if InvalidFileException is not None:
+    _PARSE_ERRORS += (InvalidFileException,)
+
+
+class _UploadParseError(ValueError):
+    """An upload that sniffed as a supported format but could not be parsed; routes answer 400."""
+
+
+@app.errorhandler(_UploadParseError)
+def _upload_parse_error(e):
+    return jsonify({"error": str(e)}), 400
+
+
+# Leading bytes of the binary formats; anything else that looks like text is read as CSV.
+_MAGIC = [
+    (b'PAR1', 'parquet'),
+    (b'ARROW1', 'feather'),
+    (b'FEA1', 'feather_v1'),
+    (b'\xff\xff\xff\xff', 'arrow_stream'),
+    (b'\x1f\x8b', 'csv.gz'),
+    (b'\x28\xb5\x2f\xfd', 'csv.zst'),
+    (b'PK\x03\x04', 'excel'),
+    (b'\xd0\xcf\x11\xe0', None),  # legacy .xls (OLE2), which openpyxl cannot read
+]
+
+
+def _upload_format(file):
+    """Sniff an upload's format from its first bytes: 'csv', 'csv.gz', 'csv.zst', 'excel',
+    'parquet', 'feather', 'feather_v1' or 'arrow_stream'; None when it is not a supported type.
+
+    The stream is rewound afterwards. Uploads that start with none of the known magic
+    numbers are taken as CSV when they look like text.
+    """
+    stream = file.stream
+    pos = stream.tell()
+    head = stream.read(4096)
+    stream.seek(pos)
+    for magic, fmt in _MAGIC:
+        if head.startswith(magic):
+            return fmt
+    if not head:
+        return 'csv' if (file.filename or '').lower().endswith('.csv') else None
+    if b'\x00' in head:
+        return None
+    return 'csv'
+
+
+def _iter_excel_chunks(file, chunksize):
+    """Yield DataFrames of up to `chunksize` rows from the first sheet, using openpyxl's read-only mode."""
+    from openpyxl import load_workbook
+    wb = load_workbook(file, read_only=True, data_only=True)
+    try:
+        rows = wb.worksheets[0].iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return
+        columns = [c if c is not None else f'Unnamed: {i}' for i, c in enumerate(header)]
+        batch = []
+        for row in rows:
+            batch.append(row[:len(columns)])
+            if len(batch) >= chunksize:
+                yield pd.DataFrame.from_records(batch, columns=columns)
+                batch = []
+        if batch:
+            yield pd.DataFrame.from_records(batch, columns=columns)
+    finally:
+        wb.close()
+
+
+def _iter_arrow_chunks(batches, chunksize):
+    """Regroup Arrow record batches into DataFrames of about `chunksize` rows."""
+    pending, rows = [], 0
+    for batch in batches:
+        pending.append(batch)
+        rows += batch.num_rows
+        if rows >= chunksize:
+            yield pa.Table.from_batches(pending).to_pandas()
+            pending, rows = [], 0
+    if pending:
+        yield pa.Table.from_batches(pending).to_pandas()
+
+
+def _iter_feather_batches(file):
+    reader = pa.ipc.open_file(file.stream)
+    for i in range(reader.num_record_batches):
+        yield reader.get_batch(i)
+
+
+def _iter_upload_chunks(file, normalize=None, chunksize=None):
+    """Yield an upload as DataFrame chunks, applying `normalize` to each chunk.
+
+    The format is sniffed by _upload_format. Compressed CSV is decompressed as it is
+    read, Parquet one row group and Arrow one record batch at a time, so peak memory is
+    bounded by the chunk size rather than the file size; callers should fold each chunk
+    into their aggregates instead of keeping it around.
+    """
+    chunksize = chunksize or INGEST_CHUNK_ROWS
+    fmt = _upload_format(file)
+    if fmt in ('parquet', 'feather', 'feather_v1', 'arrow_stream') and pa is None:
+        raise ValueError("Parquet/Feather uploads require pyarrow on the server.")
+    try:
+        reader = _open_upload_reader(file, fmt, chunksize)
+    except _PARSE_ERRORS as e:
+        raise _UploadParseError(f"Could not parse the uploaded file as {fmt}: {e}") from None
+    while True:
+        _job_stage('parse')
+        try:
+            chunk = next(reader, None)
+        except _PARSE_ERRORS as e:
+            raise _UploadParseError(f"Could not parse the uploaded file as {fmt}: {e}") from None
+        if chunk is None:
+            return
+        _job_stage('parse', len(chunk))
+        if normalize is not None:
+            _job_stage('normalize', len(chunk))
+            chunk = normalize(chunk)
+        yield chunk
+
+
+def _open_upload_reader(file, fmt, chunksize):
+    if fmt == 'csv':
+        reader = pd.read_csv(file, chunksize=chunksize)
+    elif fmt == 'csv.gz':
+        reader = pd.read_csv(file.stream, chunksize=chunksize, compression='gzip')
+    elif fmt == 'csv.zst':
+        reader = pd.read_csv(file.stream, chunksize=chunksize, compression='zstd')
+    elif fmt == 'excel':
+        reader = _iter_excel_chunks(file, chunksize)
+    elif fmt == 'parquet':
+        reader = _iter_arrow_chunks(pq.ParquetFile(file.stream).iter_batches(batch_size=chunksize), chunksize)
+    elif fmt == 'feather':
+        reader = _iter_arrow_chunks(_iter_feather_batches(file), chunksize)
+    elif fmt == 'feather_v1':
+        # Feather v1 has no record batches, so it is read whole.
+        reader = _iter_arrow_chunks(feather.read_table(file.stream).to_batches(chunksize), chunksize)
+    elif fmt == 'arrow_stream':
+        reader = _iter_arrow_chunks(pa.ipc.open_stream(file.stream), chunksize)
+    else:
+        raise ValueError(UNSUPPORTED_UPLOAD)
+    return iter(reader)
+
+
+def _read_upload(file, normalize=None, columns=None):
+    """Read a whole upload through the chunked reader, keeping only `columns` when given."""
+    parts = [chunk[columns] if columns else chunk for chunk in _iter_upload_chunks(file, normalize)]
+    if not parts:
+        return pd.DataFrame(columns=columns or [])
+    return pd.concat(parts, ignore_index=True)
+
+
+class _StreamStats:
+    """Running count/sum/min/max of one column, updated a chunk at a time."""
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def update(self, s: pd.Series):
+        s = s.dropna()
+        if s.empty:
+            return
+        self.count += int(s.size)
+        if s.dtype.kind in 'iufb':
+            self.total += float(s.sum())
+        lo, hi = s.min(), s.max()
+        self.min = lo if self.min is None or lo < self.min else self.min
+        self.max = hi if self.max is None or hi > self.max else self.max
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else None
+
+
+# --- Data quality screening ---
+# Default for requests without ?qc=: off, flag (screen and report) or drop (ML routes also
+# train without rejected rows).
+QC_MODE = os.environ.get('QC_MODE', 'off')
+# Plausible ranges per variable; values outside fail.
+QC_RANGES = {
+    'temperature_C': (-2.5, 40.0),
+    'salinity_PSU': (0.0, 42.0),
+    'oxygen_mgL': (0.0, 20.0),
+    'pH': (6.5, 9.0),
+    'depth_m': (0.0, 11000.0),
+}
+# Variables screened for spikes, with the smallest deviation scale (instrument resolution).
+QC_SPIKE_FLOOR = {'temperature_C': 0.05, 'salinity_PSU': 0.05, 'oxygen_mgL': 0.1, 'pH': 0.02}
+QC_SPIKE_WINDOW = int(os.environ.get('QC_SPIKE_WINDOW', '7'))
+QC_SPIKE_K = float(os.environ.get('QC_SPIKE_K', '10'))
+QC_STATION_DEG = float(os.environ.get('QC_STATION_DEG', '0.01'))
+# Upper bound on the rows carried between chunks for the spike test (last windows per station).
+QC_TAIL_ROWS = int(os.environ.get('QC_TAIL_ROWS', '16384'))
+# QARTOD flag values.
+QC_PASS, QC_SUSPECT, QC_FAIL, QC_MISSING = 1, 3, 4, 9
+_QC_NAMES = {QC_PASS: 'pass', QC_SUSPECT: 'suspect', QC_FAIL: 'fail', QC_MISSING: 'missing'}
+
+
+def _qc_mode():
+    """None, 'flag' or 'drop', from qc=0/1/flag/drop on the request, else QC_MODE."""
+    value = ((request.values.get('qc') if has_request_context() else None) or QC_MODE).lower()
+    if value == 'drop':
+        return 'drop'
+    return 'flag' if value in ('1', 'true', 'yes', 'on', 'flag') else None
+
+
+def _qc_flag_columns() -> bool:
+    """qc_flags=1: returned records keep the qc_* flag columns."""
+    return request.values.get('qc_flags', '').lower() in ('1', 'true', 'yes')
+
+
+class _HashSet:
+    """A set of uint64 row hashes kept as a few sorted arrays that are merged as they grow."""
+
+    def __init__(self):
+        self.levels = []
+
+    def contains(self, hashes: np.ndarray) -> np.ndarray:
+        """Membership of sorted `hashes` (sorted queries keep the binary searches cache-local)."""
+        found = np.zeros(len(hashes), dtype=bool)
+        for level in self.levels:
+            pos = np.minimum(np.searchsorted(level, hashes), len(level) - 1)
+            found |= level[pos] == hashes
+        return found
+
+    def add(self, hashes: np.ndarray):
+        """Add sorted `hashes`."""
+        self.levels.append(hashes)
+        while len(self.levels) > 1 and len(self.levels[-2]) <= 2 * len(self.levels[-1]):
+            newer, older = self.levels.pop(), self.levels.pop()
+            # Two sorted runs: the stable sort merges them in linear time.
+            self.levels.append(np.sort(np.concatenate([older, newer]), kind='stable'))
+
+
+def _column_median(columns) -> np.ndarray:
+    """Element-wise median of equally long arrays, by an odd-even transposition sorting
+    network: a fixed sequence of np.minimum/np.maximum over whole columns."""
+    cols = list(columns)
+    w = len(cols)
+    for p in range(w):
+        for i in range(p % 2, w - 1, 2):
+            cols[i], cols[i + 1] = np.minimum(cols[i], cols[i + 1]), np.maximum(cols[i], cols[i + 1])
+    return cols[w // 2] if w % 2 else (cols[w // 2 - 1] + cols[w // 2]) / 2
+
+
+class _QualityControl:
+    """Vectorized QC over a stream of chunks with QARTOD-style flags per variable:
+    1 pass, 3 suspect (spike), 4 fail (outside QC_RANGES), 9 missing.
+
+    A spike is a value further than QC_SPIKE_K scaled MADs from the median of the
+    previous QC_SPIKE_WINDOW values of the same station (position rounded to
+    QC_STATION_DEG), in time order. A station's first QC_SPIKE_WINDOW values, and values
+    whose window holds a missing or failed one, are not tested; the last window of each
+    station (up to QC_TAIL_ROWS rows in all) is carried into the next chunk. Rows whose
+    hash over `hash_columns` was already seen are duplicates.
+    `columns` maps QC_RANGES names to the frame's column names.
+    """
+
+    def __init__(self, columns=None, position=('lat', 'lon'), time_column='date', hash_columns=None):
+        self.columns = columns or {name: name for name in QC_RANGES}
+        self.position = position
+        self.time_column = time_column
+        self.hash_columns = hash_columns
+        self.rows = self.duplicates = 0
+        self.counts = {}
+        self._tail = (np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), np.empty((0, 0), dtype=np.float32))
+        self._seen = _HashSet()
+
+    def flag_columns(self, frame) -> list:
+        return [f'qc_{col}' for col in self.columns.values() if f'qc_{col}' in frame.columns]
+
+    def _stations(self, frame: pd.DataFrame):
+        """Station key and time (ns) per row, and whether both are known."""
+        n = len(frame)
+        lat_col, lon_col = self.position or (None, None)
+        if lat_col in frame.columns and lon_col in frame.columns:
+            lat = np.round(pd.to_numeric(frame[lat_col], errors='coerce').to_numpy(dtype=float) / QC_STATION_DEG)
+            lon = np.round(pd.to_numeric(frame[lon_col], errors='coerce').to_numpy(dtype=float) / QC_STATION_DEG)
+            known = np.isfinite(lat) & np.isfinite(lon)
+            key = np.where(known, (np.nan_to_num(lat) + 2 ** 24) * 2 ** 26 + np.nan_to_num(lon), -1).astype(np.int64)
+        else:  # no positions: the whole upload is one station
+            key, known = np.zeros(n, dtype=np.int64), np.ones(n, dtype=bool)
+        if self.time_column in frame.columns:
+            t = frame[self.time_column]
+            if not pd.api.types.is_datetime64_any_dtype(t):
+                t = pd.to_datetime(t, errors='coerce')
+            t = t.to_numpy(dtype='datetime64[ns]').view(np.int64)
+            known &= t != _NAT
+        else:  # no dates: upload order
+            t = self.rows + np.arange(n, dtype=np.int64)
+        return key, t, known
+
+    def _spikes(self, values: np.ndarray, floor: np.ndarray, known, key, t) -> np.ndarray:
+        """Spike mask for the (rows, variables) array `values`; missing or failing values
+        are NaN, and windows that contain one do not test."""
+        w = QC_SPIKE_WINDOW
+        tail_key, tail_t, tail_v = self._tail
+        if tail_v.shape[1] != values.shape[1]:
+            tail_key, tail_t, tail_v = key[:0], t[:0], np.empty((0, values.shape[1]), dtype=np.float32)
+        idx = np.flatnonzero(known)
+        k = np.concatenate([tail_key, key[idx]])
+        tt = np.concatenate([tail_t, t[idx]])
+        v = np.concatenate([tail_v, values[idx].astype(np.float32)])
+        n = len(k)
+        # Station files usually arrive in (station, time) order already; only sort if not.
+        dk = np.diff(k)
+        if np.all((dk > 0) | ((dk == 0) & (np.diff(tt) >= 0))):
+            order = np.arange(n)
+        else:
+            order = np.lexsort((tt, k))
+            k, tt, v = k[order], tt[order], v[order]
+        pos = np.arange(n)
+        first = np.r_[True, k[1:] != k[:-1]] if n else np.zeros(0, dtype=bool)
+        in_group = pos - np.maximum.accumulate(np.where(first, pos, 0)) if n else pos
+
+        # Only this chunk's rows with a full window from their own station are tested;
+        # column j of the window holds the values j + 1 places before them.
+        new = order >= len(tail_key)
+        tested = np.flatnonzero(new & (in_group >= w))
+        window = [v[tested - j - 1] for j in range(w)]
+        med = _column_median(window)
+        mad = _column_median([np.abs(col - med) for col in window])
+        scale = np.maximum(np.float32(1.4826) * mad, floor)
+        spike = np.abs(v[tested] - med) > np.float32(QC_SPIKE_K) * scale
+
+        # Carry each station's last window, keeping the newest rows when there are too many.
+        last = np.r_[k[1:] != k[:-1], True] if n else np.zeros(0, dtype=bool)
+        group_end = np.minimum.accumulate(np.where(last, pos, n)[::-1])[::-1]
+        keep = np.flatnonzero(group_end - pos < w)
+        if len(keep) > QC_TAIL_ROWS:
+            keep = np.sort(keep[np.argpartition(tt[keep], len(keep) - QC_TAIL_ROWS)[len(keep) - QC_TAIL_ROWS:]])
+        self._tail = (k[keep], tt[keep], v[keep])
+
+        out = np.zeros(values.shape, dtype=bool)
+        out[idx[order[tested] - len(tail_key)]] = spike
+        return out
+
+    def _duplicates(self, frame: pd.DataFrame) -> np.ndarray:
+        columns = [c for c in (self.hash_columns or frame.columns) if c in frame.columns and not str(c).startswith('qc_')]
+        # Hash numbers as float64 so int32/float32 chunks of compact frames hash alike.
+        parts = {c: frame[c].to_numpy(dtype=float) if frame[c].dtype.kind in 'iufb' else frame[c] for c in columns}
+        hashes = pd.util.hash_pandas_object(pd.DataFrame(parts, index=frame.index), index=False).to_numpy()
+        dup = pd.Series(hashes).duplicated().to_numpy(copy=True)
+        order = np.argsort(hashes)
+        hashes = hashes[order]
+        dup[order] |= self._seen.contains(hashes)
+        self._seen.add(hashes)
+        return dup
+
+    def screen(self, frame: pd.DataFrame, context: pd.DataFrame = None) -> pd.DataFrame:
+        """Add qc_<column> flags and qc_duplicate to `frame` (in place) and count them.
+
+        Positions, dates and duplicate hashes are read from `context` (default: the frame itself).
+        """
+        key, t, known = self._stations(frame if context is None else context)
+        n = len(frame)
+        flags, spiky = {}, {}
+        for name, col in self.columns.items():
+            if col not in frame.columns:
+                continue
+            values = pd.to_numeric(frame[col], errors='coerce').to_numpy(dtype=float)
+            lo, hi = QC_RANGES[name]
+            fail = (values < lo) | (values > hi)
+            flags[col] = np.where(np.isnan(values), QC_MISSING, np.where(fail, QC_FAIL, QC_PASS)).astype(np.int8)
+            if name in QC_SPIKE_FLOOR:
+                spiky[name] = np.where(fail, np.nan, values)
+        if spiky:
+            floor = np.array([QC_SPIKE_FLOOR[name] for name in spiky], dtype=np.float32)
+            spikes = self._spikes(np.column_stack(list(spiky.values())), floor, known, key, t)
+            for j, name in enumerate(spiky):
+                flags[self.columns[name]][spikes[:, j]] = QC_SUSPECT
+        for col, flag in flags.items():
+            frame[f'qc_{col}'] = flag
+            totals = np.bincount(flag, minlength=QC_MISSING + 1)
+            counts = self.counts.setdefault(col, dict.fromkeys(_QC_NAMES.values(), 0))
+            for code, label in _QC_NAMES.items():
+                counts[label] += int(totals[code])
+        dup = self._duplicates(frame if context is None else context)
+        frame['qc_duplicate'] = dup
+        self.rows += n
+        self.duplicates += int(dup.sum())
+        return frame
+
+    def rejected(self, frame: pd.DataFrame) -> np.ndarray:
+        """Rows with any failed variable or a duplicate sample."""
+        bad = frame['qc_duplicate'].to_numpy().copy()
+        for col in self.flag_columns(frame):
+            bad |= frame[col].to_numpy() == QC_FAIL
+        return bad
+
+    @staticmethod
+    def strip(frame: pd.DataFrame) -> pd.DataFrame:
+        """`frame` without the flag columns screen() added."""
+        return frame[[c for c in frame.columns if not str(c).startswith('qc_')]]
+
+    def drop_rejected(self, frame: pd.DataFrame, rows: dict) -> pd.DataFrame:
+        """`frame` without rejected rows or flag columns; the drops are counted into `rows`."""
+        dup = frame['qc_duplicate'].to_numpy()
+        bad = self.rejected(frame)
+        rows['dropped_duplicate'] = rows.get('dropped_duplicate', 0) + int(dup.sum())
+        rows['dropped_qc'] = rows.get('dropped_qc', 0) + int((bad & ~dup).sum())
+        return self.strip(frame.loc[~bad])
+
+    def summary(self) -> dict:
+        return {'rows': self.rows, 'duplicates': self.duplicates, 'variables': self.counts}
+
+
+# --- Persistent dataset store ---
+DATASET_DIR = os.environ.get('DATASET_DIR', 'datasets')
+
+
+def _arrow_ready(df: pd.DataFrame, schema: _Schema) -> pd.DataFrame:
+    """Give every column a stable type (float64, datetime64 or string) so all chunks share one Arrow schema."""
+    out = {}
+    for col in df.columns:
+        s = df[col]
+        if col == 'date' or s.dtype.kind == 'M':
+            s = pd.to_datetime(s, errors='coerce')
+        elif col in schema.text or s.dtype.kind not in 'iufb':
+            s = s.astype('string')
+        else:
+            s = s.astype('float64')
+        out[str(col)] = s
+    return pd.DataFrame(out)
+
+
+def _widen_schema(schema, other):
+    """Field-wise common schema of two dataset schemas (same names in `schema`'s order).
+
+    Every _arrow_ready column is float64, timestamp or string, and all of them cast to
+    string, so a field whose types disagree becomes a string field.
+    """
+    fields = []
+    for field in schema:
+        i = other.get_field_index(field.name)
+        kind = other.field(i).type if i >= 0 else field.type
+        if kind != field.type:
+            text = [t for t in (field.type, kind) if pa.types.is_string(t) or pa.types.is_large_string(t)]
+            field = field.with_type(text[0] if text else pa.large_string())
+        fields.append(field)
+    return pa.schema(fields, metadata=schema.metadata)
+
+
+class _DatasetStore:
+    """Normalized uploads persisted as uncompressed Arrow IPC files, read back memory-mapped.
+
+    Chunks from the streaming reader are appended to the IPC writer as they arrive, so
+    storing a file never holds more than one chunk in memory.
+    """
+
+    schemas = {'ocean': OCEAN_SCHEMA, 'fisheries': FISHERIES_SCHEMA}
+
+    def __init__(self, root):
+        self.root = root
+        self._lock = threading.Lock()
+
+    def _path(self, dataset_id, ext):
+        return os.path.join(self.root, f'{dataset_id}.{ext}')
+
+    def _segment_path(self, dataset_id, segment):
+        return self._path(dataset_id, 'arrow' if segment == 0 else f'{segment}.arrow')
+
+    @staticmethod
+    def _rewrite(tmp, new_tmp, arrow_schema):
+        """Copy the IPC file `tmp` to `new_tmp` cast to the wider `arrow_schema`; returns
+        (new_tmp, an open writer on it)."""
+        writer = pa.ipc.new_file(new_tmp, arrow_schema)
+        with pa.memory_map(tmp) as source:
+            reader = pa.ipc.open_file(source)
+            for i in range(reader.num_record_batches):
+                writer.write_table(pa.Table.from_batches([reader.get_batch(i)]).cast(arrow_schema))
+        os.remove(tmp)
+        return new_tmp, writer
+
+    def _write(self, path, file, kind, arrow_schema=None):
+        """Stream an upload into one IPC file at `path`; returns (arrow schema, rows).
+
+        Chunks are cast to the schema of the first one (or to `arrow_schema`, for appends).
+        A column whose type changes between chunks, e.g. an extra column that is empty in
+        the first chunk and text later, is widened to string and the rows written so far
+        are rewritten once.
+        """
+        schema = self.schemas[kind]
+        tmp = path + '.tmp'
+        writer, rows, generation = None, 0, 0
+        try:
+            for chunk in _iter_upload_chunks(file, lambda c: _normalize_columns(c, schema)):
+                table = pa.Table.from_pandas(_arrow_ready(chunk, schema), preserve_index=False)
+                if arrow_schema is None:
+                    arrow_schema = table.schema
+                else:
+                    for name in arrow_schema.names:
+                        if name not in table.column_names:
+                            table = table.append_column(name, pa.nulls(table.num_rows, arrow_schema.field(name).type))
+                    table = table.select(arrow_schema.names)
+                    wider = _widen_schema(arrow_schema, table.schema)
+                    if not wider.equals(arrow_schema):
+                        arrow_schema = wider
+                        if writer is not None:
+                            writer.close()
+                            generation += 1
+                            tmp, writer = self._rewrite(tmp, f'{path}.tmp{generation}', arrow_schema)
+                    table = table.cast(arrow_schema)
+                if writer is None:
+                    writer = pa.ipc.new_file(tmp, arrow_schema)
+                writer.write_table(table)
+                rows += table.num_rows
+        except Exception:
+            if writer is not None:
+                writer.close()
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+        if writer is None:
+            raise ValueError("Uploaded file contains no rows.")
+        writer.close()
+        os.replace(tmp, path)
+        return arrow_schema, rows
+
+    def _save_meta(self, meta):
+        tmp = self._path(meta['dataset_id'], 'json.tmp')
+        with open(tmp, 'w') as f:
+            json.dump(meta, f)
+        os.replace(tmp, self._path(meta['dataset_id'], 'json'))
+
+    @contextlib.contextmanager
+    def _locked(self, dataset_id):
+        """Hold the write lock of one dataset: the store's thread lock, plus an exclusive
+        flock on <id>.lock so that other worker processes wait too (where fcntl exists)."""
+        with self._lock:
+            if fcntl is None:
+                yield
+                return
+            with open(self._path(dataset_id, 'lock'), 'a') as f:
+                fcntl.flock(f, fcntl.LOCK_EX)
+                yield
+
+    def store(self, file, kind) -> dict:
+        os.makedirs(self.root, exist_ok=True)
+        dataset_id = uuid.uuid4().hex
+        with self._locked(dataset_id):
+            arrow_schema, rows = self._write(self._path(dataset_id, 'arrow'), file, kind)
+            meta = {
+                'dataset_id': dataset_id,
+                'kind': kind,
+                'rows': rows,
+                'segments': 1,
+                'columns': arrow_schema.names,
+                'source': file.filename,
+                'bytes': os.path.getsize(self._path(dataset_id, 'arrow')),
+                'created': time.time(),
+            }
+            self._save_meta(meta)
+        return meta
+
+    def append(self, dataset_id, file):
+        """Add the rows of an upload to a stored dataset as a new IPC segment; returns the updated
+        meta, or None when the dataset was deleted meanwhile.
+
+        Columns missing from the upload are stored as nulls; extra columns are dropped.
+        """
+        with self._locked(dataset_id):
+            meta = self.meta(dataset_id)
+            if meta is None:
+                return None
+            segment = meta.get('segments', 1)
+            arrow_schema = self.read_table(dataset_id).schema
+            path = self._segment_path(dataset_id, segment)
+            _, rows = self._write(path, file, meta['kind'], arrow_schema)
+            meta.update(rows=meta['rows'] + rows, segments=segment + 1,
+                        bytes=meta['bytes'] + os.path.getsize(path), updated=time.time())
+            self._save_meta(meta)
+            return meta
+
+    def meta(self, dataset_id):
+        if not dataset_id.isalnum():
+            return None
+        try:
+            with open(self._path(dataset_id, 'json')) as f:
+                return json.load(f)
+        except OSError:
+            return None
+
+    def read_segment(self, dataset_id, segment, columns=None):
+        return feather.read_table(self._segment_path(dataset_id, segment), columns=columns, memory_map=True)
+
+    def read_table(self, dataset_id, columns=None):
+        """The whole dataset, memory-mapped; appended segments are concatenated without copying."""
+        segments = (self.meta(dataset_id) or {}).get('segments', 1)
+        tables = [self.read_segment(dataset_id, i, columns) for i in range(segments)]
+        if len(tables) == 1:
+            return tables[0]
+        # An append may have widened a column to string; cast the other segments to match.
+        arrow_schema = functools.reduce(_widen_schema, (t.schema for t in tables))
+        return pa.concat_tables([t if t.schema.equals(arrow_schema) else t.cast(arrow_schema) for t in tables])
+
+    def iter_chunks(self, dataset_id, columns=None, rows=None, chunksize=None):
+        """Yield the stored frame in chunks from a memory-mapped read of the IPC file.
+
+        `rows`, if given, is an array of row positions (e.g. from a spatial query) to take.
+        """
+        chunksize = chunksize or INGEST_CHUNK_ROWS
+        table = self.read_table(dataset_id, columns)
+        if rows is not None:
+            for start in range(0, len(rows), chunksize):
+                part = table.take(pa.array(rows[start:start + chunksize]))
+                _job_stage('parse', part.num_rows)
+                yield part.to_pandas()
+            return
+        for batch in table.to_batches(max_chunksize=chunksize):
+            _job_stage('parse', batch.num_rows)
+            yield batch.to_pandas()
+
+    def delete(self, dataset_id):
+        with self._locked(dataset_id):
+            segments = (self.meta(dataset_id) or {}).get('segments', 1)
+            paths = [self._segment_path(dataset_id, i) for i in range(segments)]
+            paths += [self._path(dataset_id, ext) for ext in ('json', 'cube.arrow', 'cube_lengths.arrow', 'lock')]
+            for path in paths:
+                if os.path.exists(path):
+                    os.remove(path)
+
+
+dataset_store = _DatasetStore(DATASET_DIR)
+
+
+def _has_data_source() -> bool:
+    return bool(request.values.get('dataset_id')) or ('file' in request.files and request.files['file'].filename != '')
+
+
+def _request_chunks(kind, normalize=True):
+    """Chunks of the request's data: a stored dataset (dataset_id=...) or the uploaded 'file'.
+
+    Datasets can be narrowed with the spatial/temporal filters of _spatial_query_args.
+    Uploaded files are normalized to `kind` unless normalize=False, and compacted
+    (see _compact_frame) when _compact_mode() is on. Returns (chunks, None), or
+    (None, error response) when the source is missing or invalid.
+    """
+    dataset_id = request.values.get('dataset_id')
+    compact = _compact_mode()
+    if dataset_id:
+        if pa is None:
+            return None, (jsonify({"error": "Dataset store requires pyarrow on the server."}), 503)
+        meta = dataset_store.meta(dataset_id)
+        if meta is None:
+            return None, (jsonify({"error": f"Unknown dataset_id '{dataset_id}'."}), 404)
+        if meta['kind'] != kind:
+            return None, (jsonify({"error": f"Dataset '{dataset_id}' holds {meta['kind']} data, expected {kind}."}), 400)
+        try:
+            query = _spatial_query_args()
+        except (ValueError, KeyError) as e:
+            return None, (jsonify({"error": f"Invalid query: {str(e)}"}), 400)
+        rows = _dataset_index(dataset_id).query(**query) if query else None
+        chunks = dataset_store.iter_chunks(dataset_id, rows=rows)
+        if compact and normalize:
+            schema = _DatasetStore.schemas[kind]
+            chunks = (_normalize_columns(c, schema, compact) for c in chunks)
+        return chunks, None
+    if 'file' not in request.files or request.files['file'].filename == '':
+        return None, (jsonify({"error": "No file uploaded."}), 400)
+    file = request.files['file']
+    if _upload_format(file) is None:
+        return None, (jsonify({"error": UNSUPPORTED_UPLOAD}), 400)
+    if _stream_mode():
+        _keep_upload_open(file)
+    schema = _DatasetStore.schemas[kind] if normalize else None
+    return _iter_upload_chunks(file, (lambda c: _normalize_columns(c, schema, compact)) if schema else None), None
+
+
+@app.route('/api/datasets', methods=['POST'])
+def create_dataset():
+    """Parse and normalize an upload once (kind=ocean|fisheries) and return its dataset_id."""
+    if pa is None:
+        return jsonify({"error": "Dataset store requires pyarrow on the server."}), 503
+    kind = request.values.get('kind', 'ocean')
+    if kind not in _DatasetStore.schemas:
+        return jsonify({"error": "kind must be 'ocean' or 'fisheries'."}), 400
+    if 'file' not in request.files or request.files['file'].filename == '':
+        return jsonify({"error": "No file uploaded."}), 400
+    file = request.files['file']
+    if _upload_format(file) is None:
+        return jsonify({"error": UNSUPPORTED_UPLOAD}), 400
+    try:
+        return jsonify(dataset_store.store(file, kind)), 201
+    except _UploadParseError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"error": f"Could not store dataset: {str(e)}"}), 500
+
+
+@app.route('/api/datasets/<dataset_id>', methods=['GET', 'DELETE'])
+def dataset_detail(dataset_id):
+    meta = dataset_store.meta(dataset_id)
+    if meta is None:
+        return jsonify({"error": f"Unknown dataset_id '{dataset_id}'."}), 404
+    if request.method == 'DELETE':
+        dataset_store.delete(dataset_id)
+        _build_dataset_index.cache_clear()
+        _cube_cache.pop(dataset_id, None)
+    return jsonify(meta)
+
+
+@app.route('/api/datasets/<dataset_id>/append', methods=['POST'])
+def append_dataset(dataset_id):
+    """Append the rows of an uploaded file to a stored dataset (same kind, same columns)."""
+    if pa is None:
+        return jsonify({"error": "Dataset store requires pyarrow on the server."}), 503
+    if dataset_store.meta(dataset_id) is None:
+        return jsonify({"error": f"Unknown dataset_id '{dataset_id}'."}), 404
+    if 'file' not in request.files or request.files['file'].filename == '':
+        return jsonify({"error": "No file uploaded."}), 400
+    file = request.files['file']
+    if _upload_format(file) is None:
+        return jsonify({"error": UNSUPPORTED_UPLOAD}), 400
+    try:
+        meta = dataset_store.append(dataset_id, file)
+    except _UploadParseError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"error": f"Could not append to dataset: {str(e)}"}), 500
+    if meta is None:
+        return jsonify({"error": f"Unknown dataset_id '{dataset_id}'."}), 404
+    _build_dataset_index.cache_clear()
+    if meta['kind'] == 'fisheries' and _has_cube(dataset_id):
+        _dataset_cube(dataset_id)  # folds just the new segment into the existing cube
+    return jsonify(meta)
+
+
+# --- Spatio-temporal index ---
+SPATIAL_CELL_DEG = float(os.environ.get('SPATIAL_CELL_DEG', '1.0'))
+EARTH_RADIUS_KM = 6371.0088
+_NAT = np.iinfo(np.int64).min
+
+
+def _haversine_km(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = map(np.radians, (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+class _SpatioTemporalIndex:
+    """Grid-bucket index over lat/lon plus a sorted date index for one stored dataset.
+
+    Rows are ordered by grid cell so a bounding box only touches the rows of the
+    cells it overlaps; time windows are two binary searches over the sorted dates.
+    Candidates from either index are then filtered exactly on the remaining columns.
+    """
+
+    def __init__(self, lat, lon, dates, depth, cell_deg=SPATIAL_CELL_DEG):
+        self.lat, self.lon, self.dates, self.depth = lat, lon, dates, depth
+        self.cell_deg = cell_deg
+        self.n_rows = int(np.ceil(180.0 / cell_deg))
+        self.n_cols = int(np.ceil(360.0 / cell_deg))
+
+        cells = self._cells(lat, lon)
+        self.cell_order = np.argsort(cells, kind='stable')
+        self.cell_ids, self.cell_starts = np.unique(cells[self.cell_order], return_index=True)
+        self.cell_ends = np.append(self.cell_starts[1:], len(cells))
+
+        dated = np.flatnonzero(dates != _NAT)
+        self.date_order = dated[np.argsort(dates[dated], kind='stable')]
+        self.sorted_dates = dates[self.date_order]
+
+    def _cells(self, lat, lon):
+        row = np.clip(np.floor((lat + 90.0) / self.cell_deg), 0, self.n_rows - 1)
+        col = np.clip(np.floor((lon + 180.0) / self.cell_deg), 0, self.n_cols - 1)
+        cells = row * self.n_cols + col
+        cells[~(np.isfinite(lat) & np.isfinite(lon))] = -1
+        return cells.astype(np.int64)
+
+    def _bbox_rows(self, min_lon, min_lat, max_lon, max_lat):
+        if min_lon > max_lon:  # box crosses the antimeridian
+            return np.concatenate([self._bbox_rows(min_lon, min_lat, 180.0, max_lat),
+                                   self._bbox_rows(-180.0, min_lat, max_lon, max_lat)])
+        r0, r1 = self._cells(np.array([min_lat, max_lat]), np.array([min_lon, min_lon])) // self.n_cols
+        c0, c1 = self._cells(np.array([min_lat, min_lat]), np.array([min_lon, max_lon])) % self.n_cols
+        wanted = (np.arange(r0, r1 + 1)[:, None] * self.n_cols + np.arange(c0, c1 + 1)[None, :]).ravel()
+        pos = np.searchsorted(self.cell_ids, wanted)
+        hit = pos < len(self.cell_ids)
+        hit[hit] = self.cell_ids[pos[hit]] == wanted[hit]
+        pos = pos[hit]
+        if pos.size == 0:
+            return np.empty(0, dtype=np.int64)
+        rows = np.concatenate([self.cell_order[s:e] for s, e in zip(self.cell_starts[pos], self.cell_ends[pos])])
+        lat, lon = self.lat[rows], self.lon[rows]
+        return rows[(lat >= min_lat) & (lat <= max_lat) & (lon >= min_lon) & (lon <= max_lon)]
+
+    def query(self, bbox=None, center=None, radius_km=None, start=None, end=None, min_depth=None, max_depth=None):
+        """Sorted row positions matching every given filter (dates as int64 ns)."""
+        rows = None
+        if bbox is not None:
+            rows = self._bbox_rows(*bbox)
+        if center is not None and radius_km is not None:
+            lat0, lon0 = center
+            dlat = radius_km / 111.32
+            dlon = 180.0 if abs(lat0) + dlat >= 90 else min(180.0, dlat / np.cos(np.radians(lat0)))
+            if dlon >= 180.0:
+                lo, hi = -180.0, 180.0
+            else:
+                lo, hi = lon0 - dlon, lon0 + dlon
+                lo, hi = (lo + 360.0 if lo < -180.0 else lo), (hi - 360.0 if hi > 180.0 else hi)
+            near = self._bbox_rows(lo, max(-90.0, lat0 - dlat), hi, min(90.0, lat0 + dlat))
+            near = near[_haversine_km(lat0, lon0, self.lat[near], self.lon[near]) <= radius_km]
+            rows = near if rows is None else np.intersect1d(rows, near)
+        if start is not None or end is not None:
+            lo = np.int64(start) if start is not None else _NAT + 1
+            hi = np.int64(end) if end is not None else np.iinfo(np.int64).max
+            if rows is None:
+                rows = self.date_order[np.searchsorted(self.sorted_dates, lo, 'left'):
+                                       np.searchsorted(self.sorted_dates, hi, 'right')]
+            else:
+                d = self.dates[rows]
+                rows = rows[(d != _NAT) & (d >= lo) & (d <= hi)]
+        if rows is None:
+            rows = np.arange(len(self.lat))
+        if min_depth is not None:
+            rows = rows[self.depth[rows] >= min_depth]
+        if max_depth is not None:
+            rows = rows[self.depth[rows] <= max_depth]
+        return np.sort(rows)
+
+
+def _dataset_index(dataset_id) -> _SpatioTemporalIndex:
+    """The spatio-temporal index of a stored dataset at its current version.
+
+    The version (rows and segments from the dataset's meta file) is part of the cache
+    key, so an append made through another worker process is picked up here too.
+    """
+    meta = dataset_store.meta(dataset_id)
+    return _build_dataset_index(dataset_id, meta['rows'], meta.get('segments', 1))
+
+
+@functools.lru_cache(maxsize=8)
+def _build_dataset_index(dataset_id, rows, segments) -> _SpatioTemporalIndex:
+    """Build (once per process and dataset version) the spatio-temporal index of a stored dataset."""
+    names = dataset_store.meta(dataset_id)['columns']
+    table = dataset_store.read_table(dataset_id, [c for c in ('lat', 'lon', 'date', 'depth_m') if c in names])
+
+    def column(name):
+        if name not in table.column_names:
+            return np.full(table.num_rows, np.nan)
+        return table.column(name).to_pandas().to_numpy(dtype=float)
+
+    if 'date' in table.column_names:
+        dates = table.column('date').to_pandas().to_numpy(dtype='datetime64[ns]').view(np.int64)
+    else:
+        dates = np.full(table.num_rows, _NAT, dtype=np.int64)
+    return _SpatioTemporalIndex(column('lat'), column('lon'), dates, column('depth_m'))
+
+
+def _spatial_query_args() -> dict:
+    """Filters from the request: bbox=min_lon,min_lat,max_lon,max_lat; lat, lon, radius_km;
+    start, end (dates, end inclusive); min_depth, max_depth. Raises ValueError on bad input."""
+    v = request.values
+    query = {}
+    if v.get('bbox'):
+        bbox = tuple(float(x) for x in v['bbox'].split(','))
+        if len(bbox) != 4:
+            raise ValueError("bbox must be min_lon,min_lat,max_lon,max_lat")
+        query['bbox'] = bbox
+    if v.get('radius_km'):
+        query['center'] = (float(v['lat']), float(v['lon']))
+        query['radius_km'] = float(v['radius_km'])
+    if v.get('start'):
+        query['start'] = pd.Timestamp(v['start']).value
+    if v.get('end'):
+        end = pd.Timestamp(v['end'])
+        if len(v['end']) <= 10:  # a bare date covers the whole day
+            end = end + pd.Timedelta(days=1) - pd.Timedelta(1, 'ns')
+        query['end'] = end.value
+    for key in ('min_depth', 'max_depth'):
+        if v.get(key):
+            query[key] = float(v[key])
+    return query
+
+
+@app.route('/api/datasets/<dataset_id>/query', methods=['GET', 'POST'])
+def query_dataset(dataset_id):
+    """Rows of a stored dataset inside a bounding box / radius / time window / depth range."""
+    if pa is None:
+        return jsonify({"error": "Dataset store requires pyarrow on the server."}), 503
+    if dataset_store.meta(dataset_id) is None:
+        return jsonify({"error": f"Unknown dataset_id '{dataset_id}'."}), 404
+    try:
+        query = _spatial_query_args()
+    except (ValueError, KeyError) as e:
+        return jsonify({"error": f"Invalid query: {str(e)}"}), 400
+    limit = request.values.get('limit', 1000, type=int)
+    t0 = time.perf_counter()
+    rows = _dataset_index(dataset_id).query(**query)
+    elapsed = time.perf_counter() - t0
+    head = next(dataset_store.iter_chunks(dataset_id, rows=rows[:limit]), pd.DataFrame())
+    return jsonify({
+        'dataset_id': dataset_id,
+        'count': int(len(rows)),
+        'query_ms': round(elapsed * 1000, 3),
+        'rows': _sample_records(head),
+    })
+
+
+# --- Fisheries aggregate cube ---
+CUBE_DIMS = ['species_scientific', 'month', 'life_stage', 'cell_lat', 'cell_lon']
+CUBE_CELL_DEG = float(os.environ.get('CUBE_CELL_DEG', '1.0'))
+CUBE_REGION_DEG = float(os.environ.get('CUBE_REGION_DEG', '5.0'))
+CUBE_LENGTH_BIN_MM = float(os.environ.get('CUBE_LENGTH_BIN_MM', '10'))
+CUBE_CACHE_SIZE = int(os.environ.get('CUBE_CACHE_SIZE', '8'))
+_CUBE_ROLLUPS = {
+    'species': ['species_scientific'], 'species_scientific': ['species_scientific'],
+    'month': ['month'], 'year': ['year'], 'life_stage': ['life_stage'],
+    'region': ['region_lat', 'region_lon'], 'cell': ['cell_lat', 'cell_lon'],
+}
+
+
+class _FisheriesCube:
+    """Fisheries totals keyed by species x month x life_stage x spatial cell.
+
+    `groups` holds rows / count / length_sum / length_n per key and `lengths` a
+    histogram of avg_length_mm (CUBE_LENGTH_BIN_MM bins) per key. Both are additive,
+    so appended rows are folded in with update() and every dashboard or roll-up reads
+    the cube instead of the raw rows: its cost depends on the number of keys, not rows.
+    """
+
+    def __init__(self, groups=None, lengths=None, segments=0):
+        self._groups = [] if groups is None else [groups]
+        self._lengths = [] if lengths is None else [lengths]
+        self.segments = segments
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _keys(chunk: pd.DataFrame) -> dict:
+        def column(name):
+            if name in chunk:
+                return chunk[name].to_numpy() if name not in ('species_scientific', 'life_stage') else chunk[name]
+            return np.full(len(chunk), np.nan)
+
+        dates = column('date')
+        if dates.dtype.kind != 'M':
+            dates = pd.to_datetime(pd.Series(dates), errors='coerce').to_numpy()
+        lat = pd.to_numeric(column('lat'), errors='coerce')
+        lon = pd.to_numeric(column('lon'), errors='coerce')
+        return {
+            'species_scientific': column('species_scientific'),
+            'month': dates.astype('datetime64[M]').astype('datetime64[ns]'),
+            'life_stage': column('life_stage'),
+            'cell_lat': np.floor(lat / CUBE_CELL_DEG) * CUBE_CELL_DEG,
+            'cell_lon': np.floor(lon / CUBE_CELL_DEG) * CUBE_CELL_DEG,
+        }
+
+    @staticmethod
+    def _group_ids(codes) -> np.ndarray:
+        """Dense group ids from per-dimension factorized codes (-1 marks a missing key)."""
+        ids = np.zeros(len(codes[0]), dtype=np.int64)
+        for c in codes:
+            ids = pd.factorize(ids * (int(c.max()) + 2) + (c + 1))[0]
+        return ids
+
+    @staticmethod
+    def _labels(keys: dict, rows: np.ndarray) -> pd.DataFrame:
+        out = {}
+        for dim in CUBE_DIMS:
+            values = keys[dim]
+            values = values.iloc[rows].astype(object).to_numpy() if isinstance(values, pd.Series) else values[rows]
+            out[dim] = values
+        return pd.DataFrame(out)
+
+    def update(self, chunk: pd.DataFrame):
+        """Fold a chunk of fisheries rows into the cube.
+
+        Keys are factorized to integer codes and the measures summed with bincount,
+        so a chunk costs a few linear passes however many groups it touches.
+        """
+        if chunk.empty:
+            return
+        keys = self._keys(chunk)
+        ids = self._group_ids([pd.factorize(keys[dim])[0] for dim in CUBE_DIMS])
+        n_groups = int(ids.max()) + 1
+        count = pd.to_numeric(chunk['count'], errors='coerce') if 'count' in chunk else np.full(len(chunk), np.nan)
+        length = (pd.to_numeric(chunk['avg_length_mm'], errors='coerce') if 'avg_length_mm' in chunk
+                  else np.full(len(chunk), np.nan))
+        count, length = np.asarray(count, dtype=float), np.asarray(length, dtype=float)
+        measured = ~np.isnan(length)
+
+        groups = self._labels(keys, np.unique(ids, return_index=True)[1])
+        groups['rows'] = np.bincount(ids, minlength=n_groups)
+        groups['count'] = np.bincount(ids, weights=np.nan_to_num(count), minlength=n_groups)
+        groups['length_sum'] = np.bincount(ids, weights=np.where(measured, length, 0), minlength=n_groups)
+        groups['length_n'] = np.bincount(ids[measured], minlength=n_groups)
+
+        bins = np.floor(length[measured] / CUBE_LENGTH_BIN_MM) * CUBE_LENGTH_BIN_MM
+        bin_ids = self._group_ids([ids[measured], pd.factorize(bins)[0]]) if bins.size else ids[:0]
+        first = np.unique(bin_ids, return_index=True)[1]
+        lengths = groups.loc[ids[measured][first], CUBE_DIMS].reset_index(drop=True)
+        lengths['length_bin'] = bins[first]
+        lengths['n'] = np.bincount(bin_ids, minlength=len(first))
+        with self._lock:
+            self._groups.append(groups)
+            self._lengths.append(lengths)
+
+    @classmethod
+    def _compact(cls, parts, keys, columns):
+        if not parts:
+            return pd.DataFrame(columns=keys + columns)
+        if len(parts) == 1:
+            return parts[0]
+        merged = pd.concat(parts, ignore_index=True)
+        ids = cls._group_ids([pd.factorize(merged[k])[0] for k in keys])
+        first = np.unique(ids, return_index=True)[1]
+        out = merged.loc[first, keys].reset_index(drop=True)
+        for col in columns:
+            totals = np.bincount(ids, weights=merged[col].to_numpy(dtype=float), minlength=len(first))
+            out[col] = totals.astype(merged[col].dtype)
+        return out
+
+    def tables(self):
+        """(groups, lengths), with partial updates merged on first read."""
+        with self._lock:
+            groups = self._compact(self._groups, CUBE_DIMS, ['rows', 'count', 'length_sum', 'length_n'])
+            lengths = self._compact(self._lengths, CUBE_DIMS + ['length_bin'], ['n'])
+            self._groups, self._lengths = [groups], [lengths]
+            return groups, lengths
+
+    @staticmethod
+    def _filtered(frame, species=None, life_stage=None, year=None):
+        if species:
+            frame = frame[frame['species_scientific'] == species]
+        if life_stage:
+            frame = frame[frame['life_stage'] == life_stage]
+        if year:
+            frame = frame[frame['month'].dt.year == int(year)]
+        return frame
+
+    def rollup(self, by, **filters) -> pd.DataFrame:
+        """Totals grouped by any of _CUBE_ROLLUPS (e.g. ['species', 'year', 'region'])."""
+        groups = self._filtered(self.tables()[0], **filters)
+        if not by:
+            keys = []
+        else:
+            groups = groups.assign(
+                year=groups['month'].dt.year.astype('Int64'),
+                region_lat=np.floor(groups['cell_lat'] / CUBE_REGION_DEG) * CUBE_REGION_DEG,
+                region_lon=np.floor(groups['cell_lon'] / CUBE_REGION_DEG) * CUBE_REGION_DEG)
+            keys = [k for name in by for k in _CUBE_ROLLUPS[name]]
+        columns = ['rows', 'count', 'length_sum', 'length_n']
+        if keys:
+            out = groups.groupby(keys, dropna=False, sort=True)[columns].sum().reset_index()
+        else:
+            out = groups[columns].sum().to_frame().T.astype({'rows': 'int64', 'length_n': 'int64'})
+        out['mean_length_mm'] = out['length_sum'] / out['length_n'].where(out['length_n'] > 0)
+        return out.drop(columns='length_sum')
+
+    def dashboard(self) -> dict:
+        """Summary numbers and the series behind the upload_integration2 charts."""
+        groups, lengths = self.tables()
+        abundance = groups.dropna(subset=['species_scientific']).groupby('species_scientific')['count'].sum()
+        monthly = groups.dropna(subset=['month']).groupby('month')['count'].sum().sort_index()
+        length_hist = lengths.groupby('length_bin')['n'].sum().sort_index()
+        length_n = groups['length_n'].sum()
+        return {
+            'summary': {
+                'total_samples': int(groups['rows'].sum()),
+                'unique_species': int(len(abundance)),
+                'total_fish': int(groups['count'].sum()),
+                'avg_length': float(groups['length_sum'].sum() / length_n) if length_n else None,
+            },
+            'abundance': abundance,
+            'monthly': monthly,
+            'length_hist': length_hist,
+        }
+
+    def save(self, groups_path, lengths_path):
+        """Write both tables, each tagged with `segments`. Temp names are unique per writer,
+        so workers saving the same cube at once never write into one temp file."""
+        groups, lengths = self.tables()
+        for frame, path in ((groups, groups_path), (lengths, lengths_path)):
+            table = pa.Table.from_pandas(frame, preserve_index=False)
+            table = table.replace_schema_metadata({**(table.schema.metadata or {}), b'segments': str(self.segments).encode()})
+            tmp = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+            feather.write_feather(table, tmp, compression='uncompressed')
+            os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, groups_path, lengths_path):
+        """The saved cube, or None when the two files are unreadable or were written by
+        different saves (their `segments` tags differ), so the caller rebuilds it."""
+        try:
+            groups, lengths = feather.read_table(groups_path), feather.read_table(lengths_path)
+        except (OSError, pa.ArrowInvalid):
+            return None
+        tags = [(t.schema.metadata or {}).get(b'segments') for t in (groups, lengths)]
+        if tags[0] is None or tags[0] != tags[1]:
+            return None
+        return cls(groups.to_pandas(), lengths.to_pandas(), int(tags[0]))
+
+
+_cube_cache = OrderedDict()
+_cube_lock = threading.Lock()
+
+
+def _cube_paths(dataset_id):
+    return dataset_store._path(dataset_id, 'cube.arrow'), dataset_store._path(dataset_id, 'cube_lengths.arrow')
+
+
+def _has_cube(dataset_id) -> bool:
+    return dataset_id in _cube_cache or os.path.exists(_cube_paths(dataset_id)[0])
+
+
+def _dataset_cube(dataset_id) -> _FisheriesCube:
+    """The aggregate cube of a stored fisheries dataset.
+
+    Built once from the stored rows and saved next to the dataset; segments appended
+    since it was saved are folded in incrementally.
+    """
+    with _cube_lock:
+        cube = _cube_cache.pop(dataset_id, None)
+        paths = _cube_paths(dataset_id)
+        if cube is None and os.path.exists(paths[0]):
+            cube = _FisheriesCube.load(*paths)
+        cube = cube or _FisheriesCube()
+        segments = dataset_store.meta(dataset_id).get('segments', 1)
+        if cube.segments < segments:
+            for segment in range(cube.segments, segments):
+                for batch in dataset_store.read_segment(dataset_id, segment).to_batches(max_chunksize=INGEST_CHUNK_ROWS):
+                    _job_stage('aggregate', batch.num_rows)
+                    cube.update(batch.to_pandas())
+            cube.segments = segments
+            cube.save(*paths)
+        _cube_cache[dataset_id] = cube
+        while len(_cube_cache) > CUBE_CACHE_SIZE:
+            _cube_cache.popitem(last=False)
+        return cube
+
+
+@app.route('/api/datasets/<dataset_id>/cube', methods=['GET'])
+def dataset_cube(dataset_id):
+    """Roll-ups of a fisheries dataset's cube: by=species,year,region,... plus optional
+    species / life_stage / year filters."""
+    if pa is None:
+        return jsonify({"error": "Dataset store requires pyarrow on the server."}), 503
+    meta = dataset_store.meta(dataset_id)
+    if meta is None:
+        return jsonify({"error": f"Unknown dataset_id '{dataset_id}'."}), 404
+    if meta['kind'] != 'fisheries':
+        return jsonify({"error": f"Dataset '{dataset_id}' holds {meta['kind']} data, expected fisheries."}), 400
+    by = [b for b in request.values.get('by', 'species').split(',') if b]
+    unknown = [b for b in by if b not in _CUBE_ROLLUPS]
+    if unknown:
+        return jsonify({"error": f"Unknown roll-up(s) {unknown}; use any of {sorted(_CUBE_ROLLUPS)}."}), 400
+    filters = {k: request.values.get(k) for k in ('species', 'life_stage', 'year') if request.values.get(k)}
+    t0 = time.perf_counter()
+    try:
+        table = _dataset_cube(dataset_id).rollup(by, **filters)
+    except ValueError as e:
+        return jsonify({"error": f"Invalid roll-up: {str(e)}"}), 400
+    if 'month' in table:
+        table['month'] = table['month'].dt.strftime('%Y-%m')
+    return jsonify({
+        'dataset_id': dataset_id,
+        'by': by,
+        'query_ms': round((time.perf_counter() - t0) * 1000, 3),
+        'rows': _json_records(table),
+    })
+
+
+# --- Shared state ---
+# Background jobs, lazy charts and request profiles live in process memory unless
+# STATE_DIR is set. Behind more than one worker process the follow-up request (job
+# status, chart fetch, profile) can land on another worker, so point STATE_DIR at a
+# directory every worker can reach. It holds pickles: keep it private to the service.
+STATE_DIR = os.environ.get('STATE_DIR') or None
+
+
+class _FileStore:
+    """Pickled values under one directory, visible to every worker process.
+
+    Values are written to a temp file and renamed into place, so readers never see
+    a partial write. Keys are hex tokens (uuid4().hex).
+    """
+
+    def __init__(self, root, namespace):
+        self.dir = os.path.join(root, namespace)
+        os.makedirs(self.dir, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.dir, f'{key}.pkl')
+
+    def put(self, key, value):
+        tmp = f'{self._path(key)}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(tmp, 'wb') as f:
+            pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, self._path(key))
+
+    def get(self, key):
+        if not key.isalnum():
+            return None
+        try:
+            with open(self._path(key), 'rb') as f:
+                return pickle.load(f)
+        except FileNotFoundError:
+            return None
+
+    def touch(self, key):
+        try:
+            os.utime(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def prune(self, max_entries=None, max_bytes=None, max_age=None):
+        """Delete the least recently written (or touched) values beyond any of the limits."""
+        entries = []
+        with os.scandir(self.dir) as it:
+            for entry in it:
+                if entry.name.endswith('.pkl'):
+                    try:
+                        st = entry.stat()
+                    except FileNotFoundError:
+                        continue
+                    entries.append((st.st_mtime, st.st_size, entry.path))
+        entries.sort(reverse=True)
+        cutoff = time.time() - max_age if max_age is not None else None
+        kept = total = 0
+        for mtime, size, path in entries:
+            if ((max_entries is not None and kept >= max_entries)
+                    or (max_bytes is not None and total + size > max_bytes)
+                    or (cutoff is not None and mtime < cutoff)):
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                continue
+            kept += 1
+            total += size
+
+
+def _state_store(namespace):
+    """A _FileStore for `namespace` under STATE_DIR, or None to keep state in memory."""
+    return _FileStore(STATE_DIR, namespace) if STATE_DIR else None
+
+
+# --- Chart rendering pool ---
+CHART_WORKERS = int(os.environ.get('CHART_WORKERS', '3'))
+CHART_RENDER_TIMEOUT = float(os.environ.get('CHART_RENDER_TIMEOUT', '20'))
+LAZY_CHART_MAX = int(os.environ.get('LAZY_CHART_MAX', '256'))
+LAZY_CHART_MAX_BYTES = int(os.environ.get('LAZY_CHART_MAX_MB', '64')) * 1024 * 1024
+# Forking a multithreaded server can copy held locks into the child, so chart
+# workers start from a clean interpreter that imports only chart_render.
+CHART_START_METHOD = os.environ.get('CHART_START_METHOD') or (
+    'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn')
+
+_chart_pool = None
+_chart_pool_lock = threading.Lock()
+
+
+def _get_chart_pool() -> ProcessPoolExecutor:
+    global _chart_pool
+    with _chart_pool_lock:
+        if _chart_pool is None:
+            ctx = multiprocessing.get_context(CHART_START_METHOD)
+            if CHART_START_METHOD == 'forkserver':
+                # Workers are forks of a server that imported only the renderers, never the app
+                # or its models. (The fork server resolves it from the working directory; if it
+                # is not found there, each worker imports chart_render on its first chart.)
+                ctx.set_forkserver_preload(['chart_render'])
+            _chart_pool = ProcessPoolExecutor(max_workers=CHART_WORKERS, mp_context=ctx)
+        return _chart_pool
+
+
+def _retire_chart_pool(pool):
+    """Kill `pool`'s workers so a runaway render stops using CPU; the next call starts a fresh pool.
+
+    Renders from other requests still running on `pool` fail and are skipped.
+    """
+    global _chart_pool
+    with _chart_pool_lock:
+        if _chart_pool is pool:
+            _chart_pool = None
+    # cancel() cannot stop a render that already started, so stop the processes directly.
+    for proc in list((getattr(pool, '_processes', None) or {}).values()):
+        proc.terminate()
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def _render_charts(jobs: dict, timeout=CHART_RENDER_TIMEOUT) -> dict:
+    """Render {name: (func, args)} concurrently in worker processes and return {name: png bytes}.
+
+    Every chart shares one deadline measured from submission; a chart that fails or
+    misses it is left out of the result instead of failing the request.
+    """
+    pool = _get_chart_pool()
+    futures = {name: pool.submit(func, *args) for name, (func, args) in jobs.items()}
+    deadline = time.monotonic() + timeout
+    rendered = {}
+    retire = False
+    for name, future in futures.items():
+        try:
+            rendered[name] = future.result(timeout=max(0.0, deadline - time.monotonic()))
+        except Exception as e:
+            print(f"Chart '{name}' skipped: {e!r}")
+            if not future.cancel() and isinstance(e, (TimeoutError, BrokenProcessPool)):
+                retire = True
+    if retire:
+        _retire_chart_pool(pool)
+    return rendered
+
+
+def _chart_args_bytes(args) -> int:
+    """Approximate memory held by a chart job's arguments (arrays and frames)."""
+    total = 0
+    for arg in args:
+        if isinstance(arg, pd.DataFrame):
+            total += _frame_bytes(arg)
+        elif isinstance(arg, pd.Series):
+            total += int(arg.memory_usage(deep=True))
+        else:
+            total += getattr(arg, 'nbytes', 0)
+    return total
+
+
+class _LazyCharts:
+    """Chart jobs registered by token and rendered on first fetch, then kept as PNG bytes.
+
+    Bounded both by entry count and by bytes: pending entries hold their full
+    input arrays, so a few large uploads could otherwise pin a lot of memory.
+    With a `store` (see STATE_DIR) entries are kept there instead, so any worker
+    can serve a token another one registered.
+    """
+
+    def __init__(self, max_entries, max_bytes, store=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._store = store
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def register(self, func, args) -> str:
+        token = uuid.uuid4().hex
+        if self._store is not None:
+            self._store.put(token, (func, args))
+            self._store.prune(self.max_entries, self.max_bytes)
+            return token
+        size = _chart_args_bytes(args)
+        with self._lock:
+            self._entries[token] = [func, args, None, size]
+            self._bytes += size
+            self._evict()
+        return token
+
+    def _evict(self):
+        while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+            _, entry = self._entries.popitem(last=False)
+            self._bytes -= entry[3]
+
+    def _stored_png(self, token):
+        entry = self._store.get(token)
+        if entry is None or isinstance(entry, bytes):
+            self._store.touch(token)
+            return entry
+        func, args = entry
+        png = _render_charts({token: (func, args)}).get(token)
+        if png is not None:
+            self._store.put(token, png)
+        return png
+
+    def png(self, token):
+        if self._store is not None:
+            return self._stored_png(token)
+        with self._lock:
+            entry = self._entries.get(token)
+        if entry is None:
+            return None
+        if entry[2] is None:
+            func, args, _, _ = entry
+            png = _render_charts({token: (func, args)}).get(token)
+            if png is not None:
+                with self._lock:
+                    if self._entries.get(token) is entry:
+                        self._bytes += len(png) - entry[3]
+                    entry[1:] = [None, png, len(png)]
+                    self._evict()
+            return png
+        with self._lock:
+            if token in self._entries:
+                self._entries.move_to_end(token)
+        return entry[2]
+
+
+lazy_charts = _LazyCharts(LAZY_CHART_MAX, LAZY_CHART_MAX_BYTES, _state_store('charts'))
+
+
+@app.route('/charts/<token>.png', methods=['GET'])
+def lazy_chart(token):
+    png = lazy_charts.png(token)
+    if png is None:
+        return jsonify({"error": "Chart not found or could not be rendered."}), 404
+    return app.response_class(png, mimetype='image/png')
+
+
+# --- Background jobs ---
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS', '2'))
+JOB_TTL_SECONDS = int(os.environ.get('JOB_TTL_SECONDS', '3600'))
+JOB_ROUTES = ('upload_integration1', 'upload_integration2', 'predict_ocean', 'predict_fish', 'upload_ml_analysis')
+
+_job_local = threading.local()
+
+
+def _job_stage(stage, rows=0):
+    """Report that the current request (and background job, if any) entered `stage`."""
+    job = getattr(_job_local, 'job', None)
+    if job is not None:
+        job.enter(stage, rows)
+    timer = getattr(_job_local, 'timer', None)
+    if timer is not None:
+        timer.enter(stage, rows)
+
+
+def _frame_memory(before, after):
+    """Report the bytes of the default frame representation vs the compact one."""
+    timer = getattr(_job_local, 'timer', None)
+    if timer is not None:
+        timer.frame_bytes['baseline'] += before
+        timer.frame_bytes['compact'] += after
+
+
+class _Job:
+    """State of one queued upload: status, per-stage rows/seconds and the final response."""
+
+    def __init__(self, endpoint, store=None):
+        self.id = uuid.uuid4().hex
+        self.endpoint = endpoint
+        self._store = store
+        self.status = 'queued'
+        self.created = time.time()
+        self.finished = None
+        self.stage = None
+        self.stages = OrderedDict()
+        self.result = None
+        self.status_code = None
+        self.error = None
+        self._mark = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_store'] = None
+        return state
+
+    def save(self):
+        """Publish the job's state to the other workers (no-op without STATE_DIR)."""
+        if self._store is not None:
+            self._store.put(self.id, self)
+
+    def enter(self, stage, rows=0):
+        now = time.monotonic()
+        if self.stage is not None:
+            self.stages[self.stage]['seconds'] += now - self._mark
+        self._mark = now
+        changed = stage != self.stage
+        self.stage = stage
+        if stage is not None:
+            record = self.stages.setdefault(stage, {'rows': 0, 'seconds': 0.0})
+            record['rows'] += rows
+        if changed:
+            self.save()
+
+    def to_dict(self):
+        return {
+            'job_id': self.id,
+            'endpoint': self.endpoint,
+            'status': self.status,
+            'stage': self.stage,
+            'stages': {k: {'rows': v['rows'], 'seconds': round(v['seconds'], 3)} for k, v in self.stages.items()},
+            'created': self.created,
+            'finished': self.finished,
+            'error': self.error,
+        }
+
+
+class _JobQueue:
+    """Runs upload views on a local thread pool and keeps their responses for JOB_TTL_SECONDS.
+
+    The upload is spooled to a temp file and replayed through the unchanged view in a
+    test request context, so job results match the synchronous JSON exactly. Jobs run
+    in the worker that accepted them; with a `store` (see STATE_DIR) their state is
+    published there so any worker can answer status and result requests.
+    """
+
+    def __init__(self, workers, ttl, store=None):
+        self.ttl = ttl
+        self._store = store
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='job')
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def submit(self, endpoint, file, form, args) -> _Job:
+        self._purge()
+        job = _Job(endpoint, self._store)
+        fd, path = tempfile.mkstemp(prefix='upload-', suffix=os.path.splitext(file.filename)[1])
+        with os.fdopen(fd, 'wb') as out:
+            file.save(out)
+        with self._lock:
+            self._jobs[job.id] = job
+        job.save()
+        self._executor.submit(self._run, job, url_for(endpoint), path, file.filename, form, args)
+        return job
+
+    def _run(self, job, path_info, path, filename, form, args):
+        _job_local.job = job
+        _job_local.timer = timer = _StageTimer(job.endpoint)
+        job.status = 'running'
+        try:
+            with open(path, 'rb') as fh:
+                data = dict(form)
+                data['file'] = (fh, filename)
+                with app.test_request_context(path_info, method='POST', data=data, query_string=args):
+                    resp = app.make_response(app.view_functions[job.endpoint]())
+            job.result = resp.get_data()
+            job.status_code = resp.status_code
+            job.status = 'done' if resp.status_code < 400 else 'failed'
+        except Exception as e:
+            traceback.print_exc()
+            job.error = str(e)
+            job.status = 'failed'
+        finally:
+            job.finished = time.time()
+            job.enter(None)
+            _job_local.job = None
+            _end_request_timing(timer, job.status_code or 500)
+            os.remove(path)
+
+    def get(self, job_id):
+        self._purge()
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is None and self._store is not None:
+            job = self._store.get(job_id)
+        return job
+
+    def _purge(self):
+        cutoff = time.time() - self.ttl
+        with self._lock:
+            for job_id in [k for k, j in self._jobs.items() if j.finished is not None and j.finished < cutoff]:
+                del self._jobs[job_id]
+        if self._store is not None:
+            self._store.prune(max_age=self.ttl)
+
+
+job_queue = _JobQueue(JOB_WORKERS, JOB_TTL_SECONDS, _state_store('jobs'))
+
+
+@app.route('/api/jobs/<endpoint>', methods=['POST'])
+def submit_job(endpoint):
+    """Queue an upload for one of JOB_ROUTES and return its job id immediately."""
+    if endpoint not in JOB_ROUTES:
+        return jsonify({"error": f"Unknown job endpoint. Use one of {list(JOB_ROUTES)}."}), 404
+    if 'file' not in request.files or request.files['file'].filename == '':
+        return jsonify({"error": "No file uploaded."}), 400
+    job = job_queue.submit(endpoint, request.files['file'], request.form.to_dict(), request.args.to_dict())
+    return jsonify(job.to_dict()), 202
+
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found or expired."}), 404
+    return jsonify(job.to_dict())
+
+
+@app.route('/api/jobs/<job_id>/result', methods=['GET'])
+def job_result(job_id):
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found or expired."}), 404
+    if job.status in ('queued', 'running'):
+        return jsonify(job.to_dict()), 202
+    if job.result is None:
+        return jsonify({"error": job.error or "Job failed."}), 500
+    return app.response_class(job.result, status=job.status_code, mimetype='application/json')
+
+
+# --- Request instrumentation ---
+METRICS_WINDOW = int(os.environ.get('METRICS_WINDOW', '1024'))
+METRICS_QUANTILES = (0.5, 0.9, 0.99)
+PROFILE_HEADER = 'X-Profile'
+# Profiling runs arbitrary-cost profilers for any client that sends the header: opt in
+# with PROFILE_ALLOWED=1 (the debug server allows it too).
+PROFILE_ALLOWED = os.environ.get('PROFILE_ALLOWED', '0') == '1'
+PROFILE_KEEP = int(os.environ.get('PROFILE_KEEP', '32'))
+
+
+def _profiling_allowed() -> bool:
+    return PROFILE_ALLOWED or app.debug
+
+
+class _StageTimer:
+    """Wall time, thread CPU time, peak RSS and rows per stage of one request.
+
+    Stages are entered through _job_stage; time until the next stage (or the end of
+    the request) is charged to the current one. RSS is sampled on every stage call,
+    which the chunked readers make once per chunk.
+    """
+
+    def __init__(self, route):
+        self.route = route
+        self.status = None
+        self.stages = OrderedDict()
+        self.stage = None
+        self.streaming = False
+        self.frame_bytes = {'baseline': 0, 'compact': 0}
+        self._wall = self._cpu = None
+        self.enter('request')
+
+    def enter(self, stage, rows=0):
+        wall, cpu, rss = time.perf_counter(), time.thread_time(), _rss_bytes()
+        if self.stage is not None:
+            record = self.stages[self.stage]
+            record['wall'] += wall - self._wall
+            record['cpu'] += cpu - self._cpu
+            record['peak_rss'] = max(record['peak_rss'], rss)
+        self.stage, self._wall, self._cpu = stage, wall, cpu
+        if stage is not None:
+            record = self.stages.setdefault(stage, {'wall': 0.0, 'cpu': 0.0, 'peak_rss': rss, 'rows': 0})
+            record['rows'] += rows
+            record['peak_rss'] = max(record['peak_rss'], rss)
+
+    def finish(self, status):
+        self.enter(None)
+        self.status = status
+        return self
+
+    def server_timing(self) -> str:
+        return ', '.join(f'{name};dur={rec["wall"] * 1000:.1f}' for name, rec in self.stages.items())
+
+    def frame_memory(self) -> str:
+        """Header value for compact frames, summed over all chunks: baseline=...; compact=...; saved=... (bytes)."""
+        base, compact = self.frame_bytes['baseline'], self.frame_bytes['compact']
+        return f'baseline={base}; compact={compact}; saved={base - compact}'
+
+
+class _Summary:
+    """Rolling window of observations for quantiles, plus all-time sum and count."""
+
+    __slots__ = ('window', 'sum', 'count')
+
+    def __init__(self):
+        self.window = deque(maxlen=METRICS_WINDOW)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.window.append(value)
+        self.sum += value
+        self.count += 1
+
+
+def _prom_labels(labels: dict) -> str:
+    def esc(v):
+        return str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return '{' + ','.join(f'{k}="{esc(v)}"' for k, v in labels.items()) + '}' if labels else ''
+
+
+class _Metrics:
+    """Per-route request and per-stage summaries, rendered in Prometheus text format."""
+
+    summaries = {
+        'app_request_duration_seconds': 'Wall time of whole requests.',
+        'app_stage_wall_seconds': 'Wall time spent in each request stage.',
+        'app_stage_cpu_seconds': 'CPU time of the request thread in each stage.',
+        'app_stage_peak_rss_bytes': 'Highest resident set size sampled during each stage.',
+    }
+    counters = {
+        'app_requests_total': 'Requests by route and status.',
+        'app_stage_rows_total': 'Rows processed by each request stage.',
+        'app_frame_bytes_saved_total': 'Frame bytes saved by compact frames, measured (see COMPACT_FRAMES).',
+    }
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._summaries = {name: {} for name in self.summaries}
+        self._counters = {name: {} for name in self.counters}
+
+    def _observe(self, name, labels, value):
+        self._summaries[name].setdefault(labels, _Summary()).observe(value)
+
+    def _inc(self, name, labels, value=1):
+        self._counters[name][labels] = self._counters[name].get(labels, 0) + value
+
+    def record(self, timer: _StageTimer):
+        route = timer.route or 'unmatched'
+        with self._lock:
+            self._observe('app_request_duration_seconds', (('route', route),),
+                          sum(rec['wall'] for rec in timer.stages.values()))
+            self._inc('app_requests_total', (('route', route), ('status', str(timer.status))))
+            for stage, rec in timer.stages.items():
+                labels = (('route', route), ('stage', stage))
+                self._observe('app_stage_wall_seconds', labels, rec['wall'])
+                self._observe('app_stage_cpu_seconds', labels, rec['cpu'])
+                self._observe('app_stage_peak_rss_bytes', labels, rec['peak_rss'])
+                if rec['rows']:
+                    self._inc('app_stage_rows_total', labels, rec['rows'])
+            if timer.frame_bytes['baseline']:
+                self._inc('app_frame_bytes_saved_total', (('route', route),),
+                          timer.frame_bytes['baseline'] - timer.frame_bytes['compact'])
+
+    def render(self) -> str:
+        lines = []
+        with self._lock:
+            for name, help_text in self.summaries.items():
+                lines += [f'# HELP {name} {help_text}', f'# TYPE {name} summary']
+                for labels, s in sorted(self._summaries[name].items()):
+                    values = np.quantile(np.fromiter(s.window, float), METRICS_QUANTILES)
+                    for q, v in zip(METRICS_QUANTILES, values):
+                        lines.append(f'{name}{_prom_labels(dict(labels, quantile=q))} {v:.12g}')
+                    lines.append(f'{name}_sum{_prom_labels(dict(labels))} {s.sum:.12g}')
+                    lines.append(f'{name}_count{_prom_labels(dict(labels))} {s.count}')
+            for name, help_text in self.counters.items():
+                lines += [f'# HELP {name} {help_text}', f'# TYPE {name} counter']
+                for labels, value in sorted(self._counters[name].items()):
+                    lines.append(f'{name}{_prom_labels(dict(labels))} {value}')
+        lines += ['# HELP process_resident_memory_bytes Resident memory size in bytes.',
+                  '# TYPE process_resident_memory_bytes gauge',
+                  f'process_resident_memory_bytes {_rss_bytes()}']
+        return '\n'.join(lines) + '\n'
+
+
+metrics = _Metrics()
+
+
+class _ProfileStore:
+    """The last PROFILE_KEEP request profiles, served from /debug/profiles/<id>.
+
+    Kept in `store` (see STATE_DIR) when given, so any worker can serve them.
+    """
+
+    def __init__(self, keep, store=None):
+        self.keep = keep
+        self._store = store
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def put(self, profile: dict) -> str:
+        profile_id = uuid.uuid4().hex
+        if self._store is not None:
+            self._store.put(profile_id, profile)
+            self._store.prune(max_entries=self.keep)
+            return profile_id
+        with self._lock:
+            self._items[profile_id] = profile
+            while len(self._items) > self.keep:
+                self._items.popitem(last=False)
+        return profile_id
+
+    def get(self, profile_id):
+        if self._store is not None:
+            return self._store.get(profile_id)
+        with self._lock:
+            return self._items.get(profile_id)
+
+
+profile_store = _ProfileStore(PROFILE_KEEP, _state_store('profiles'))
+
+
+def _start_profiler(kind):
+    """Start a profiler for the header value 'cprofile' or 'pyinstrument'; None if unavailable."""
+    if kind == 'pyinstrument' and PyinstrumentProfiler is not None:
+        profiler = PyinstrumentProfiler()
+    elif kind in ('cprofile', 'pyinstrument', '1'):
+        kind, profiler = 'cprofile', cProfile.Profile()
+    else:
+        return None
+    try:
+        profiler.start() if kind == 'pyinstrument' else profiler.enable()
+    except (RuntimeError, ValueError):
+        return None  # another profiler is already running in this process
+    return kind, profiler
+
+
+def _stop_profiler(kind, profiler) -> dict:
+    if kind == 'pyinstrument':
+        profiler.stop()
+        return {'kind': kind, 'text': profiler.output_text(), 'html': profiler.output_html()}
+    profiler.disable()
+    out = io.StringIO()
+    stats = pstats.Stats(profiler, stream=out)
+    stats.sort_stats('cumulative').print_stats(60)
+    return {'kind': kind, 'text': out.getvalue(), 'pstats': marshal.dumps(stats.stats)}
+
+
+@app.before_request
+def _begin_request_timing():
+    _job_local.timer = _StageTimer(request.endpoint)
+    kind = request.headers.get(PROFILE_HEADER)
+    _job_local.profiler = _start_profiler(kind.lower()) if kind and _profiling_allowed() else None
+
+
+def _end_request_timing(timer, status):
+    metrics.record(timer.finish(status))
+    if getattr(_job_local, 'timer', None) is timer:
+        _job_local.timer = None
+
+
+@app.after_request
+def _finish_request_timing(response):
+    timer = getattr(_job_local, 'timer', None)
+    profiler = getattr(_job_local, 'profiler', None)
+    if profiler is not None:
+        _job_local.profiler = None
+        profile_id = profile_store.put(_stop_profiler(*profiler))
+        response.headers['X-Profile-Id'] = profile_id
+        response.headers['X-Profile-URL'] = url_for('request_profile', profile_id=profile_id)
+    if timer is None:
+        return response
+    if response.is_streamed:
+        # The body is generated after this hook; account for it when the server closes the response.
+        timer.streaming = True
+        response.call_on_close(lambda: _end_request_timing(timer, response.status_code))
+    else:
+        response.headers['Server-Timing'] = timer.server_timing()
+        if timer.frame_bytes['baseline']:
+            response.headers['X-Frame-Memory'] = timer.frame_memory()
+        _end_request_timing(timer, response.status_code)
+    return response
+
+
+@app.teardown_request
+def _teardown_request_timing(exc):
+    """Drop per-request state that after_request did not get to (it also runs for error responses)."""
+    profiler = getattr(_job_local, 'profiler', None)
+    if profiler is not None:
+        _job_local.profiler = None
+        _stop_profiler(*profiler)
+    timer = getattr(_job_local, 'timer', None)
+    if timer is not None and not timer.streaming:
+        _job_local.timer = None
+
+
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+
+@app.route('/debug/profiles/<profile_id>', methods=['GET'])
+def request_profile(profile_id):
+    """A profile captured with the X-Profile header: text, html (pyinstrument) or pstats (cProfile)."""
+    if not _profiling_allowed():
+        return jsonify({"error": "Profiling is disabled (set PROFILE_ALLOWED=1)."}), 404
+    profile = profile_store.get(profile_id)
+    if profile is None:
+        return jsonify({"error": "Profile not found or expired."}), 404
+    fmt = request.args.get('format', 'text')
+    if fmt == 'html' and 'html' in profile:
+        return Response(profile['html'], mimetype='text/html')
+    if fmt == 'pstats' and 'pstats' in profile:
+        return Response(profile['pstats'], mimetype='application/octet-stream',
+                        headers={'Content-Disposition': f'attachment; filename={profile_id}.pstats'})
+    return Response(profile['text'], mimetype='text/plain')
+
+
+# --- Incremental regression models ---
+ML_MODEL_DIR = os.environ.get('ML_MODEL_DIR', 'ml_models')
+ML_FEATURES = ['Temperature', 'Salinity', 'Oxygen', 'Turbidity', 'Depth']
+ML_TARGET = 'Chlorophyll'
+# Every 5th row goes to the held-out statistics, matching the 80/20 split of the batch mode.
+ML_HOLDOUT_EVERY = 5
+ML_CHART_SAMPLE = int(os.environ.get('ML_CHART_SAMPLE', '5000'))
+
+
+class _LinearStats:
+    """Sufficient statistics of a linear regression: the Gram matrix ZᵀZ of Z = [1, X, y].
+
+    The least-squares fit and the SSE/SST of any coefficient vector all follow from
+    ZᵀZ, so chunks can be folded in one at a time and then dropped.
+    """
+
+    def __init__(self, k, gram=None):
+        self.gram = np.zeros((k + 2, k + 2)) if gram is None else gram
+
+    @property
+    def n(self) -> int:
+        return int(round(self.gram[0, 0]))
+
+    def update(self, X: np.ndarray, y: np.ndarray):
+        Z = np.column_stack([np.ones(len(y)), X, y])
+        self.gram += Z.T @ Z
+
+    def fit(self) -> np.ndarray:
+        """[intercept, coefficients...] solving the normal equations (least-norm if singular)."""
+        return np.linalg.lstsq(self.gram[:-1, :-1], self.gram[:-1, -1], rcond=None)[0]
+
+    def metrics(self, beta: np.ndarray):
+        """(r2, rmse) of `beta` on the rows summarized here, or (None, None) when empty."""
+        n = self.gram[0, 0]
+        if n == 0:
+            return None, None
+        yy, sy = self.gram[-1, -1], self.gram[0, -1]
+        sse = max(yy - 2 * beta @ self.gram[:-1, -1] + beta @ self.gram[:-1, :-1] @ beta, 0.0)
+        sst = yy - sy * sy / n
+        r2 = float(1 - sse / sst) if sst > 0 else None
+        return r2, float(np.sqrt(sse / n))
+
+    def corr(self) -> np.ndarray:
+        """Correlation matrix of [X, y]."""
+        n = self.gram[0, 0]
+        mean = self.gram[0, 1:] / n
+        cov = self.gram[1:, 1:] / n - np.outer(mean, mean)
+        sd = np.sqrt(np.clip(np.diag(cov), 0, None))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return cov / np.outer(sd, sd)
+
+
+class _Reservoir:
+    """Uniform random sample of at most `cap` rows from a stream of frames."""
+
+    def __init__(self, cap, seed=42):
+        self.cap = cap
+        self._rng = np.random.default_rng(seed)
+        self._frame = None
+        self._keys = np.empty(0)
+
+    def add(self, frame: pd.DataFrame):
+        if frame.empty:
+            return
+        keys = np.concatenate([self._keys, self._rng.random(len(frame))])
+        frame = frame if self._frame is None else pd.concat([self._frame, frame], ignore_index=True)
+        if len(frame) > self.cap:
+            keep = np.sort(np.argpartition(keys, self.cap)[:self.cap])
+            frame, keys = frame.iloc[keep].reset_index(drop=True), keys[keep]
+        self._frame, self._keys = frame, keys
+
+    def frame(self) -> pd.DataFrame:
+        return self._frame if self._frame is not None else pd.DataFrame()
+
+
+class _RegressionStore:
+    """Trained regression statistics persisted per signature (model key + features + target).
+
+    Each upload accumulates into fresh statistics and is merged in under the lock once
+    it has been read completely, so a failed upload never leaves a half-updated model.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self._models = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def signature(model_key, features, target=ML_TARGET) -> str:
+        raw = json.dumps({'key': model_key, 'features': list(features), 'target': target}, sort_keys=True)
+        return hashlib.sha1(raw.encode('utf-8')).hexdigest()[:16]
+
+    def _path(self, signature):
+        return os.path.join(self.root, f'{signature}.npz')
+
+    def get(self, signature):
+        if not signature.isalnum():
+            return None
+        with self._lock:
+            model = self._models.get(signature)
+            if model is None and os.path.exists(self._path(signature)):
+                with np.load(self._path(signature)) as data:
+                    meta = json.loads(str(data['meta']))
+                    k = len(meta['features'])
+                    model = dict(meta, train=_LinearStats(k, data['train']), test=_LinearStats(k, data['test']))
+                self._models[signature] = model
+            return model
+
+    def merge(self, model_key, features, train: _LinearStats, test: _LinearStats, reset=False) -> dict:
+        signature = self.signature(model_key, features)
+        current = None if reset else self.get(signature)
+        with self._lock:
+            if current is None:
+                current = {'signature': signature, 'model_key': model_key, 'features': list(features),
+                           'target': ML_TARGET, 'updates': 0,
+                           'train': _LinearStats(len(features)), 'test': _LinearStats(len(features))}
+            current['train'].gram += train.gram
+            current['test'].gram += test.gram
+            current['updates'] += 1
+            current['updated'] = time.time()
+            self._models[signature] = current
+            self._save(current)
+            return current
+
+    def _save(self, model):
+        os.makedirs(self.root, exist_ok=True)
+        meta = {k: v for k, v in model.items() if k not in ('train', 'test')}
+        tmp = self._path(model['signature']) + '.tmp'
+        with open(tmp, 'wb') as f:
+            np.savez(f, train=model['train'].gram, test=model['test'].gram, meta=json.dumps(meta))
+        os.replace(tmp, self._path(model['signature']))
+
+    def list(self):
+        names = {f[:-4] for f in os.listdir(self.root) if f.endswith('.npz')} if os.path.isdir(self.root) else set()
+        with self._lock:
+            names |= set(self._models)
+        return [_regression_summary(self.get(s)) for s in sorted(names)]
+
+
+regression_store = _RegressionStore(ML_MODEL_DIR)
+
+
+def _regression_summary(model) -> dict:
+    beta = model['train'].fit()
+    r2, rmse = model['test'].metrics(beta)
+    return {
+        'signature': model['signature'],
+        'model_key': model['model_key'],
+        'features': model['features'],
+        'target': model['target'],
+        'intercept': float(beta[0]),
+        'coefficients': dict(zip(model['features'], map(float, beta[1:]))),
+        'rows_train': model['train'].n,
+        'rows_test': model['test'].n,
+        'updates': model['updates'],
+        'updated': model.get('updated'),
+        'metrics': {'r2': r2, 'rmse': rmse},
+    }
+
+
+def _ml_features():
+    """Features requested via ?features=Temperature,Depth,... (default: all of ML_FEATURES)."""
+    raw = request.values.get('features')
+    features = [f.strip() for f in raw.split(',') if f.strip()] if raw else list(ML_FEATURES)
+    unknown = [f for f in features if f not in ML_FEATURES]
+    if unknown or not features:
+        raise ValueError(f"Unknown features {unknown}; choose from {ML_FEATURES}.")
+    return features
+
+
+def _ml_arrays(chunk: pd.DataFrame, columns):
+    """Resolve ML columns in one chunk and return (frame of canonical float columns, missing names)."""
+    resolved = ML_SCHEMA.resolve(chunk.columns)
+    missing = [c for c in columns if not resolved.get(c)]
+    if missing:
+        return None, missing
+    frame = chunk[[resolved[c] for c in columns]].copy()
+    frame.columns = columns
+    _coerce_numeric(frame, columns)
+    return frame, []
+
+
+# QC variables that are also ML columns.
+_ML_QC_VARIABLES = {'temperature_C': 'Temperature', 'salinity_PSU': 'Salinity', 'oxygen_mgL': 'Oxygen', 'depth_m': 'Depth'}
+
+
+def _ml_quality_control(headers, names=None) -> _QualityControl:
+    """QC over the ML columns (renamed through `names`, e.g. the resolved upload headers),
+    with positions and dates taken from the upload's own headers."""
+    names = names or {}
+    ocean = OCEAN_SCHEMA.resolve(headers)
+    return _QualityControl(columns={name: names.get(ml, ml) for name, ml in _ML_QC_VARIABLES.items()},
+                           position=(ocean.get('lat'), ocean.get('lon')), time_column=ocean.get('date') or 'date')
+
+
+def _incremental_ml_analysis(chunks):
+    """Fold an upload into the persisted regression for its signature in one chunked pass.
+
+    Only the Gram matrices and bounded chart samples are kept; r2/rmse are computed on
+    the held-out rows of every upload seen so far.
+    """
+    try:
+        features = _ml_features()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    model_key = request.values.get('model_key') or request.values.get('dataset_id') or 'default'
+    columns = features + [ML_TARGET]
+    train, test = _LinearStats(len(features)), _LinearStats(len(features))
+    temp_sample, test_sample = _Reservoir(ML_CHART_SAMPLE), _Reservoir(ML_CHART_SAMPLE)
+    offset = 0
+    qc_mode, qc = _qc_mode(), None
+    rows = {'input': 0, 'used': 0, 'dropped_incomplete': 0}
+    for chunk in chunks:
+        frame, missing = _ml_arrays(chunk, columns)
+        if missing:
+            return jsonify({"error": f"Missing required columns: {missing}"}), 400
+        if 'date' in chunk.columns:
+            frame['date'] = pd.to_datetime(chunk['date'], errors='coerce')
+        rows['input'] += len(frame)
+        if qc_mode:
+            qc = qc or _ml_quality_control(chunk.columns)
+            frame = qc.screen(frame, context=chunk)
+            frame = qc.drop_rejected(frame, rows) if qc_mode == 'drop' else qc.strip(frame)
+        kept = len(frame)
+        frame = frame.dropna(subset=columns)
+        rows['dropped_incomplete'] += kept - len(frame)
+        rows['used'] += len(frame)
+        _job_stage('predict', len(frame))
+        held_out = (offset + np.arange(len(frame))) % ML_HOLDOUT_EVERY == 0
+        offset += len(frame)
+        X, y = frame[features].to_numpy(dtype=float), frame[ML_TARGET].to_numpy(dtype=float)
+        train.update(X[~held_out], y[~held_out])
+        test.update(X[held_out], y[held_out])
+        test_sample.add(frame[held_out])
+        if 'date' in frame.columns and 'Temperature' in frame.columns:
+            temp_sample.add(frame[['date', 'Temperature']].dropna())
+
+    if train.n + test.n == 0:
+        return jsonify({"error": "No complete rows to train on."}), 400
+    model = regression_store.merge(model_key, features, train, test, reset=bool(request.values.get('reset')))
+    summary = _regression_summary(model)
+    summary['rows_this_upload'] = train.n + test.n
+    quality = {"rows": rows, "qc": qc.summary()} if qc else {}
+
+    _job_stage('chart')
+    jobs = {}
+    temp_df = temp_sample.frame()
+    if not temp_df.empty:
+        temp_df = temp_df.sort_values('date')
+        jobs['temp_time'] = (chart_render.plot_temperature_time, (temp_df['date'].to_numpy(), temp_df['Temperature'].to_numpy()))
+    corr = model['train'].corr()
+    jobs['corr'] = (chart_render.plot_correlation, (pd.DataFrame(corr, index=columns, columns=columns),))
+    sample = test_sample.frame()
+    if not sample.empty:
+        beta = model['train'].fit()
+        y_pred = beta[0] + sample[features].to_numpy(dtype=float) @ beta[1:]
+        jobs['scatter'] = (chart_render.plot_predicted_vs_actual, (sample[ML_TARGET].to_numpy(), y_pred))
+
+    if request.values.get('chart_mode') == 'url':
+        chart_urls = {name: url_for('lazy_chart', token=lazy_charts.register(func, args))
+                      for name, (func, args) in jobs.items()}
+        return jsonify({"metrics": summary['metrics'], "model": summary, **quality, "charts": {}, "chart_urls": chart_urls})
+    charts = {name: base64.b64encode(png).decode('utf-8') for name, png in _render_charts(jobs).items()}
+    return jsonify({"metrics": summary['metrics'], "model": summary, **quality, "charts": charts})
+
+
+@app.route('/api/ml_models', methods=['GET'])
+def list_regression_models():
+    return jsonify(regression_store.list())
+
+
+@app.route('/api/ml_models/<signature>', methods=['GET'])
+def get_regression_model(signature):
+    model = regression_store.get(signature)
+    if model is None:
+        return jsonify({"error": f"Unknown model '{signature}'."}), 404
+    return jsonify(_regression_summary(model))
+
+
+@app.route('/api/ml_models/<signature>/predict', methods=['POST'])
+def predict_regression(signature):
+    """Predict the target for an upload or dataset with a stored model, without retraining.
+
+    Rows with a missing feature get a null prediction.
+    """
+    model = regression_store.get(signature)
+    if model is None:
+        return jsonify({"error": f"Unknown model '{signature}'."}), 404
+    chunks, error = _request_chunks('ocean', normalize=False)
+    if error:
+        return error
+    features = model['features']
+    beta = model['train'].fit()
+    name = f"{model['target']}_pred"
+    # Check the first chunk up front, so a streamed response never starts on a bad upload.
+    first, chunks = _peek_chunks(chunks)
+    if first is not None:
+        _, missing = _ml_arrays(first, features)
+        if missing:
+            return jsonify({"error": f"Missing required columns: {missing}"}), 400
+
+    def prediction_frames():
+        for chunk in chunks:
+            frame, missing = _ml_arrays(chunk, features)
+            if missing:
+                raise ValueError(f"Missing required columns: {missing}")
+            _job_stage('predict', len(frame))
+            out = pd.DataFrame({name: beta[0] + frame.to_numpy(dtype=float) @ beta[1:]})
+            if 'sample_id' in chunk.columns:
+                out.insert(0, 'sample_id', chunk['sample_id'].to_numpy())
+            yield out
+
+    stream_mode = _stream_mode()
+    if stream_mode:
+        return _streamed_response((rows for frame in prediction_frames() for rows in _iter_json_rows(frame)),
+                                  stream_mode)
+    try:
+        frames = list(prediction_frames())
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    df = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=[name])
+    return jsonify({
+        "signature": signature,
+        "rows": len(df),
+        "predictions": _json_records(df),
+    })
+
+
+@app.route("/")
+def index():
+    return "✅ Flask is running! Use integration1.html or integration2.html frontend files."
+
+
+# --- New: ML Analysis Route ---
+@app.route('/upload_ml_analysis', methods=['POST'])
+def upload_ml_analysis():
+    try:
+        chunks, error = _request_chunks('ocean', normalize=False)
+        if error:
+            return error
+        if request.values.get('training') == 'incremental':
+            return _incremental_ml_analysis(chunks)
+        parts = list(chunks)
+        df = pd.concat(parts, ignore_index=True) if parts else pd.DataFrame()
+        if 'date' in df.columns:
+            try:
+                df['date'] = pd.to_datetime(df['date'], errors='coerce')
+            except Exception:
+                pass
+        resolved = ML_SCHEMA.resolve(df.columns)
+
+        required = ["Temperature", "Salinity", "Oxygen", "Turbidity", "Depth", "Chlorophyll"]
+        missing = [k for k in required if not resolved.get(k)]
+        if missing:
+            return jsonify({"error": f"Missing required columns: {missing}"}), 400
+
+        _coerce_numeric(df, [resolved[k] for k in required])
+        # With qc=drop, bad values are dropped and counted instead of disappearing in dropna.
+        rows = {'input': len(df)}
+        qc_mode = _qc_mode()
+        qc = _ml_quality_control(df.columns, resolved) if qc_mode else None
+        if qc:
+            df = qc.screen(df)
+            df = qc.drop_rejected(df, rows) if qc_mode == 'drop' else qc.strip(df)
+        kept = len(df)
+        df = df.dropna(subset=[resolved[k] for k in required])
+        rows.update(dropped_incomplete=kept - len(df), used=len(df))
+        quality = {"rows": rows, "qc": qc.summary()} if qc else {}
+        X = df[[resolved['Temperature'], resolved['Salinity'], resolved['Oxygen'], resolved['Turbidity'], resolved['Depth']]].dropna()
+        y = df[resolved['Chlorophyll']].loc[X.index]
+
+        if len(X) < 10:
             return jsonify({"error": "Not enough rows after cleaning to train the model (need >= 10)."}), 400
 
+        _job_stage('predict', len(X))
         X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42)
         model = LinearRegression()
         model.fit(X_train, y_train)
         y_pred = model.predict(X_test)
 
         r2 = float(r2_score(y_test, y_pred))
-        rmse = float(mean_squared_error(y_test, y_pred, squared=False))
+        rmse = float(np.sqrt(mean_squared_error(y_test, y_pred)))
 
-        def fig_to_base64(fig):
-            buf = io.BytesIO()
-            fig.savefig(buf, format='png', bbox_inches='tight')
-            plt.close(fig)
-            buf.seek(0)
-            return base64.b64encode(buf.read()).decode('utf-8')
-
-        charts = {}
+        # Each chart gets its data up front; rendering happens in the chart process pool.
+        _job_stage('chart')
+        jobs = {}
         if 'date' in df.columns and resolved['Temperature'] in df.columns:
-            try:
-                temp_df = df[["date", resolved['Temperature']]].dropna()
-                temp_df = temp_df.sort_values('date')
-                fig, ax = plt.subplots(figsize=(7, 4))
-                ax.plot(temp_df['date'], temp_df[resolved['Temperature']], color='#1f77b4')
-                ax.set_title('Temperature over Time')
-                ax.set_xlabel('Date')
-                ax.set_ylabel('Temperature')
-                fig.autofmt_xdate()
-                charts['temp_time'] = fig_to_base64(fig)
-            except Exception:
-                pass
+            temp_df = df[["date", resolved['Temperature']]].dropna()
+            temp_df = temp_df.sort_values('date')
+            jobs['temp_time'] = (chart_render.plot_temperature_time, (temp_df['date'].to_numpy(), temp_df[resolved['Temperature']].to_numpy()))
 
-        try:
-            corr_cols = [resolved['Temperature'], resolved['Salinity'], resolved['Oxygen'], resolved['Turbidity'], resolved['Depth'], resolved['Chlorophyll']]
-            corr_df = df[corr_cols].apply(pd.to_numeric, errors='coerce').dropna()
-            if not corr_df.empty:
-                fig, ax = plt.subplots(figsize=(6, 5))
-                sns.heatmap(corr_df.corr(), annot=True, cmap='coolwarm', ax=ax, fmt='.2f')
-                ax.set_title('Correlation Heatmap')
-                charts['corr'] = fig_to_base64(fig)
-        except Exception:
-            pass
+        corr_cols = [resolved['Temperature'], resolved['Salinity'], resolved['Oxygen'], resolved['Turbidity'], resolved['Depth'], resolved['Chlorophyll']]
+        corr_df = df[corr_cols].dropna()
+        if not corr_df.empty:
+            jobs['corr'] = (chart_render.plot_correlation, (corr_df.corr(),))
 
-     
-        try:
-            fig, ax = plt.subplots(figsize=(6, 5))
-            ax.scatter(y_test, y_pred, alpha=0.7, color='#2ca02c')
-            min_val = float(min(y_test.min(), y_pred.min()))
-            max_val = float(max(y_test.max(), y_pred.max()))
-            ax.plot([min_val, max_val], [min_val, max_val], 'r--')
-            ax.set_xlabel('Actual Chlorophyll')
-            ax.set_ylabel('Predicted Chlorophyll')
-            ax.set_title('Predicted vs Actual')
-            charts['scatter'] = fig_to_base64(fig)
-        except Exception:
-            pass
+        jobs['scatter'] = (chart_render.plot_predicted_vs_actual, (np.asarray(y_test), np.asarray(y_pred)))
+
+        if request.values.get('chart_mode') == 'url':
+            chart_urls = {name: url_for('lazy_chart', token=lazy_charts.register(func, args))
+                          for name, (func, args) in jobs.items()}
+            return jsonify({
+                "metrics": {"r2": r2, "rmse": rmse},
+                **quality,
+                "charts": {},
+                "chart_urls": chart_urls
+            })
 
+        charts = {name: base64.b64encode(png).decode('utf-8') for name, png in _render_charts(jobs).items()}
         return jsonify({
             "metrics": {"r2": r2, "rmse": rmse},
+            **quality,
             "charts": charts
         })
+    except _UploadParseError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         traceback.print_exc()
-        return jsonify({"error": str(e)}), 500
\ No newline at end of file
+        return jsonify({"error": str(e)}), 500
+
+
+# --- Production server ---
+SERVER_HOST = os.environ.get('HOST', '0.0.0.0')
+SERVER_PORT = int(os.environ.get('PORT', '5000'))
+# One worker by default: jobs, lazy charts and profiles are only shared between worker
+# processes through STATE_DIR, and /metrics always reports the worker that answers.
+SERVER_WORKERS = int(os.environ.get('WEB_WORKERS', str(os.cpu_count() or 2) if STATE_DIR else '1'))
+SERVER_THREADS = int(os.environ.get('WEB_THREADS', '8'))
+SERVER_IDLE_TIMEOUT = float(os.environ.get('WEB_IDLE_TIMEOUT', '30'))
+SERVER_GRACEFUL_TIMEOUT = float(os.environ.get('GRACEFUL_TIMEOUT', '30'))
+SERVER_WORKER_TIMEOUT = float(os.environ.get('WORKER_TIMEOUT', '300'))
+# ASGI mode: request bodies up to this size stay in memory while they arrive, larger ones go to a temp file.
+ASGI_SPOOL_MEMORY = int(float(os.environ.get('ASGI_SPOOL_MEMORY_MB', '1')) * 2**20)
+# Response chunks buffered between a request thread and the event loop.
+ASGI_SEND_BUFFER = 8
+
+
+def create_app(config=None, preload=None):
+    """App factory for WSGI servers, e.g. gunicorn --preload 'app:create_app()'.
+
+    Applies `config` to app.config and finishes loading the `preload` models
+    (MODEL_PRELOAD by default) before returning, so workers forked afterwards share
+    them copy-on-write instead of each loading its own copy.
+    """
+    if config:
+        app.config.update(config)
+    model_registry.preload(MODEL_PRELOAD if preload is None else preload, wait=MODEL_LOAD_TIMEOUT)
+    return app
+
+
+def _freeze_for_fork():
+    """Move everything allocated so far (models included) out of the GC's reach, so
+    collections in the workers don't write to, and so copy, the shared pages."""
+    gc.collect()
+    gc.freeze()
+
+
+class _PooledRequestHandler(WSGIRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    timeout = SERVER_IDLE_TIMEOUT  # idle keep-alive connections give their thread back
+
+
+class _PooledWSGIServer(BaseWSGIServer):
+    """Werkzeug server that accepts on its own thread and handles requests on a pool
+    of `threads`, so CPU-bound pandas work in the handlers never holds up accepting."""
+
+    multithread = True
+
+    def __init__(self, host, port, wsgi_app, threads, fd=None):
+        self._pool = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='http')
+        super().__init__(host, port, wsgi_app, handler=_PooledRequestHandler, fd=fd)
+
+    def process_request(self, request, client_address):
+        self._pool.submit(self._handle, request, client_address)
+
+    def _handle(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+    def drain(self):
+        """Wait for the requests in flight, then close the listening socket."""
+        self._pool.shutdown(wait=True)
+        self.server_close()
+
+
+class _PreforkServer:
+    """Pre-forking server for hosts without gunicorn.
+
+    The master binds the socket and loads the models, then forks `workers` processes
+    that each serve the shared socket with a _PooledWSGIServer. SIGHUP re-checks the
+    model files and replaces the workers with a new generation before retiring the
+    old one; SIGTERM/SIGINT stop all workers. Retiring workers finish their in-flight
+    requests, for up to graceful_timeout seconds.
+    """
+
+    def __init__(self, host, port, workers, threads, graceful_timeout=SERVER_GRACEFUL_TIMEOUT):
+        self.host, self.port = host, port
+        self.size, self.threads = workers, threads
+        self.graceful_timeout = graceful_timeout
+        self.workers = {}  # pid -> generation
+        self.retiring = {}  # pid -> kill deadline
+        self.generation = 0
+        self.sock = None
+        self._reload = self._stop = False
+
+    def run(self):
+        create_app()
+        self.sock = socket.create_server((self.host, self.port), backlog=2048)
+        self.sock.set_inheritable(True)
+        signal.signal(signal.SIGHUP, lambda *_: setattr(self, '_reload', True))
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            signal.signal(sig, lambda *_: setattr(self, '_stop', True))
+        print(f"Master {os.getpid()}: {self.size} workers x {self.threads} threads on {self.host}:{self.port}")
+        try:
+            while not self._stop:
+                self._reap()
+                if self._reload:
+                    self._reload = False
+                    self._replace_workers()
+                self._spawn_missing()
+                for pid, deadline in list(self.retiring.items()):
+                    if time.monotonic() > deadline:
+                        self._signal(pid, signal.SIGKILL)
+                time.sleep(0.2)
+        finally:
+            self._stop_workers()
+            self.sock.close()
+
+    def _spawn_missing(self):
+        current = sum(1 for gen in self.workers.values() if gen == self.generation)
+        if current < self.size:
+            _freeze_for_fork()
+        for _ in range(self.size - current):
+            pid = os.fork()
+            if pid == 0:
+                code = 0
+                try:
+                    self._serve()
+                except BaseException:
+                    traceback.print_exc()
+                    code = 1
+                finally:
+                    os._exit(code)
+            self.workers[pid] = self.generation
+
+    def _serve(self):
+        for sig in (signal.SIGHUP, signal.SIGINT):
+            signal.signal(sig, signal.SIG_IGN)
+        server = _PooledWSGIServer(self.host, self.port, app, self.threads, fd=self.sock.fileno())
+        signal.signal(signal.SIGTERM, lambda *_: threading.Thread(target=server.shutdown, daemon=True).start())
+        server.serve_forever()
+        server.drain()
+
+    def _replace_workers(self):
+        print(f"Master {os.getpid()}: reloading (generation {self.generation + 1})")
+        model_registry.preload(MODEL_PRELOAD, wait=MODEL_LOAD_TIMEOUT)
+        old = list(self.workers)
+        self.generation += 1
+        self._spawn_missing()
+        self._retire(old)
+
+    def _retire(self, pids):
+        deadline = time.monotonic() + self.graceful_timeout
+        for pid in pids:
+            self.retiring.setdefault(pid, deadline)
+            self._signal(pid, signal.SIGTERM)
+
+    @staticmethod
+    def _signal(pid, sig):
+        try:
+            os.kill(pid, sig)
+        except ProcessLookupError:
+            pass
+
+    def _reap(self):
+        while self.workers:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            generation = self.workers.pop(pid, None)
+            if self.retiring.pop(pid, None) is None and generation == self.generation and not self._stop:
+                print(f"Worker {pid} exited unexpectedly (status {status}); starting a new one")
+
+    def _stop_workers(self):
+        self._retire(list(self.workers))
+        while self.workers:
+            self._reap()
+            for pid, deadline in list(self.retiring.items()):
+                if time.monotonic() > deadline:
+                    self._signal(pid, signal.SIGKILL)
+            time.sleep(0.1)
+
+
+def _gunicorn_server(host, port, workers, threads):
+    """gunicorn with the models loaded in the master (preload_app) and threaded workers."""
+    options = {
+        'bind': f'{host}:{port}',
+        'workers': workers,
+        'threads': threads,
+        'worker_class': 'gthread',
+        'preload_app': True,
+        'graceful_timeout': SERVER_GRACEFUL_TIMEOUT,
+        'timeout': SERVER_WORKER_TIMEOUT,
+        'keepalive': SERVER_IDLE_TIMEOUT,
+    }
+
+    class _Server(GunicornApplication):
+        def load_config(self):
+            for key, value in options.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            wsgi = create_app()
+            _freeze_for_fork()
+            return wsgi
+
+        def reload(self):
+            # HUP: workers are re-forked from the master, so refresh its models first.
+            super().reload()
+            model_registry.preload(MODEL_PRELOAD, wait=MODEL_LOAD_TIMEOUT)
+            _freeze_for_fork()
+
+    return _Server()
+
+
+class _AsgiBridge:
+    """ASGI front door for the WSGI app, e.g. uvicorn 'app:asgi_app'.
+
+    Request bodies are received on the event loop and spooled to a SpooledTemporaryFile
+    (in memory up to ASGI_SPOOL_MEMORY, then on disk), so a slow upload holds a
+    coroutine rather than a thread. Only once the body is complete does the Flask app
+    run, on a pool of `threads`; its response is handed back to the loop chunk by chunk,
+    so streamed responses stay streamed. Routes and JSON contracts are the WSGI ones.
+    """
+
+    def __init__(self, wsgi_app, threads=SERVER_THREADS, spool_memory=ASGI_SPOOL_MEMORY):
+        self.wsgi_app = wsgi_app
+        self.threads = threads
+        self.spool_memory = spool_memory
+        self._pool = None
+
+    def _executor(self) -> ThreadPoolExecutor:
+        # Created on first use, so forked or spawned server workers each start their own.
+        if self._pool is None:
+            self._pool = ThreadPoolExecutor(max_workers=self.threads, thread_name_prefix='asgi')
+        return self._pool
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+        elif scope['type'] == 'http':
+            body = await self._spool(receive)
+            if body is not None:
+                with body:
+                    await self._respond(scope, body, send)
+        elif scope['type'] == 'websocket':
+            await send({'type': 'websocket.close', 'code': 1000})
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await asyncio.get_running_loop().run_in_executor(self._executor(), create_app)
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                if self._pool is not None:
+                    self._pool.shutdown(wait=False)
+                    self._pool = None
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def _spool(self, receive):
+        """The whole request body as a file positioned at 0; None if the client went away."""
+        body = tempfile.SpooledTemporaryFile(max_size=self.spool_memory, prefix='upload-')
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                body.close()
+                return None
+            body.write(message.get('body', b''))
+            if not message.get('more_body'):
+                body.seek(0)
+                return body
+
+    @staticmethod
+    def _environ(scope, body, length) -> dict:
+        root = scope.get('root_path', '')
+        path = scope['path'][len(root):] if root and scope['path'].startswith(root) else scope['path']
+        server = scope.get('server') or ('localhost', 80)
+        client = scope.get('client') or ('', 0)
+        environ = {
+            'REQUEST_METHOD': scope['method'],
+            'SCRIPT_NAME': root.encode('utf-8').decode('latin-1'),
+            'PATH_INFO': path.encode('utf-8').decode('latin-1'),
+            'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+            'SERVER_NAME': server[0],
+            'SERVER_PORT': str(server[1]),
+            'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+            'REMOTE_ADDR': client[0],
+            'REMOTE_PORT': str(client[1]),
+            'CONTENT_LENGTH': str(length),
+            'wsgi.version': (1, 0),
+            'wsgi.url_scheme': scope.get('scheme', 'http'),
+            'wsgi.input': body,
+            'wsgi.errors': sys.stderr,
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': True,
+            'wsgi.run_once': False,
+            # The body is spooled whole, so the app may read to EOF whatever the framing.
+            'wsgi.input_terminated': True,
+        }
+        for name, value in scope.get('headers', []):
+            name, value = name.decode('latin-1').upper().replace('-', '_'), value.decode('latin-1')
+            if name in ('CONTENT_LENGTH', 'TRANSFER_ENCODING'):
+                # The server has already de-chunked the body: its spooled length is the one to use.
+                continue
+            key = name if name == 'CONTENT_TYPE' else f'HTTP_{name}'
+            environ[key] = f'{environ[key]},{value}' if key in environ else value
+        return environ
+
+    def _run(self, environ, loop, chunks: asyncio.Queue, abort: threading.Event):
+        """On a pool thread: run the WSGI app and put ('start', status, headers), then body
+        bytes, then None on `chunks`. Stops early once `abort` is set."""
+        def put(item):
+            asyncio.run_coroutine_threadsafe(chunks.put(item), loop).result()
+
+        head = []
+
+        def send_head():
+            if head and head[0] is not None:
+                put(('start', *head))
+                head[0] = None
+
+        def start_response(status, headers, exc_info=None):
+            if exc_info and head and head[0] is None:
+                raise exc_info[1].with_traceback(exc_info[2])
+            head[:] = [int(status.split(' ', 1)[0]), headers]
+            return write
+
+        def write(data):
+            send_head()
+            if data:
+                put(data)
+
+        try:
+            result = self.wsgi_app(environ, start_response)
+            try:
+                for data in result:
+                    if abort.is_set():
+                        break
+                    write(data)
+                send_head()
+            finally:
+                if hasattr(result, 'close'):
+                    result.close()
+        except Exception as e:
+            put(e)
+        finally:
+            put(None)
+
+    async def _respond(self, scope, body, send):
+        loop = asyncio.get_running_loop()
+        length = body.seek(0, io.SEEK_END)
+        body.seek(0)
+        chunks, abort = asyncio.Queue(maxsize=ASGI_SEND_BUFFER), threading.Event()
+        done = loop.run_in_executor(self._executor(), self._run, self._environ(scope, body, length), loop, chunks, abort)
+        started, item = False, ()
+        try:
+            while (item := await chunks.get()) is not None:
+                if isinstance(item, Exception):
+                    if started:
+                        raise item
+                    traceback.print_exception(item)
+                    payload = json.dumps({"error": f"Internal server error: {item}"}).encode('utf-8')
+                    await send({'type': 'http.response.start', 'status': 500,
+                                'headers': [(b'content-type', b'application/json')]})
+                    await send({'type': 'http.response.body', 'body': payload})
+                    started = None
+                elif isinstance(item, tuple):
+                    _, status, headers = item
+                    await send({'type': 'http.response.start', 'status': status,
+                                'headers': [(k.lower().encode('latin-1'), v.encode('latin-1')) for k, v in headers]})
+                    started = True
+                else:
+                    await send({'type': 'http.response.body', 'body': item, 'more_body': True})
+            if started:
+                await send({'type': 'http.response.body', 'body': b''})
+        finally:
+            # On a failed send, let the request thread run to its end instead of blocking on a full queue.
+            abort.set()
+            while item is not None:
+                item = await chunks.get()
+            await done
+
+
+asgi_app = _AsgiBridge(app)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Ocean / fisheries data API.')
+    parser.add_argument('--mode', choices=['dev', 'prefork', 'asgi'], default=os.environ.get('SERVER_MODE', 'dev'),
+                        help="dev: Flask's debug server; prefork: production workers (gunicorn when installed); "
+                             "asgi: uvicorn workers that receive uploads asynchronously")
+    parser.add_argument('--host', help=f'bind address (prefork default {SERVER_HOST})')
+    parser.add_argument('--port', type=int, default=SERVER_PORT)
+    parser.add_argument('--workers', type=int, default=SERVER_WORKERS, help='worker processes')
+    parser.add_argument('--threads', type=int, default=SERVER_THREADS, help='request threads per worker')
+    args = parser.parse_args(argv)
+    if args.mode != 'dev' and args.workers > 1 and STATE_DIR is None:
+        print(f'Warning: {args.workers} workers without STATE_DIR; job status, lazy chart and profile '
+              'requests only succeed on the worker that created them.', file=sys.stderr)
+    if args.mode == 'dev':
+        # Pickled models are cheap to load, so start them now; TensorFlow waits for the first image.
+        model_registry.preload(MODEL_PRELOAD)
+        app.run(host=args.host, port=args.port, debug=True)
+    elif args.mode == 'asgi':
+        if uvicorn is None:
+            parser.error('asgi mode needs uvicorn (pip install uvicorn)')
+        # Extra workers import this module afresh, so they read the thread count from the environment.
+        os.environ['WEB_THREADS'] = str(args.threads)
+        asgi_app.threads = args.threads
+        uvicorn.run(asgi_app if args.workers == 1 else 'app:asgi_app', host=args.host or SERVER_HOST, port=args.port,
+                    workers=args.workers, app_dir=os.path.dirname(os.path.abspath(__file__)), lifespan='on',
+                    timeout_keep_alive=int(SERVER_IDLE_TIMEOUT), timeout_graceful_shutdown=int(SERVER_GRACEFUL_TIMEOUT))
+    elif GunicornApplication is not None:
+        _gunicorn_server(args.host or SERVER_HOST, args.port, args.workers, args.threads).run()
+    elif hasattr(os, 'fork'):
+        _PreforkServer(args.host or SERVER_HOST, args.port, args.workers, args.threads).run()
+    else:
+        parser.error('prefork mode needs gunicorn or a platform with os.fork')
+    return 0
+
+
+# --- Main entry point ---
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,476 @@
+"""Benchmark suite for the Flask endpoints in app.py.
+
+Generates seeded synthetic ocean/fisheries data with app.generate_dummy_*_data at each
+size, drives every endpoint through the Flask test client and records latency,
+throughput (rows or images/sec) and peak RSS per endpoint and size.
+
+    python benchmark.py --save                       # record benchmark_baseline.json
+    python benchmark.py                              # compare against it, exit 1 on regressions
+    python benchmark.py --sizes 1e3,1e5 --only upload_integration1,predict_ocean
+
+Each endpoint and size runs in its own subprocess, so peak memory is that process's
+RSS high-water mark and no case inherits another's heap; --in-process trades that
+for speed.
+Payloads are written to --data-dir once and read back by the subprocesses; the
+datasets and incremental models that endpoints store go there too.
+
+The species endpoints get one synthetic JPEG per IMAGE_ROWS rows. Without TensorFlow
+or otolith_classifier.h5 they run against a small stub classifier, so the numbers
+cover decoding, batching and the request path rather than the real network.
+Endpoints whose model files are missing are reported as skipped. The result cache is
+disabled so repeated runs measure real work.
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import resource
+except ImportError:  # Windows: fall back to sampling RSS in-process
+    resource = None
+
+os.environ.setdefault('RESULT_CACHE_MAX_MB', '0')
+os.environ.setdefault('MODEL_PRELOAD', 'fish,ocean')
+
+import numpy as np
+import pandas as pd
+from PIL import Image
+
+service = None  # the app module, imported by _import_service()
+
+SEED = 42
+DEFAULT_SIZES = '1e3,1e4,1e5,1e6,1e7'
+DEFAULT_BASELINE = 'benchmark_baseline.json'
+IMAGE_ROWS = 1000
+IMAGE_SIZE = (640, 480)
+SPECIES_CLIENTS = 8
+
+
+class _PeakRSS:
+    """Samples the process RSS on a background thread while a request runs."""
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.start = self.peak = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def __enter__(self):
+        self.start = self.peak = service._rss_bytes()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+        return self
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, service._rss_bytes())
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, service._rss_bytes())
+
+
+def _reset_peak_rss():
+    """Reset the kernel's RSS high-water mark (Linux), so imports and model loading
+    before the timed region don't count towards the case's peak."""
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        pass
+
+
+def _peak_rss_bytes():
+    """High-water RSS of this process: VmHWM where available, else ru_maxrss."""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024  # KiB on Linux, bytes on macOS
+
+
+class _Data:
+    """Payloads per size in `root`, generated once with a fixed seed and read back from disk."""
+
+    def __init__(self, root):
+        self.root = root
+        self._cache = {}
+
+    def _path(self, name):
+        return os.path.join(self.root, name)
+
+    def prepare(self, n, images=False):
+        """Write the payloads for size n (outside any timed region)."""
+        for kind in ('ocean', 'fisheries'):
+            path = self._path(f'{kind}-{n}.csv')
+            if not os.path.exists(path):
+                self._generate(kind, n).to_csv(path + '.tmp', index=False)
+                os.replace(path + '.tmp', path)
+        if images and not os.path.exists(self._path(f'images-{n}.zip')):
+            self._write_images(n)
+
+    def _generate(self, kind, n) -> pd.DataFrame:
+        if kind == 'ocean':
+            df = service.generate_dummy_ocean_data(n, seed=SEED)
+            rng = np.random.default_rng(SEED + 1)
+            # Columns the ML route needs on top of the dummy ocean data.
+            df['turbidity'] = rng.gamma(2.0, 1.2, n)
+            df['chlorophyll'] = np.clip(
+                0.6 + 0.08 * (df['temperature_C'] - 20) - 0.02 * df['depth_m'] + 0.1 * df['turbidity']
+                + rng.normal(0, 0.2, n), 0, None)
+            return df
+        return service.generate_dummy_fisheries_data(n, seed=SEED + 2)
+
+    def _write_images(self, n):
+        """Distinct otolith-like JPEGs: a bright ellipse with growth rings on a noisy background."""
+        rng = np.random.default_rng(SEED + 3)
+        w, h = IMAGE_SIZE
+        y, x = np.mgrid[0:h, 0:w].astype(np.float32)
+        path = self._path(f'images-{n}.zip')
+        with zipfile.ZipFile(path + '.tmp', 'w', zipfile.ZIP_STORED) as zf:
+            for i in range(max(1, n // IMAGE_ROWS)):
+                cx, cy = w / 2 + rng.normal(0, 20), h / 2 + rng.normal(0, 15)
+                r = np.hypot((x - cx) / rng.uniform(180, 260), (y - cy) / rng.uniform(110, 170))
+                shade = np.where(r < 1, 170 + 40 * np.sin(r * rng.uniform(20, 40)), 40)
+                pixels = shade[..., None] * rng.uniform(0.8, 1.0, 3) + rng.normal(0, 8, (h, w, 3))
+                buf = io.BytesIO()
+                Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8)).save(buf, format='JPEG', quality=85)
+                zf.writestr(f'otolith_{i:06d}.jpg', buf.getvalue())
+        os.replace(path + '.tmp', path)
+
+    def _read(self, name) -> bytes:
+        if name not in self._cache:
+            with open(self._path(name), 'rb') as f:
+                self._cache[name] = f.read()
+        return self._cache[name]
+
+    def csv(self, kind, n) -> bytes:
+        return self._read(f'{kind}-{n}.csv')
+
+    def image_archive(self, n) -> bytes:
+        return self._read(f'images-{n}.zip')
+
+    def images(self, n) -> list:
+        with zipfile.ZipFile(io.BytesIO(self.image_archive(n))) as zf:
+            return [(info.filename, zf.read(info)) for info in zf.infolist()]
+
+
+class _StubOtolithModel:
+    """Fixed random linear classifier over 8x8-pooled pixels, standing in for the Keras
+    model when TensorFlow or otolith_classifier.h5 is missing."""
+
+    def __init__(self, weights):
+        self.weights = weights
+
+    @classmethod
+    def load(cls, path):
+        return cls(np.load(path))
+
+    def predict(self, batch, verbose=0):
+        batch = np.asarray(batch, dtype=np.float32)
+        h, w = service.OTOLITH_SIZE[1] // 8, service.OTOLITH_SIZE[0] // 8
+        pooled = batch.reshape(len(batch), h, 8, w, 8, 3).mean(axis=(2, 4)).reshape(len(batch), -1)
+        logits = pooled @ self.weights
+        e = np.exp(logits - logits.max(axis=1, keepdims=True))
+        return e / e.sum(axis=1, keepdims=True)
+
+
+def _species_model(root) -> str:
+    """Use the real otolith classifier when it loads, else register the stub; returns which."""
+    if service.model_registry.get('otolith') is not None:
+        return 'otolith_classifier'
+    path = os.path.join(root, 'otolith_stub.npy')
+    if not os.path.exists(path):
+        w, h = service.OTOLITH_SIZE
+        weights = np.random.default_rng(SEED + 4).normal(0, 1, ((w // 8) * (h // 8) * 3, len(service.SPECIES_LABELS)))
+        np.save(path, weights.astype(np.float32))
+    service.model_registry.register('otolith', path, _StubOtolithModel.load)
+    return 'stub'
+
+
+def _upload(client, path, payload, name='data.csv', **form):
+    data = {'file': (io.BytesIO(payload), name)}
+    data.update(form)
+    return client.post(path, data=data, content_type='multipart/form-data')
+
+
+def _models_available(*names):
+    return all(service.model_registry.get(name) is not None for name in names)
+
+
+def _cases(data):
+    """(name, required models, unit, run(client, n) -> response) for every endpoint.
+
+    `unit` is 'rows' or 'images'; image cases send one image per IMAGE_ROWS rows.
+    """
+    def dataset_query(client, n):
+        resp = _upload(client, '/api/datasets', data.csv('ocean', n), kind='ocean')
+        dataset_id = resp.get_json()['dataset_id']
+        try:
+            return client.get(f'/api/datasets/{dataset_id}/query',
+                              query_string={'bbox': '-95,25,-85,35', 'start': '2024-01-01', 'end': '2025-12-31'})
+        finally:
+            client.delete(f'/api/datasets/{dataset_id}')
+
+    def dataset_cube(client, n):
+        resp = _upload(client, '/api/datasets', data.csv('fisheries', n), kind='fisheries')
+        dataset_id = resp.get_json()['dataset_id']
+        try:
+            client.post('/upload_integration2', data={'dataset_id': dataset_id})  # builds the cube
+            return client.get(f'/api/datasets/{dataset_id}/cube', query_string={'by': 'species,year,region'})
+        finally:
+            client.delete(f'/api/datasets/{dataset_id}')
+
+    def ml_predict(client, n):
+        resp = _upload(client, '/upload_ml_analysis', data.csv('ocean', n), training='incremental',
+                       model_key='benchmark', reset='1', chart_mode='url')
+        signature = resp.get_json()['model']['signature']
+        return _upload(client, f'/api/ml_models/{signature}/predict', data.csv('ocean', n))
+
+    def predict_species(client, n):
+        """One request per image from SPECIES_CLIENTS threads, so the micro-batcher coalesces them."""
+        def post(item):
+            name, payload = item
+            resp = service.app.test_client().post('/api/predict_species', data={'image': (io.BytesIO(payload), name)},
+                                                  content_type='multipart/form-data')
+            resp.close()
+            return resp
+        with ThreadPoolExecutor(max_workers=SPECIES_CLIENTS) as pool:
+            responses = list(pool.map(post, data.images(n)))
+        return max(responses, key=lambda r: r.status_code)
+
+    def predict_species_batch(client, n):
+        return client.post('/api/predict_species_batch', data={
+            'archive': (io.BytesIO(data.image_archive(n)), 'otoliths.zip')}, content_type='multipart/form-data')
+
+    return [
+        ('oceanographic_data', (), 'rows', lambda c, n: _upload(c, '/api/oceanographic_data', data.csv('ocean', n))),
+        ('oceanographic_data_stream', (), 'rows', lambda c, n: _upload(c, '/api/oceanographic_data',
+                                                                        data.csv('ocean', n), stream='ndjson')),
+        ('fisheries_data', (), 'rows', lambda c, n: c.post('/api/fisheries_data', data={
+            'file': (io.BytesIO(data.csv('fisheries', n)), 'fisheries.csv'),
+            'ocean_file': (io.BytesIO(data.csv('ocean', n)), 'ocean.csv'),
+            'stream': 'ndjson'}, content_type='multipart/form-data')),
+        ('upload_integration1', (), 'rows', lambda c, n: _upload(c, '/upload_integration1', data.csv('ocean', n),
+                                                                  chart_format='columnar', downsample='auto')),
+        ('upload_integration1_qc', (), 'rows', lambda c, n: _upload(c, '/upload_integration1', data.csv('ocean', n),
+                                                                     chart_format='columnar', downsample='auto',
+                                                                     qc='1')),
+        ('upload_integration2', (), 'rows', lambda c, n: _upload(c, '/upload_integration2', data.csv('fisheries', n),
+                                                                  chart_format='columnar')),
+        ('upload_integration2_compact', (), 'rows', lambda c, n: _upload(
+            c, '/upload_integration2', data.csv('fisheries', n), chart_format='columnar', compact='1')),
+        ('upload_ml_analysis', (), 'rows', lambda c, n: _upload(c, '/upload_ml_analysis', data.csv('ocean', n))),
+        ('upload_ml_analysis_incremental', (), 'rows', lambda c, n: _upload(
+            c, '/upload_ml_analysis', data.csv('ocean', n), training='incremental', model_key='benchmark', reset='1')),
+        ('ml_model_predict', (), 'rows', ml_predict),
+        ('predict_fish', ('fish',), 'rows', lambda c, n: _upload(c, '/api/predict_fish', data.csv('ocean', n))),
+        ('predict_ocean', ('ocean',), 'rows', lambda c, n: _upload(c, '/api/predict_ocean', data.csv('ocean', n),
+                                                                    chart_format='columnar', downsample='auto')),
+        ('predict_species', ('otolith',), 'images', predict_species),
+        ('predict_species_batch', ('otolith',), 'images', predict_species_batch),
+        ('dataset_query', (), 'rows', dataset_query),
+        ('dataset_cube', (), 'rows', dataset_cube),
+    ]
+
+
+def _measure(call, unit, n, repeat, isolated):
+    """Time `repeat` runs of one case at size n in this process.
+
+    In a dedicated subprocess (`isolated`) the peak is the process's RSS high-water mark,
+    reset just before the first run; otherwise RSS is sampled on a thread. The delta is
+    taken against the RSS at the start.
+    """
+    client = service.app.test_client()
+    latencies, peaks, status = [], [], None
+    if isolated:
+        _reset_peak_rss()
+    start = service._rss_bytes()
+    for _ in range(repeat):
+        with contextlib.nullcontext() if isolated else _PeakRSS() as rss:
+            t0 = time.perf_counter()
+            resp = call(client, n)
+            resp.get_data()  # drain streamed bodies inside the timed region
+            latencies.append(time.perf_counter() - t0)
+        status = resp.status_code
+        resp.close()
+        if not isolated:
+            peaks.append(rss.peak)
+    peak = _peak_rss_bytes() if isolated else max(peaks)
+    latency = float(np.median(latencies))
+    items = n if unit == 'rows' else max(1, n // IMAGE_ROWS)
+    return {
+        'status': status,
+        'latency_s': round(latency, 4),
+        'latency_min_s': round(min(latencies), 4),
+        f'{unit}_per_sec': round(items / latency, 1) if latency > 0 else None,
+        'peak_rss_delta_bytes': int(max(0, peak - start)),
+        'peak_rss_bytes': int(peak),
+    }
+
+
+def _import_service(data_dir):
+    """Import app with its dataset store and model directory under `data_dir`, so a run
+    leaves nothing in the working tree, and wait for its preloaded models."""
+    global service
+    os.environ.setdefault('DATASET_DIR', os.path.join(data_dir, 'datasets'))
+    os.environ.setdefault('ML_MODEL_DIR', os.path.join(data_dir, 'ml_models'))
+    import app
+    service = app
+    service.create_app()
+
+
+def _run_isolated(name, n, repeat, data_dir):
+    """Run one case at size n in a fresh interpreter and return its result dict."""
+    proc = subprocess.run([sys.executable, os.path.abspath(__file__), '--worker', name, '--sizes', str(n),
+                           '--repeat', str(repeat), '--data-dir', data_dir],
+                          stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    lines = proc.stdout.strip().splitlines()
+    if proc.returncode != 0 or not lines:
+        return {'error': (proc.stderr.strip().splitlines() or [f'exit code {proc.returncode}'])[-1]}
+    return json.loads(lines[-1])
+
+
+def _worker(name, n, repeat, data_dir):
+    """--worker: run one case in this process and print its result as the last line of stdout."""
+    data = _Data(data_dir)
+    _species_model(data_dir)
+    for case, models, unit, call in _cases(data):
+        if case == name:
+            print(json.dumps(_measure(call, unit, n, repeat, isolated=True)))
+            return 0
+    print(f'Unknown benchmark {name!r}', file=sys.stderr)
+    return 2
+
+
+def run(sizes, repeat, only=None, data_dir=None, isolated=True):
+    data = _Data(data_dir)
+    species_model = _species_model(data_dir)
+    results = {}
+    for name, models, unit, call in _cases(data):
+        if only and name not in only:
+            continue
+        if models and not _models_available(*models):
+            results[name] = {'skipped': f"model(s) {', '.join(models)} not available"}
+            print(f'{name:32s} skipped (no model)')
+            continue
+        results[name] = {}
+        for n in sizes:
+            data.prepare(n, images=unit == 'images')  # generate outside the timed region
+            if isolated and resource is not None:
+                result = _run_isolated(name, n, repeat, data_dir)
+            else:
+                result = _measure(call, unit, n, repeat, isolated=False)
+            if unit == 'images':
+                result['model'] = species_model
+            results[name][str(n)] = result
+            if 'error' in result:
+                print(f'{name:32s} n={n:<9d} failed: {result["error"]}')
+                continue
+            print(f'{name:32s} n={n:<9d} status={result["status"]} latency={result["latency_s"]:8.3f}s '
+                  f'{unit}/s={result[f"{unit}_per_sec"] or 0:12.0f} '
+                  f'peak_rss={result["peak_rss_bytes"] / 2**20:8.1f}MiB (+{result["peak_rss_delta_bytes"] / 2**20:.1f})')
+    return results
+
+
+def compare(results, baseline, latency_tol, memory_tol):
+    """Regressions against the baseline: latency or peak memory above (1 + tolerance) x baseline."""
+    regressions = []
+    for name, by_size in results.items():
+        for size, cur in by_size.items():
+            base = baseline.get('results', {}).get(name, {}).get(size)
+            if not isinstance(cur, dict) or not isinstance(base, dict) or 'latency_s' not in base or 'latency_s' not in cur:
+                continue
+            if cur['status'] >= 400 > base['status']:
+                regressions.append(f"{name} n={size}: status {base['status']} -> {cur['status']}")
+            if cur['latency_s'] > base['latency_s'] * (1 + latency_tol):
+                regressions.append(f"{name} n={size}: latency {base['latency_s']:.3f}s -> {cur['latency_s']:.3f}s")
+            # Ignore memory noise below 8 MiB.
+            if cur['peak_rss_delta_bytes'] > max(base['peak_rss_delta_bytes'] * (1 + memory_tol), 8 * 2**20):
+                regressions.append(f"{name} n={size}: peak RSS +{base['peak_rss_delta_bytes'] / 2**20:.1f}MiB"
+                                   f" -> +{cur['peak_rss_delta_bytes'] / 2**20:.1f}MiB")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', default=DEFAULT_SIZES, help='comma-separated row counts, e.g. 1e3,1e5')
+    parser.add_argument('--repeat', type=int, default=3, help='runs per endpoint and size (median is reported)')
+    parser.add_argument('--only', help='comma-separated benchmark names to run')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE, help='baseline JSON to compare against or write')
+    parser.add_argument('--save', action='store_true', help='write the results as the new baseline')
+    parser.add_argument('--output', help='also write this run to a JSON file')
+    parser.add_argument('--latency-tolerance', type=float, default=0.2)
+    parser.add_argument('--memory-tolerance', type=float, default=0.25)
+    parser.add_argument('--data-dir', help='where payloads are generated and kept (default: a temp dir, removed after)')
+    parser.add_argument('--in-process', action='store_true',
+                        help='run every case in this process (faster; peak memory is sampled, not exact)')
+    parser.add_argument('--worker', help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    sizes = [int(float(s)) for s in args.sizes.split(',') if s]
+    data_dir = args.data_dir or tempfile.mkdtemp(prefix='benchmark-')
+    os.makedirs(data_dir, exist_ok=True)
+    _import_service(data_dir)
+    if args.worker:
+        return _worker(args.worker, sizes[0], args.repeat, data_dir)
+    only = set(args.only.split(',')) if args.only else None
+    try:
+        results = run(sizes, args.repeat, only, data_dir, isolated=not args.in_process)
+    finally:
+        if not args.data_dir:
+            shutil.rmtree(data_dir, ignore_errors=True)
+    report = {
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'seed': SEED,
+        'sizes': sizes,
+        'repeat': args.repeat,
+        'environment': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            'numpy': np.__version__,
+            'pandas': pd.__version__,
+        },
+        'isolated': not args.in_process and resource is not None,
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    if args.save:
+        with open(args.baseline, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f'Baseline written to {args.baseline}')
+        return 0
+    if not os.path.exists(args.baseline):
+        print(f'No baseline at {args.baseline}; run with --save to create one.')
+        return 0
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    regressions = compare(report['results'], baseline, args.latency_tolerance, args.memory_tolerance)
+    for line in regressions:
+        print(f'REGRESSION {line}')
+    print(f'{len(regressions)} regression(s) against {args.baseline}')
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
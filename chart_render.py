@@ -0,0 +1,49 @@
+"""Matplotlib chart renderers run in the chart worker processes.
+
+Kept apart from app.py so the fork server preloads only this module and its
+plotting imports: workers never import the app, its config or its models.
+Every function takes plain arrays/frames and returns PNG bytes.
+"""
+import io
+
+import pandas as pd
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+import seaborn as sns
+
+
+def png_bytes(fig) -> bytes:
+    buf = io.BytesIO()
+    fig.savefig(buf, format='png', bbox_inches='tight')
+    plt.close(fig)
+    return buf.getvalue()
+
+
+def plot_temperature_time(dates, temps) -> bytes:
+    fig, ax = plt.subplots(figsize=(7, 4))
+    ax.plot(dates, temps, color='#1f77b4')
+    ax.set_title('Temperature over Time')
+    ax.set_xlabel('Date')
+    ax.set_ylabel('Temperature')
+    fig.autofmt_xdate()
+    return png_bytes(fig)
+
+
+def plot_correlation(corr: pd.DataFrame) -> bytes:
+    fig, ax = plt.subplots(figsize=(6, 5))
+    sns.heatmap(corr, annot=True, cmap='coolwarm', ax=ax, fmt='.2f')
+    ax.set_title('Correlation Heatmap')
+    return png_bytes(fig)
+
+
+def plot_predicted_vs_actual(y_test, y_pred) -> bytes:
+    fig, ax = plt.subplots(figsize=(6, 5))
+    ax.scatter(y_test, y_pred, alpha=0.7, color='#2ca02c')
+    min_val = float(min(y_test.min(), y_pred.min()))
+    max_val = float(max(y_test.max(), y_pred.max()))
+    ax.plot([min_val, max_val], [min_val, max_val], 'r--')
+    ax.set_xlabel('Actual Chlorophyll')
+    ax.set_ylabel('Predicted Chlorophyll')
+    ax.set_title('Predicted vs Actual')
+    return png_bytes(fig)
@@ -0,0 +1,16 @@
+import os
+import shutil
+import sys
+import tempfile
+
+# app reads its storage directories at import time; keep test runs out of the working tree.
+_SCRATCH = tempfile.mkdtemp(prefix='app-tests-')
+os.environ.setdefault('DATASET_DIR', os.path.join(_SCRATCH, 'datasets'))
+os.environ.setdefault('ML_MODEL_DIR', os.path.join(_SCRATCH, 'ml_models'))
+os.environ.setdefault('RESULT_CACHE_MAX_MB', '0')
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def pytest_sessionfinish(session, exitstatus):
+    shutil.rmtree(_SCRATCH, ignore_errors=True)
@@ -0,0 +1,101 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import app
+
+
+@pytest.fixture(scope='module')
+def hauls():
+    df = app._normalize_fisheries_columns(app.generate_dummy_fisheries_data(2000, seed=11))
+    df['date'] = pd.to_datetime(df['date'])
+    df.loc[::97, 'species_scientific'] = None
+    df.loc[::89, 'avg_length_mm'] = np.nan
+    df.loc[::83, 'count'] = np.nan
+    df.loc[::71, 'date'] = pd.NaT
+    return df
+
+
+@pytest.fixture(scope='module')
+def cube(hauls):
+    cube = app._FisheriesCube()
+    for start in range(0, len(hauls), 300):
+        cube.update(hauls.iloc[start:start + 300])
+    return cube
+
+
+def _expected(hauls, by):
+    """The roll-up computed directly from the rows with a pandas groupby."""
+    frame = hauls.assign(
+        year=hauls['date'].dt.year.astype('Int64'),
+        region_lat=np.floor(np.floor(hauls['lat'] / app.CUBE_CELL_DEG) * app.CUBE_CELL_DEG / app.CUBE_REGION_DEG)
+        * app.CUBE_REGION_DEG,
+        region_lon=np.floor(np.floor(hauls['lon'] / app.CUBE_CELL_DEG) * app.CUBE_CELL_DEG / app.CUBE_REGION_DEG)
+        * app.CUBE_REGION_DEG)
+    keys = [k for name in by for k in app._CUBE_ROLLUPS[name]]
+    grouped = frame.groupby(keys, dropna=False, sort=True)
+    return pd.DataFrame({
+        'rows': grouped.size(),
+        'count': grouped['count'].sum(),
+        'mean_length_mm': grouped['avg_length_mm'].mean(),
+    }).reset_index()
+
+
+def _comparable(frame, keys):
+    frame = frame.copy()
+    for k in keys:
+        frame[k] = frame[k].astype(object).where(frame[k].notna(), None)
+    return frame.sort_values(keys, key=lambda s: s.astype(str)).reset_index(drop=True)
+
+
+@pytest.mark.parametrize('by', [['species'], ['species', 'year'], ['life_stage', 'region'], ['year']])
+def test_rollup_matches_a_groupby_of_the_rows(hauls, cube, by):
+    keys = [k for name in by for k in app._CUBE_ROLLUPS[name]]
+    got = _comparable(cube.rollup(by), keys)
+    want = _comparable(_expected(hauls, by), keys)
+
+    assert got[keys].values.tolist() == want[keys].values.tolist()
+    np.testing.assert_array_equal(got['rows'].to_numpy(), want['rows'].to_numpy())
+    np.testing.assert_allclose(got['count'].to_numpy(dtype=float), want['count'].to_numpy(dtype=float))
+    np.testing.assert_allclose(got['mean_length_mm'].to_numpy(dtype=float),
+                               want['mean_length_mm'].to_numpy(dtype=float), equal_nan=True)
+
+
+def test_rollup_filters_and_totals(hauls, cube):
+    species = 'Sardina pilchardus'
+    got = cube.rollup(['life_stage'], species=species)
+    want = hauls[hauls['species_scientific'] == species].groupby('life_stage')['count'].sum()
+    assert got.set_index('life_stage')['count'].to_dict() == pytest.approx(want.to_dict())
+
+    total = cube.rollup([])
+    assert int(total['rows'].iloc[0]) == len(hauls)
+    assert float(total['count'].iloc[0]) == pytest.approx(hauls['count'].sum())
+    assert float(total['mean_length_mm'].iloc[0]) == pytest.approx(hauls['avg_length_mm'].mean())
+
+
+def test_save_and_load_round_trip(cube, tmp_path):
+    paths = str(tmp_path / 'cube.arrow'), str(tmp_path / 'cube_lengths.arrow')
+    cube.segments = 3
+    cube.save(*paths)
+    assert sorted(p.name for p in tmp_path.iterdir()) == ['cube.arrow', 'cube_lengths.arrow']
+
+    loaded = app._FisheriesCube.load(*paths)
+    assert loaded.segments == 3
+    pd.testing.assert_frame_equal(loaded.rollup(['species', 'year']), cube.rollup(['species', 'year']))
+    assert loaded.dashboard()['summary'] == cube.dashboard()['summary']
+
+
+def test_load_rejects_a_torn_pair(cube, tmp_path):
+    paths = str(tmp_path / 'cube.arrow'), str(tmp_path / 'cube_lengths.arrow')
+    cube.segments = 1
+    cube.save(*paths)
+    groups = paths[0] + '.keep'
+    (tmp_path / 'cube.arrow').rename(groups)
+    cube.segments = 2
+    cube.save(*paths)
+    (tmp_path / 'cube.arrow.keep').replace(paths[0])  # groups from the first save, lengths from the second
+    assert app._FisheriesCube.load(*paths) is None
+
+    (tmp_path / 'cube_lengths.arrow').write_bytes(b'not arrow')
+    assert app._FisheriesCube.load(*paths) is None
+    assert app._FisheriesCube.load(str(tmp_path / 'missing.arrow'), paths[1]) is None
@@ -0,0 +1,83 @@
+import io
+
+import pyarrow as pa
+from werkzeug.datastructures import FileStorage
+
+import app
+
+
+def _upload(text, name='casts.csv'):
+    return FileStorage(stream=io.BytesIO(text.encode()), filename=name)
+
+
+def _casts_csv(rows, notes=None):
+    """CSV of `rows` ocean casts; `notes`, if given, maps a row number to its notes text."""
+    lines = ['sample_id,date,lat,lon,temperature_C' + (',notes' if notes is not None else '')]
+    for i in range(rows):
+        line = f's{i},2024-01-{i % 28 + 1:02d},{i % 90}.5,{i % 180}.25,{10 + i % 7}.0'
+        if notes is not None:
+            line += ',' + notes.get(i, '')
+        lines.append(line)
+    return '\n'.join(lines) + '\n'
+
+
+def test_widen_schema_turns_disagreeing_fields_into_strings():
+    schema = pa.schema([('a', pa.float64()), ('b', pa.string()), ('c', pa.timestamp('ns')), ('d', pa.float64())],
+                       metadata={b'k': b'v'})
+    other = pa.schema([('a', pa.string()), ('b', pa.string()), ('c', pa.float64())])
+
+    wider = app._widen_schema(schema, other)
+    assert wider.names == ['a', 'b', 'c', 'd']
+    assert wider.field('a').type == pa.string()
+    assert wider.field('b').type == pa.string()
+    assert wider.field('c').type == pa.large_string()
+    assert wider.field('d').type == pa.float64()  # missing from `other`
+    assert wider.metadata == {b'k': b'v'}
+    assert app._widen_schema(schema, schema).equals(schema)
+
+
+def test_store_widens_a_column_that_turns_to_text_in_a_later_chunk(tmp_path, monkeypatch):
+    monkeypatch.setattr(app, 'INGEST_CHUNK_ROWS', 50)
+    store = app._DatasetStore(str(tmp_path))
+
+    meta = store.store(_upload(_casts_csv(120, notes={110: 'net torn'})), 'ocean')
+    assert meta['rows'] == 120 and meta['segments'] == 1
+
+    table = store.read_table(meta['dataset_id'])
+    assert table.num_rows == 120
+    assert pa.types.is_string(table.schema.field('notes').type) or pa.types.is_large_string(table.schema.field('notes').type)
+    notes = table.column('notes').to_pylist()
+    assert notes[110] == 'net torn' and notes[0] is None
+    assert table.column('temperature_C').to_pylist()[:3] == [10.0, 11.0, 12.0]
+    assert not [p for p in tmp_path.iterdir() if '.tmp' in p.name]
+
+
+def test_read_table_casts_appended_segments_to_a_common_schema(tmp_path):
+    store = app._DatasetStore(str(tmp_path))
+    meta = store.store(_upload(_casts_csv(30, notes={})), 'ocean')
+    dataset_id = meta['dataset_id']
+    assert pa.types.is_floating(store.read_table(dataset_id).schema.field('notes').type)
+
+    # The first segment stored `notes` as an empty float column; this one carries text.
+    meta = store.append(dataset_id, _upload(_casts_csv(20, notes={3: 'calm sea'})))
+    assert meta['rows'] == 50 and meta['segments'] == 2
+
+    table = store.read_table(dataset_id)
+    assert table.num_rows == 50
+    notes = table.column('notes')
+    assert pa.types.is_string(notes.type) or pa.types.is_large_string(notes.type)
+    assert notes.to_pylist()[33] == 'calm sea'
+    assert notes.null_count == 49
+
+    part = store.read_table(dataset_id, columns=['sample_id', 'temperature_C'])
+    assert part.column_names == ['sample_id', 'temperature_C'] and part.num_rows == 50
+    assert sum(len(c) for c in store.iter_chunks(dataset_id, chunksize=7)) == 50
+
+
+def test_append_and_delete_of_a_missing_dataset(tmp_path):
+    store = app._DatasetStore(str(tmp_path))
+    meta = store.store(_upload(_casts_csv(5)), 'ocean')
+    store.delete(meta['dataset_id'])
+    assert list(tmp_path.iterdir()) == []
+    assert store.append(meta['dataset_id'], _upload(_casts_csv(5))) is None
+
@@ -0,0 +1,75 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import app
+
+
+def _options(max_points, grid_bins=200, mode='auto'):
+    return {'mode': mode, 'max_points': max_points, 'grid_bins': grid_bins}
+
+
+@pytest.mark.parametrize('n, n_out', [(1000, 50), (101, 3), (10, 9), (7, 7), (5, 100), (5, 2)])
+def test_lttb_keeps_both_endpoints_and_returns_sorted_unique_indices(n, n_out):
+    x = np.arange(n, dtype=float)
+    y = np.sin(x / 7.0)
+    keep = app._lttb_indices(x, y, n_out)
+    if n_out >= n or n_out < 3:
+        np.testing.assert_array_equal(keep, np.arange(n))
+        return
+    assert len(keep) == n_out
+    assert keep[0] == 0 and keep[-1] == n - 1
+    assert np.all(np.diff(keep) > 0)
+
+
+def test_lttb_keeps_an_isolated_spike():
+    y = np.zeros(1000)
+    y[537] = 10.0
+    keep = app._lttb_indices(np.arange(1000, dtype=float), y, 20)
+    assert 537 in keep
+
+
+def test_downsample_series_keeps_the_first_and_last_dates():
+    dates = pd.date_range('2024-01-01', periods=5000, freq='h')
+    frame = pd.DataFrame({'date': dates, 'temp': np.random.default_rng(1).normal(size=5000)})
+    frame.loc[10, 'temp'] = np.nan
+
+    out = app._downsample_series(frame, 'date', 'temp', _options(100))
+    assert len(out) == 100
+    assert out['date'].iloc[0] == dates[0] and out['date'].iloc[-1] == dates[-1]
+    assert out['temp'].notna().all()
+
+    assert app._downsample_series(frame, 'date', 'temp', _options(100, mode='none')) is frame
+    assert app._downsample_series(frame, 'date', 'temp', _options(10000)) is frame
+
+
+def test_bin_points_puts_the_maximum_in_the_last_cell():
+    frame = pd.DataFrame({
+        'x': [0.0, 0.0, 10.0, 10.0, 5.0],
+        'y': [0.0, 0.0, 10.0, 0.0, 5.0],
+        'v': [1.0, 3.0, 5.0, np.nan, 7.0],
+    })
+    cells = app._bin_points(frame, 'x', 'y', 'v', _options(4))  # 2 x 2 grid of 5-unit cells
+    cells = cells.sort_values(['x', 'y']).reset_index(drop=True)
+    assert cells[['x', 'y']].values.tolist() == [[2.5, 2.5], [7.5, 2.5], [7.5, 7.5]]
+    assert cells['n'].tolist() == [2, 1, 2]
+    assert cells['v'].iloc[0] == 2.0 and np.isnan(cells['v'].iloc[1]) and cells['v'].iloc[2] == 6.0
+
+
+def test_bin_points_bounds_cells_and_keeps_every_finite_point():
+    rng = np.random.default_rng(3)
+    frame = pd.DataFrame({'x': rng.normal(size=20000), 'y': rng.normal(size=20000), 'v': rng.normal(size=20000)})
+    frame.loc[:9, 'x'] = np.nan
+    cells = app._bin_points(frame, 'x', 'y', 'v', _options(400, grid_bins=200))
+    assert len(cells) <= 400
+    assert cells['n'].sum() == 20000 - 10
+    assert cells['x'].between(frame['x'].min(), frame['x'].max()).all()
+    np.testing.assert_allclose((cells['v'] * cells['n']).sum(), frame['v'][frame['x'].notna()].sum())
+
+
+def test_bin_points_handles_a_degenerate_axis_and_small_frames():
+    frame = pd.DataFrame({'x': np.ones(50), 'y': np.arange(50.0), 'v': np.arange(50.0)})
+    cells = app._bin_points(frame, 'x', 'y', 'v', _options(9))
+    assert cells['n'].sum() == 50 and (cells['x'] == 1.5).all()
+    assert app._bin_points(frame, 'x', 'y', 'v', _options(50)) is None
+    assert app._bin_points(frame, 'x', 'y', 'v', _options(9, mode='none')) is None
@@ -0,0 +1,115 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import app
+
+KM_PER_DEG = np.pi * app.EARTH_RADIUS_KM / 180
+
+
+def _casts(rows):
+    """Ocean casts from (sample_id, lat, lon, date, temperature_C) tuples."""
+    return app._normalize_ocean_columns(
+        pd.DataFrame(rows, columns=['sample_id', 'lat', 'lon', 'date', 'temperature_C']))
+
+
+def _hauls(rows):
+    """Fisheries hauls from (lat, lon, date) tuples."""
+    df = pd.DataFrame(rows, columns=['lat', 'lon', 'date'])
+    df['date'] = pd.to_datetime(df['date'])
+    return df
+
+
+def _ids(out):
+    return [None if pd.isna(v) else v for v in out['ocean_sample_id']]
+
+
+def test_time_tolerance_prefers_a_farther_cast_inside_the_window():
+    hauls = _hauls([(10.0, 20.0, '2024-01-10')])
+    casts = _casts([
+        ('near_late', 10.0 + 1 / KM_PER_DEG, 20.0, '2024-01-15', 1.0),   # 1 km, 120 h away
+        ('far_ontime', 10.0 + 10 / KM_PER_DEG, 20.0, '2024-01-11', 2.0),  # 10 km, 24 h away
+    ])
+
+    out, stats = app._spatiotemporal_join(hauls, casts, max_km=50, max_hours=72)
+    assert _ids(out) == ['far_ontime']
+    assert out['temperature_C'].tolist() == [2.0]
+    assert out['join_distance_km'].iloc[0] == pytest.approx(10.0, rel=1e-6)
+    assert out['join_time_diff_h'].iloc[0] == pytest.approx(24.0)
+    assert stats['matched'] == 1
+
+    out, _ = app._spatiotemporal_join(hauls, casts, max_km=50, max_hours=200)
+    assert _ids(out) == ['near_late']
+
+    # max_hours <= 0 joins on distance only.
+    out, _ = app._spatiotemporal_join(hauls, casts, max_km=50, max_hours=0)
+    assert _ids(out) == ['near_late']
+
+
+def test_distance_tolerance_leaves_distant_hauls_unmatched():
+    hauls = _hauls([(10.0, 20.0, '2024-01-10'), (np.nan, 20.0, '2024-01-10')])
+    casts = _casts([('c60', 10.0 + 60 / KM_PER_DEG, 20.0, '2024-01-10', 5.0)])
+
+    out, stats = app._spatiotemporal_join(hauls, casts, max_km=50, max_hours=72)
+    assert _ids(out) == [None, None]
+    assert out['temperature_C'].isna().all()
+    assert stats['hauls'] == 2 and stats['hauls_joinable'] == 1 and stats['matched'] == 0
+
+    out, stats = app._spatiotemporal_join(hauls, casts, max_km=100, max_hours=72)
+    assert _ids(out) == ['c60', None]
+    assert out['join_distance_km'].iloc[0] == pytest.approx(60.0, rel=1e-6)
+    assert stats['coverage_pct'] == 50.0
+
+
+def test_radius_fallback_finds_a_match_beyond_the_k_nearest():
+    # With k=1 the nearest cast is outside the time window; the second one is not.
+    hauls = _hauls([(0.0, 0.0, '2024-03-01')])
+    casts = _casts([
+        ('nearest', 0.0, 1 / KM_PER_DEG, '2024-02-01', 1.0),
+        ('second', 0.0, 5 / KM_PER_DEG, '2024-03-01', 2.0),
+    ])
+    out, _ = app._spatiotemporal_join(hauls, casts, max_km=20, max_hours=24, k=1)
+    assert _ids(out) == ['second']
+    assert out['join_distance_km'].iloc[0] == pytest.approx(5.0, rel=1e-6)
+
+
+def test_no_ocean_data_leaves_every_haul_unmatched():
+    hauls = _hauls([(0.0, 0.0, '2024-03-01')])
+    out, stats = app._spatiotemporal_join(hauls, None)
+    assert _ids(out) == [None]
+    assert stats['ocean_samples'] == 0 and stats['matched'] == 0
+
+
+@pytest.mark.parametrize('k', [1, 2, app.JOIN_NEIGHBOURS])
+def test_join_matches_brute_force(k):
+    rng = np.random.default_rng(7)
+    start = np.datetime64('2024-01-01T00:00')
+    n_hauls, n_casts = 300, 400
+    hauls = pd.DataFrame({
+        'lat': rng.uniform(0, 2, n_hauls),
+        'lon': rng.uniform(0, 2, n_hauls),
+        'date': start + rng.integers(0, 30 * 24 * 60, n_hauls).astype('timedelta64[m]'),
+    })
+    casts = _casts(pd.DataFrame({
+        'sample_id': [f'c{i}' for i in range(n_casts)],
+        'lat': rng.uniform(0, 2, n_casts),
+        'lon': rng.uniform(0, 2, n_casts),
+        'date': start + rng.integers(0, 30 * 24 * 60, n_casts).astype('timedelta64[m]'),
+        'temperature_C': rng.normal(15, 3, n_casts),
+    }).itertuples(index=False))
+    max_km, max_hours = 30.0, 48.0
+
+    out, _ = app._spatiotemporal_join(hauls, casts, max_km=max_km, max_hours=max_hours, k=k)
+
+    d = app._haversine_km(hauls['lat'].to_numpy()[:, None], hauls['lon'].to_numpy()[:, None],
+                          casts['lat'].to_numpy()[None, :], casts['lon'].to_numpy()[None, :])
+    dt = np.abs(hauls['date'].to_numpy()[:, None] - pd.to_datetime(casts['date']).to_numpy()[None, :])
+    ok = (d <= max_km) & (dt <= np.timedelta64(int(max_hours * 3600), 's'))
+    masked = np.where(ok, d, np.inf)
+    best = masked.argmin(axis=1)
+    expected = np.where(ok.any(axis=1), casts['sample_id'].to_numpy(dtype=object)[best], None)
+
+    assert _ids(out) == expected.tolist()
+    hit = ok.any(axis=1)
+    assert hit.any() and not hit.all()
+    np.testing.assert_allclose(out['join_distance_km'].to_numpy()[hit], masked.min(axis=1)[hit], rtol=1e-6)
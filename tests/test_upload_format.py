@@ -0,0 +1,80 @@
+import gzip
+import io
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.feather as feather
+import pyarrow.parquet as pq
+import pytest
+from werkzeug.datastructures import FileStorage
+
+import app
+
+CSV = b'sample_id,date,lat,lon,temperature_C\ns1,2024-01-01,10.5,20.25,14.0\ns2,2024-01-02,11.5,21.25,15.0\n'
+
+
+def _upload(data, name='upload.bin'):
+    return FileStorage(stream=io.BytesIO(data), filename=name)
+
+
+def _table():
+    return pa.Table.from_pandas(pd.read_csv(io.BytesIO(CSV)), preserve_index=False)
+
+
+def _parquet():
+    buf = io.BytesIO()
+    pq.write_table(_table(), buf)
+    return buf.getvalue()
+
+
+def _feather():
+    buf = io.BytesIO()
+    feather.write_feather(_table(), buf)
+    return buf.getvalue()
+
+
+def _arrow_stream():
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, _table().schema) as writer:
+        writer.write_table(_table())
+    return sink.getvalue().to_pybytes()
+
+
+@pytest.mark.parametrize('data, name, expected', [
+    (_parquet(), 'casts.parquet', 'parquet'),
+    (_feather(), 'casts.feather', 'feather'),
+    (b'FEA1' + b'\x00' * 16, 'casts.feather', 'feather_v1'),
+    (_arrow_stream(), 'casts.arrows', 'arrow_stream'),
+    (gzip.compress(CSV), 'casts.csv.gz', 'csv.gz'),
+    (b'\x28\xb5\x2f\xfd' + b'\x00' * 16, 'casts.csv.zst', 'csv.zst'),
+    (b'PK\x03\x04' + b'\x00' * 16, 'casts.xlsx', 'excel'),
+    (b'\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1' + b'\x00' * 16, 'casts.xls', None),
+    (CSV, 'casts.txt', 'csv'),
+    (CSV, '', 'csv'),
+    (b'\x00\x01binary' * 8, 'casts.csv', None),
+    (b'', 'casts.CSV', 'csv'),
+    (b'', 'casts.parquet', None),
+])
+def test_upload_format_sniffs_the_leading_bytes(data, name, expected):
+    assert app._upload_format(_upload(data, name)) == expected
+
+
+def test_upload_format_rewinds_the_stream():
+    upload = _upload(_parquet())
+    assert app._upload_format(upload) == 'parquet'
+    assert upload.stream.tell() == 0
+    assert upload.stream.read(4) == b'PAR1'
+
+
+@pytest.mark.parametrize('data', [_parquet(), _feather(), _arrow_stream(), gzip.compress(CSV), CSV])
+def test_sniffed_uploads_parse_to_the_same_rows(data):
+    chunks = list(app._iter_upload_chunks(_upload(data), app._normalize_ocean_columns))
+    frame = pd.concat(chunks, ignore_index=True)
+    assert frame['sample_id'].tolist() == ['s1', 's2']
+    assert frame['temperature_C'].tolist() == [14.0, 15.0]
+
+
+@pytest.mark.parametrize('data', [_parquet()[:-12], b'PK\x03\x04' + b'\x00' * 64])
+def test_truncated_binary_uploads_raise_a_parse_error(data):
+    with pytest.raises(app._UploadParseError):
+        list(app._iter_upload_chunks(_upload(data)))